@@ -0,0 +1,62 @@
+import argparse
+
+from app.log_analytics import (
+    LOG_INDEX_DB, connect, ingest_logs, review_rate_by_issuer, top_flags,
+    date_validation_summary, daily_volume,
+)
+from app.logging_utils import LOG_FILE
+
+
+def _print_table(headers, rows):
+    widths = [len(h) for h in headers]
+    for row in rows:
+        widths = [max(w, len(str(v))) for w, v in zip(widths, row)]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in rows:
+        print("  ".join(str(v).ljust(w) for v, w in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Index and query extraction logs')
+    parser.add_argument('--db', default=LOG_INDEX_DB, help='Path to the SQLite log index')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_ingest = sub.add_parser('ingest', help='Load new log lines into the index')
+    p_ingest.add_argument('--log', default=LOG_FILE, help='Path to extraction_logs.json')
+
+    for name, help_text in [
+        ('review-rate', 'Manual-review rate per issuer'),
+        ('flags', 'Most common confidence flags'),
+        ('dates', 'Date validation outcomes'),
+        ('daily', 'Documents and reviews per day'),
+    ]:
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument('--since', help="Lower bound: '7d', '24h' or an ISO date")
+        p.add_argument('--limit', type=int, default=20)
+
+    args = parser.parse_args()
+
+    if args.command == 'ingest':
+        loaded = ingest_logs(args.log, args.db)
+        print(f"📥 Indexed {loaded} new log entries into {args.db}")
+        return
+
+    conn = connect(args.db)
+    try:
+        if args.command == 'review-rate':
+            _print_table(['issuer', 'docs', 'reviews', 'rate'],
+                         review_rate_by_issuer(conn, args.since, args.limit))
+        elif args.command == 'flags':
+            _print_table(['flag', 'count'], top_flags(conn, args.since, args.limit))
+        elif args.command == 'dates':
+            _print_table(['expiry_status', 'dates_consistent', 'count'],
+                         date_validation_summary(conn, args.since))
+        elif args.command == 'daily':
+            _print_table(['day', 'docs', 'reviews'], daily_volume(conn, args.since))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,18 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, g, stream_with_context
+from werkzeug.utils import secure_filename
 import os
+import json
 import shutil
 from datetime import datetime
 from batch_processor import process_single_file
 from app.rag_pipeline import CertificateRAG
+from app import issuer_index
+from app.deadline import Deadline, DeadlineExceeded
+from app.metrics import registry, span
+from app.rate_limiter import get_rate_limiter
+from app.profiling import start_request_profile, PROFILE_HEADER
+from app.security import MAX_QUERY_BATCH, MAX_UPLOAD_BATCH_FILES, MAX_BATCH_CONCURRENCY
+from app.intake import run_bounded
 
 # Configure Flask to look for frontend in sibling directory
 app = Flask(__name__, 
@@ -22,6 +31,37 @@ except Exception as e:
 UPLOAD_FOLDER = os.path.join('data', 'uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Opt-in per-request profiling (PROFILE_REQUESTS / PROFILE_SAMPLE_RATE / X-Profile header)
+PROFILED_ENDPOINTS = ('upload_file', 'upload_batch', 'query_rag', 'query_batch')
+
+@app.before_request
+def start_profile():
+    if request.endpoint in PROFILED_ENDPOINTS:
+        g.profile = start_request_profile(request.endpoint, request.headers.get(PROFILE_HEADER))
+
+def _profile_stream(body, profile):
+    # Streamed bodies (/upload/batch) do their work after after_request; stop once the stream ends
+    try:
+        yield from body
+    finally:
+        profile.finish()
+
+@app.after_request
+def finish_profile(response):
+    profile = g.pop('profile', None)
+    if profile and response.is_streamed:
+        response.response = _profile_stream(response.response, profile)
+    elif profile:
+        response.headers['X-Profile-Report'] = os.path.basename(profile.finish())
+    return response
+
+@app.teardown_request
+def discard_profile(error=None):
+    # Requests that raised never reach after_request; still stop the sampler and keep the report
+    profile = g.pop('profile', None)
+    if profile:
+        profile.finish()
+
 @app.route('/')
 def home():
     return render_template('index.html')
@@ -41,22 +81,115 @@ def upload_file():
             filepath = os.path.join(UPLOAD_FOLDER, filename)
             file.save(filepath)
             
+            # One budget for the whole request (UPLOAD_DEADLINE_SECONDS), shared by every stage
+            deadline = Deadline()
+
             # 1. Extraction & Validation (The "Brain")
-            result = process_single_file(filepath)
+            with span('pipeline_total'):
+                result = process_single_file(filepath, deadline=deadline)
             
             if not result:
                  return jsonify({'success': False, 'error': 'Document processing failed or not a certificate.'}), 400
+            result = result.to_dict()
 
             # 2. RAG Ingestion (The "Memory")
             # 2. RAG Ingestion (The "Memory")
+            warning = None
             if rag:
-                rag.ingest_certificate(result)
+                try:
+                    rag.ingest_certificate(result, deadline=deadline)
+                except DeadlineExceeded as e:
+                    print(f"⏱️  {e}. Skipping RAG ingestion.")
+                    warning = 'Not added to the search index: upload deadline exceeded.'
+
+            # Issuer -> certificate index, so trusted-list edits can re-verify just the affected ones
+            conn = issuer_index.connect()
+            try:
+                issuer_index.record_certificates(conn, [result])
+            finally:
+                conn.close()
             
+            if warning:
+                return jsonify({'success': True, 'data': result, 'warning': warning})
             return jsonify({'success': True, 'data': result})
             
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
 
+def _sse(event, data):
+    """One Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _process_with_deadline(filepath):
+    # Each file gets the same per-upload budget as /upload
+    with span('pipeline_total'):
+        return process_single_file(filepath, deadline=Deadline())
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    """
+    Process many files from one multipart request ('files' parts) concurrently.
+    Progress streams back as Server-Sent Events: 'start', one 'progress' per file
+    (in completion order), 'ingested' after the bulk RAG write, then 'done'.
+    """
+    files = [f for f in request.files.getlist('files') if f and f.filename]
+    if not files:
+        return jsonify({'error': 'No files'}), 400
+    if len(files) > MAX_UPLOAD_BATCH_FILES:
+        return jsonify({'error': f'At most {MAX_UPLOAD_BATCH_FILES} files per batch'}), 400
+
+    # Save everything while the request body is still available
+    filepaths = []
+    for file in files:
+        filepath = os.path.join(UPLOAD_FOLDER, secure_filename(file.filename) or 'upload')
+        stem, ext = os.path.splitext(filepath)
+        n = 1
+        while filepath in filepaths:  # Same name twice in one batch: keep both
+            filepath = f"{stem}_{n}{ext}"
+            n += 1
+        file.save(filepath)
+        filepaths.append(filepath)
+
+    def generate():
+        total = len(filepaths)
+        yield _sse('start', {'total': total, 'files': [os.path.basename(p) for p in filepaths]})
+        results, failed = [], 0
+        for done, (filepath, result) in enumerate(run_bounded(_process_with_deadline, filepaths,
+                                                               MAX_BATCH_CONCURRENCY), start=1):
+            event = {'file': os.path.basename(filepath), 'done': done, 'total': total}
+            if isinstance(result, Exception):
+                event.update(success=False, error=str(result))
+            elif not result:
+                event.update(success=False, error='Document processing failed or not a certificate.')
+            else:
+                result = result.to_dict()
+                results.append(result)
+                event.update(success=True, data=result)
+            failed += not event['success']
+            yield _sse('progress', event)
+
+        # Bulk ingestion: batched embeddings + one store write per batch
+        if results:
+            try:
+                ingested = {'doc_ids': [r['doc_id'] for r in results], 'failed': []}
+                if rag:
+                    ingested = rag.ingest_many(results)
+                conn = issuer_index.connect()
+                try:
+                    issuer_index.record_certificates(conn, results)
+                finally:
+                    conn.close()
+                event = {'count': len(ingested['doc_ids'])}
+                if ingested['failed']:
+                    event['error'] = f"embedding failed for {', '.join(ingested['failed'])}"
+                yield _sse('ingested', event)
+            except Exception as e:
+                yield _sse('ingested', {'count': 0, 'error': str(e)})
+        yield _sse('done', {'total': total, 'succeeded': len(results), 'failed': failed})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/query', methods=['POST'])
 def query_rag():
     if not rag:
@@ -65,5 +198,26 @@ def query_rag():
     answer = rag.answer_question(data.get('question'))
     return jsonify({'answer': answer})
 
+@app.route('/query/batch', methods=['POST'])
+def query_batch():
+    """Answer a list of questions in one request; answers come back in question order"""
+    data = request.get_json(silent=True) or {}
+    questions = data.get('questions')
+    if not isinstance(questions, list) or not all(isinstance(q, str) for q in questions):
+        return jsonify({'error': 'Expected {"questions": [<string>, ...]}'}), 400
+    if len(questions) > MAX_QUERY_BATCH:
+        return jsonify({'error': f'At most {MAX_QUERY_BATCH} questions per request'}), 400
+    if not rag:
+        return jsonify({'answers': [{'question': q, 'answer': "RAG System is offline."} for q in questions]})
+    answers = rag.answer_many(questions)
+    return jsonify({'answers': [{'question': q, 'answer': a} for q, a in zip(questions, answers)]})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Per-stage / per-model-call latency histograms and counters (Prometheus text, or ?format=json)"""
+    if request.args.get('format') == 'json':
+        return jsonify(dict(registry.snapshot(), rate_limiter=get_rate_limiter().stats()))
+    return Response(registry.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
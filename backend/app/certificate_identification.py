@@ -1,8 +1,15 @@
 import re
+from itertools import islice
+
+from app.document import as_document
+
+# Certificates often have issue/expiry dates. Added short months (jan, feb, etc.)
+DATE_MENTION_RE = re.compile(r'\d{1,2}[-/\.]\d{1,2}[-/\.]\d{2,4}|january|february|march|april|may|june|july|august|september|october|november|december|jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec')
 
 def is_certificate(file_type, text_content):
     """
     Enhanced certificate detection with multiple strategies
+    (`text_content` may be a plain string or an app.document.Document)
     """
     
     # Validate file type
@@ -10,58 +17,21 @@ def is_certificate(file_type, text_content):
     if file_type.lower().replace('.', '') not in valid_types:
         return False
     
-    text_lower = text_content.lower()
+    document = as_document(text_content)
+    text_lower = document.lower
     
-    # Strategy 1: Primary certificate keywords
-    primary_keywords = [
-        'certificate',
-        'certification',
-        'certify',
-        'certified',
-        'diploma'
-    ]
+    # Strategy 1: Primary certificate keywords, Strategy 2: Formal certificate phrases
+    # (keyword lists live in app.document.CERTIFICATE_KEYWORDS; hits are cached on the document)
+    hits = document.keyword_hits
     
-    # Strategy 2: Formal certificate phrases
-    formal_phrases = [
-        'to whomsoever it may concern',
-        'this is to certify that',
-        'has completed',
-        'is hereby awarded',
-        'this is to confirm',
-        'completion certificate',
-        'achievement certificate',
-        'certificate of',
-        'award',
-        'completion of',
-    ]
-    
-    # Strategy 3: Dates (certificates often have issue/expiry dates)
-    # Added short months (jan, feb, etc.)
-    date_pattern = r'\d{1,2}[-/\.]\d{1,2}[-/\.]\d{2,4}|january|february|march|april|may|june|july|august|september|october|november|december|jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec'
-    date_found = len(re.findall(date_pattern, text_lower)) >= 2
+    # Strategy 3: Dates (two mentions are enough, so stop scanning there)
+    date_found = len(list(islice(DATE_MENTION_RE.finditer(text_lower), 2))) >= 2
     
     # Strategy 4: Certificate fields
-    field_keywords = [
-        'issued',
-        'issue date',
-        'expiry',
-        'expires',
-        'expiration',
-        'valid until',
-        'issuer',
-        'issued by',
-        'issued on',
-        'date',
-        'signature',
-        'authorized',
-        'validation number',
-        'validate at'
-    ]
-    
-    # Count matches
-    primary_count = sum(1 for kw in primary_keywords if kw in text_lower)
-    formal_count = sum(1 for phrase in formal_phrases if phrase in text_lower)
-    field_count = sum(1 for kw in field_keywords if kw in text_lower)
+    # Count matches (strategies 1, 2 and 4)
+    primary_count = len(hits['primary'])
+    formal_count = len(hits['formal'])
+    field_count = len(hits['field'])
     
     # Decision logic (improved):
     # Option A: Has primary keyword + formal phrase = CERTIFICATE
@@ -1,3 +1,5 @@
+import json
+import os
 from datetime import datetime
 
 def validate_dates(issued_date_str, expiry_date_str):
@@ -52,22 +54,30 @@ def validate_dates(issued_date_str, expiry_date_str):
         "expiry_status": expiry_status,
         "dates_consistent": dates_consistent
     }
+
+TRUSTED_ISSUERS_FILE = os.path.join(os.path.dirname(__file__), '..', 'trusted_issuers.json')
+_trusted_cache = {'mtime': None, 'issuers': []}
+
+def load_trusted_issuers():
+    """Load the trusted issuer list, re-reading the file only when it changes."""
+    mtime = os.path.getmtime(TRUSTED_ISSUERS_FILE)
+    if _trusted_cache['mtime'] != mtime:
+        with open(TRUSTED_ISSUERS_FILE, 'r') as f:
+            _trusted_cache['issuers'] = json.load(f)['trusted_issuers']
+        _trusted_cache['mtime'] = mtime
+    return _trusted_cache['issuers']
+
 def validate_issuer(issuer_name):
     """Validate issuer against trusted issuer list"""
-    import json
-    import os
-    
     try:
         # Load trusted list from project root
-        filepath = os.path.join(os.path.dirname(__file__), '..', 'trusted_issuers.json')
-        with open(filepath, 'r') as f:
-            trusted_list = json.load(f)
+        trusted_list = load_trusted_issuers()
         
         # Check matching
         if not issuer_name:
             is_trusted = False
         else:
-            is_trusted = issuer_name in trusted_list['trusted_issuers']
+            is_trusted = issuer_name in trusted_list
         
         return {
             'issuer': issuer_name,
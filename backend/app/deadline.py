@@ -0,0 +1,46 @@
+import os
+import time
+
+UPLOAD_DEADLINE_SECONDS = float(os.getenv('UPLOAD_DEADLINE_SECONDS', '60'))  # End-to-end budget per /upload
+MIN_CALL_TIMEOUT = float(os.getenv('MIN_CALL_TIMEOUT', '1.0'))  # Not worth starting a model call with less left
+
+DEADLINE_FLAG = "DEADLINE_EXCEEDED"
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before a stage could start or finish."""
+
+
+class Deadline:
+    """
+    Absolute time budget for one request, passed down the pipeline so every
+    stage sizes its own timeouts from what is left instead of a fixed value.
+    """
+
+    __slots__ = ('budget', 'expires_at')
+
+    def __init__(self, seconds=UPLOAD_DEADLINE_SECONDS):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() < MIN_CALL_TIMEOUT
+
+    def check(self, stage):
+        """Raise DeadlineExceeded if there is no usable budget left for `stage`."""
+        if self.expired():
+            raise DeadlineExceeded(f"Deadline of {self.budget:g}s exceeded before {stage}")
+
+    def timeout(self, cap=None, stage='model call'):
+        """Timeout for the next call: the remaining budget, capped at the stage's own limit."""
+        self.check(stage)
+        remaining = self.remaining()
+        return min(cap, remaining) if cap else remaining
+
+
+def stage_timeout(deadline, cap, stage='model call'):
+    """`cap` when there is no deadline, else deadline.timeout(cap, stage)."""
+    return deadline.timeout(cap, stage) if deadline else cap
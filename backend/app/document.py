@@ -0,0 +1,103 @@
+import hashlib
+import re
+from functools import cached_property
+
+from app.text_windows import DATE_PATTERN, EXTRACTION_TOKEN_BUDGET, compact_text, estimate_tokens, find_relevant_windows
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Phrases certificate identification counts, by strategy
+CERTIFICATE_KEYWORDS = {
+    'primary': ('certificate', 'certification', 'certify', 'certified', 'diploma'),
+    'formal': (
+        'to whomsoever it may concern', 'this is to certify that', 'has completed', 'is hereby awarded',
+        'this is to confirm', 'completion certificate', 'achievement certificate', 'certificate of',
+        'award', 'completion of',
+    ),
+    'field': (
+        'issued', 'issue date', 'expiry', 'expires', 'expiration', 'valid until', 'issuer', 'issued by',
+        'issued on', 'date', 'signature', 'authorized', 'validation number', 'validate at',
+    ),
+}
+
+
+class Document:
+    """
+    Certificate text after OCR, shared by every pipeline stage.
+
+    Derived features are computed on first use and cached on the instance, so
+    identification, rule and LLM extraction and the near-duplicate index each
+    read them instead of re-scanning the text. Stage-specific values (MinHash
+    signature, extraction prompt) go through memo().
+    """
+
+    def __init__(self, text, doc_id=None, file_type=None, used_ocr=False):
+        self.text = text or ''
+        self.doc_id = doc_id
+        self.file_type = file_type
+        self.used_ocr = used_ocr
+        self._memo = {}
+
+    def __len__(self):
+        return len(self.text)
+
+    def __bool__(self):
+        return bool(self.text)
+
+    def __repr__(self):
+        return f"Document({self.doc_id!r}, {len(self.text)} chars)"
+
+    @cached_property
+    def lower(self):
+        return self.text.lower()
+
+    @cached_property
+    def tokens(self):
+        """Word tokens of the lower-cased text."""
+        return TOKEN_RE.findall(self.lower)
+
+    @cached_property
+    def normalized(self):
+        """Lower-cased, punctuation-free text (tokens joined by single spaces)."""
+        return ' '.join(self.tokens)
+
+    @cached_property
+    def content_hash(self):
+        return hashlib.sha256(self.text.encode('utf-8')).hexdigest()
+
+    @cached_property
+    def token_estimate(self):
+        return estimate_tokens(self.text)
+
+    @cached_property
+    def keyword_hits(self):
+        """{strategy: tuple of CERTIFICATE_KEYWORDS phrases present in the text}."""
+        return {group: tuple(k for k in keywords if k in self.lower) for group, keywords in CERTIFICATE_KEYWORDS.items()}
+
+    @cached_property
+    def date_spans(self):
+        """(start, end) offsets of every candidate date in the text, in order."""
+        return [m.span() for m in DATE_PATTERN.finditer(self.text)]
+
+    @cached_property
+    def windows(self):
+        """(segments, windows) from text_windows.find_relevant_windows."""
+        return find_relevant_windows(self.text)
+
+    @cached_property
+    def compacted(self):
+        """(text_for_prompt, stats) under EXTRACTION_TOKEN_BUDGET, reusing the cached windows."""
+        return compact_text(self.text, EXTRACTION_TOKEN_BUDGET, windows=lambda: self.windows)
+
+    def memo(self, key, compute):
+        """Value cached under `key`, computed by compute() on first use."""
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+
+def as_document(text_or_document):
+    """The Document itself, or a new one wrapping a plain string."""
+    if isinstance(text_or_document, Document):
+        return text_or_document
+    return Document(text_or_document)
@@ -1,98 +1,118 @@
 from datetime import datetime
 import json
 import os
-from openai import AzureOpenAI
 
 # Load env vars (already loaded by main.py)
-AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
-AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZURE_OPENAI_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4")
-AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview")
 
+import re
 from collections import Counter
 
-def _extract_single(text_content):
+from app.deadline import DeadlineExceeded
+from app.document import as_document
+from app.metrics import span, incr
+from app.model_backend import available as model_available, get_client
+from app.rate_limiter import call_model
+from app.text_windows import estimate_tokens
+
+# Voting policy: 'adaptive' starts with one deterministic call and escalates only when needed,
+# 'fixed' always spends VOTING_MAX_CALLS calls.
+VOTING_POLICY = os.getenv("VOTING_POLICY", "adaptive")
+VOTING_MAX_CALLS = int(os.getenv("VOTING_MAX_CALLS", "3"))
+VOTING_FIRST_TEMPERATURE = float(os.getenv("VOTING_FIRST_TEMPERATURE", "0.0"))
+VOTING_TEMPERATURE = float(os.getenv("VOTING_TEMPERATURE", "0.7"))
+
+# Packed (multi-document) extraction for batch mode
+PACKED_TOKEN_BUDGET = int(os.getenv("PACKED_TOKEN_BUDGET", "3000"))
+PACKED_MAX_DOCS = int(os.getenv("PACKED_MAX_DOCS", "10"))
+
+# Expected completion size of one extraction answer, charged to the token bucket up front
+EXTRACTION_COMPLETION_TOKENS = 150
+EXTRACTION_CALL_TIMEOUT = 30  # Seconds per vote; a request deadline can only shorten it
+
+TARGET_FIELDS = ['issuer', 'certificate_number', 'issued_date', 'expiry_date', 'subject']
+DATE_FIELDS = ['issued_date', 'expiry_date']
+ISO_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+def _build_prompt(text_content):
+    """(Private) Extraction prompt for one certificate text."""
+    return f"""
+    You are a strict data extraction assistant. 
+    Extract the following fields from the certificate text provided below.
+    Return ONLY a valid JSON object. Do not include markdown formatting (```json).
+    
+    Fields to extract:
+    - issuer: Name of the organization issuing the certificate.
+    - certificate_number: The unique ID of the certificate.
+    - issued_date: Date issued (format YYYY-MM-DD if possible, else original).
+    - expiry_date: Date expired (format YYYY-MM-DD if possible, else original).
+    - subject: What is being certified (e.g., ISO 9001, Completion of Course).
+
+    If a field is not found, use null.
+    
+    Certificate Text:
+    \"\"\"
+    {text_content}
+    \"\"\"
+    """
+
+def _parse_model_json(content):
+    """(Private) Parse a JSON answer, tolerating markdown code fences."""
+    content = content.strip()
+    # Clean up markdown if present
+    if content.startswith("```json"):
+        content = content.replace("```json", "").replace("```", "")
+    if content.startswith("```"):
+        content = content.replace("```", "")
+    return json.loads(content)
+
+def _map_fields(data):
+    """(Private) Map a raw {field: value} answer to our internal {value, confidence} structure."""
+    mapped_result = {}
+    for key, val in data.items():
+        mapped_result[key] = {
+            'value': val,
+            'confidence': 0.95 if val else 0.0 
+        }
+    return mapped_result
+
+def _extract_single(text_content, temperature=0.7, deadline=None, prompt=None):
     """
     (Private) Single attempt to extract certificate fields using Azure OpenAI.
+    `prompt` is the already built prompt for `text_content`, shared by every vote.
+    Raises DeadlineExceeded when `deadline` leaves no time for the call.
     """
     
-    # Check if we have usable keys
-    # Clean the endpoint if it contains the full path/query params
-    base_endpoint = AZURE_OPENAI_ENDPOINT
-    if base_endpoint:
-        if "/openai/deployments" in base_endpoint:
-             base_endpoint = base_endpoint.split("/openai/deployments")[0]
-        # Remove query params if any
-        if "?" in base_endpoint:
-            base_endpoint = base_endpoint.split("?")[0]
-
-    has_real_config = (
-        AZURE_OPENAI_API_KEY and 
-        base_endpoint and
-        "your-key" not in str(AZURE_OPENAI_API_KEY)
-    )
-
-    if has_real_config:
+    # Check if we have usable keys (or a recorded/fake backend)
+    if model_available():
         try:
             # print(f"🧠 Sending text to Azure OpenAI ({AZURE_OPENAI_DEPLOYMENT})...") 
             # (Silenced print to avoid spamming console during ensemble)
             
-            client = AzureOpenAI(
-                azure_endpoint=base_endpoint, 
-                api_key=AZURE_OPENAI_API_KEY,  
-                api_version=AZURE_OPENAI_API_VERSION
-            )
+            client = get_client()
 
-            prompt = f"""
-            You are a strict data extraction assistant. 
-            Extract the following fields from the certificate text provided below.
-            Return ONLY a valid JSON object. Do not include markdown formatting (```json).
-            
-            Fields to extract:
-            - issuer: Name of the organization issuing the certificate.
-            - certificate_number: The unique ID of the certificate.
-            - issued_date: Date issued (format YYYY-MM-DD if possible, else original).
-            - expiry_date: Date expired (format YYYY-MM-DD if possible, else original).
-            - subject: What is being certified (e.g., ISO 9001, Completion of Course).
-
-            If a field is not found, use null.
-            
-            Certificate Text:
-            \"\"\"
-            {text_content}
-            \"\"\"
-            """
+            prompt = prompt or _build_prompt(text_content)
 
-            response = client.chat.completions.create(
+            response = call_model(
+                'extraction_vote', client.chat.completions.create,
+                tokens=estimate_tokens(prompt) + EXTRACTION_COMPLETION_TOKENS,
                 model=AZURE_OPENAI_DEPLOYMENT,
                 messages=[
                     {"role": "system", "content": "You are a helpful assistant that extracts data."},
                     {"role": "user", "content": prompt}
                 ],
-                temperature=0.7, # Increased slightly for variety in ensemble
-                timeout=30 
+                temperature=temperature, # 0 for the first vote, higher for variety when escalating
+                timeout=EXTRACTION_CALL_TIMEOUT,
+                deadline=deadline
             )
 
-            content = response.choices[0].message.content.strip()
-            
-            # Clean up markdown if present
-            if content.startswith("```json"):
-                content = content.replace("```json", "").replace("```", "")
-            if content.startswith("```"):
-                content = content.replace("```", "")
-            
-            data = json.loads(content)
+            data = _parse_model_json(response.choices[0].message.content)
             
             # Map to our internal structure
-            mapped_result = {}
-            for key, val in data.items():
-                mapped_result[key] = {
-                    'value': val,
-                    'confidence': 0.95 if val else 0.0 
-                }
-                
-            return mapped_result
+            return _map_fields(data)
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             # print(f"❌ Azure OpenAI Error: [Securely Logged]")
             return None
@@ -108,58 +128,56 @@ def _extract_single(text_content):
         }
         return mock_response
 
+def _vote_key(field, value):
+    """
+    (Private) Normalized form of a vote, so trivially different answers agree.
+    Case and whitespace are ignored and dates are compared after normalization.
+    """
+    if value is None:
+        return "None"
+    text = " ".join(str(value).split())
+    if not text:
+        return "None"
+    if field in DATE_FIELDS and not ISO_DATE_RE.match(text):
+        text = normalize_date(text)
+    return text.casefold()
+
 def calculate_consensus(results_list):
     """
     Find the majority vote for each field across multiple results.
+    Votes are compared on normalized values (see _vote_key).
     Returns (consensus_dict, full_voting_log)
     """
+    results_list = [res for res in results_list if res]
     if not results_list:
         return {}, {}
         
     consensus_result = {}
     voting_log = {}
     
-    # Get all keys from the first result
-    keys = results_list[0].keys()
+    # All keys seen in any result, in first-seen order
+    keys = list(dict.fromkeys(key for res in results_list for key in res))
     
     for key in keys:
-        # Collect all values for this field from all runs
-        values = []
+        # Normalized vote per run, plus the first original answer behind each vote
+        counter = Counter()
+        originals = {}
         for res in results_list:
-            if res and key in res:
-                # We vote on the 'value' part of the dict
-                val = res[key].get('value')
-                # Convert list/dict to string for hashing if needed, or keep simple
-                values.append(val)
-        
-        # Count votes
-        # We need to handle 'None' carefully
-        safe_values = [str(v) if v is not None else "None" for v in values]
-        counter = Counter(safe_values)
-        
-        # Get the winner (most common)
-        most_common = counter.most_common(1)
-        winner_val_str = most_common[0][0]
-        vote_count = most_common[0][1]
+            field = res.get(key) or {}
+            vote = _vote_key(key, field.get('value'))
+            counter[vote] += 1
+            originals.setdefault(vote, field)
         
-        # Recover the original type (if it was None)
-        final_val = None if winner_val_str == "None" else winner_val_str
-        
-        # If we have original values, try to find the one that matches winner string to preserve type
-        # (Simple approximation for now)
-        
-        # Construct the detailed field object
-        # We use the confidence of the first occurrence of the winner
-        winner_conf = 0.0
-        for res in results_list:
-            if res and key in res:
-                if str(res[key].get('value')) == safe_values[0] or (res[key].get('value') is None and safe_values[0] == "None"):
-                   winner_conf = res[key].get('confidence', 0.0)
-                   break
+        # Most common wins; ties go to the earliest vote (the deterministic first call)
+        winner_key = counter.most_common(1)[0][0]
+        winner = originals[winner_key]
+        final_val = None if winner_key == "None" else winner.get('value')
+        if isinstance(final_val, str):
+            final_val = " ".join(final_val.split())
                    
         consensus_result[key] = {
             'value': final_val,
-            'confidence': winner_conf
+            'confidence': winner.get('confidence', 0.0)
         }
         
         # Log details
@@ -171,35 +189,284 @@ def calculate_consensus(results_list):
         
     return consensus_result, voting_log
 
-def extract_with_azure(text_content):
+def _escalation_reason(results):
+    """
+    (Private) Why another vote is needed, or None when the current votes suffice.
+    - One vote: escalate if a field is missing or a date does not parse.
+    - Several votes: escalate while any field lacks a strict majority.
+    """
+    if not results:
+        return "no_result"
+    if len(results) == 1:
+        first = results[0]
+        if any(not (first.get(f) or {}).get('value') for f in TARGET_FIELDS):
+            return "missing_fields"
+        for f in DATE_FIELDS:
+            if not _is_iso_date(normalize_date(str(first[f]['value']).strip())):
+                return "date_unparsed"
+        return None
+    for field in TARGET_FIELDS:
+        counts = Counter(_vote_key(field, (res.get(field) or {}).get('value')) for res in results)
+        if counts.most_common(1)[0][1] * 2 <= len(results):
+            return "disagreement"
+    return None
+
+def _is_iso_date(value):
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+        return True
+    except (TypeError, ValueError):
+        return False
+
+def extract_with_azure(text_content, seed_votes=None, deadline=None):
     """
     MAIN ENTRY: Performs Self-Consistency (Ensembling).
-    Calls the API 3 times and returns the consensus result.
+    With the adaptive policy, one deterministic call is made first and more
+    votes are only spent when fields are missing, dates fail to parse or the
+    votes disagree (up to VOTING_MAX_CALLS). Returns the consensus result.
+
+    `text_content` may be a plain string or an app.document.Document, whose
+    compacted text and prompt are then shared with any later call for it.
+
+    `seed_votes` are votes already obtained elsewhere (e.g. from a packed
+    batch request); they count towards the call budget.
+
+    With a `deadline`, each vote's timeout is cut to the remaining budget and
+    no further votes are started once it runs out; the consensus of the votes
+    gathered so far is returned with '_deadline_exceeded' set.
     """
-    print(f"🧠 Consensus Engine: Running 3 parallel extraction attempts...")
+    # Send only the relevant windows of long documents (computed once, reused by every vote)
+    document = as_document(text_content)
+    with span('prompt_compaction'):
+        prompt_text, prompt_stats = document.compacted
+        prompt = document.memo('extraction_prompt', lambda: _build_prompt(prompt_text))
+    prompt_stats = dict(prompt_stats)
+    prompt_stats['prompt_tokens_after'] = estimate_tokens(prompt)
+    # Same prompt around the full text, without building it
+    prompt_stats['prompt_tokens_before'] = (prompt_stats['prompt_tokens_after'] - prompt_stats['compacted_tokens']
+                                            + prompt_stats['original_tokens'])
+    incr('prompt_tokens_before', prompt_stats['prompt_tokens_before'])
+    incr('prompt_tokens_after', prompt_stats['prompt_tokens_after'])
+    if not prompt_stats['fallback']:
+        print(f"✂️  Prompt compacted: {prompt_stats['prompt_tokens_before']} → "
+              f"{prompt_stats['prompt_tokens_after']} tokens ({prompt_stats['windows']} windows)")
+
+    adaptive = VOTING_POLICY != "fixed"
+    print(f"🧠 Consensus Engine: {'adaptive' if adaptive else 'fixed'} voting (max {VOTING_MAX_CALLS} calls)...")
     
-    results = []
-    attempts = 3
+    results = [res for res in (seed_votes or []) if res]
+    escalations = []
+    calls = len(results)
+    done = False
+    if results and adaptive:
+        reason = _escalation_reason(results)
+        done = not reason
+        if reason:
+            escalations.append(reason)
     
-    for i in range(attempts):
-        print(f"   🔹 Attempt {i+1}/{attempts}...", end="\r")
-        res = _extract_single(text_content)
+    timed_out = False
+    while not done and calls < VOTING_MAX_CALLS:
+        temperature = VOTING_FIRST_TEMPERATURE if (adaptive and calls == 0) else VOTING_TEMPERATURE
+        calls += 1
+        print(f"   🔹 Attempt {calls}/{VOTING_MAX_CALLS}...", end="\r")
+        try:
+            with span('consensus_vote'):
+                res = _extract_single(prompt_text, temperature=temperature, deadline=deadline, prompt=prompt)
+        except DeadlineExceeded as e:
+            # Remaining votes are cancelled; whatever was gathered so far is used
+            print(f"\n   ⏱️  {e}. Skipping remaining votes.")
+            incr('deadline_exceeded')
+            timed_out = True
+            calls -= 1  # The cancelled vote was never sent
+            break
         if res:
             results.append(res)
+        
+        if adaptive:
+            reason = _escalation_reason(results)
+            if not reason:
+                break
+            escalations.append(reason)
             
-    print(f"\n   ✅ Completed {len(results)} successful extractions.")
+    print(f"\n   ✅ Completed {len(results)} successful extractions in {calls} call(s).")
+    incr('extraction_calls', calls)
     
     if not results:
-        return {} # Failed all
+        return {'_deadline_exceeded': True} if timed_out else {} # Failed all
         
     # Calculate Majority Vote
-    final_output, voting_details = calculate_consensus(results)
+    with span('consensus'):
+        final_output, voting_details = calculate_consensus(results)
     
     # Inject voting details into the output so logging can find it
+    voting_details['calls_spent'] = calls
+    voting_details['escalations'] = escalations[:max(0, calls - 1)]
     final_output['_voting_debug'] = voting_details
+    final_output['_prompt_stats'] = prompt_stats
+    if timed_out:
+        final_output['_deadline_exceeded'] = True
     
     return final_output
 
+def _build_packed_prompt(pack):
+    """(Private) One prompt covering several certificates, given as [(pack_id, text)]."""
+    documents = "\n".join(
+        f'Certificate {pack_id}:\n    \"\"\"\n    {text}\n    \"\"\"' for pack_id, text in pack
+    )
+    return f"""
+    You are a strict data extraction assistant. 
+    Extract the following fields from EACH certificate text provided below.
+    Return ONLY a valid JSON array with one object per certificate. Do not include markdown formatting (```json).
+    Every object must contain "doc_id" (exactly as given, e.g. "d0") and the fields.
+    
+    Fields to extract:
+    - issuer: Name of the organization issuing the certificate.
+    - certificate_number: The unique ID of the certificate.
+    - issued_date: Date issued (format YYYY-MM-DD if possible, else original).
+    - expiry_date: Date expired (format YYYY-MM-DD if possible, else original).
+    - subject: What is being certified (e.g., ISO 9001, Completion of Course).
+
+    If a field is not found, use null.
+    
+    {documents}
+    """
+
+def _extract_packed(pack, temperature=0.0):
+    """
+    (Private) One request for a pack of certificates.
+    Returns {pack_id: mapped_result} for every document whose answer was valid;
+    documents missing from (or malformed in) the response are left out.
+    """
+    if not model_available():
+        return {}
+    try:
+        client = get_client()
+        prompt = _build_packed_prompt(pack)
+        response = call_model(
+            'extraction_packed', client.chat.completions.create,
+            tokens=estimate_tokens(prompt) + EXTRACTION_COMPLETION_TOKENS * len(pack),
+            model=AZURE_OPENAI_DEPLOYMENT,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant that extracts data."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=temperature,
+            timeout=30 + 10 * len(pack)
+        )
+        data = _parse_model_json(response.choices[0].message.content)
+    except Exception:
+        return {}
+
+    # Accept a list of objects with doc_id, or an object keyed by doc_id
+    if isinstance(data, dict):
+        data = [dict(v, doc_id=k) for k, v in data.items() if isinstance(v, dict)]
+    if not isinstance(data, list):
+        return {}
+
+    expected = {pack_id for pack_id, _ in pack}
+    valid = {}
+    for item in data:
+        if not isinstance(item, dict) or item.get('doc_id') not in expected:
+            continue
+        fields = {k: v for k, v in item.items() if k != 'doc_id'}
+        if not set(TARGET_FIELDS) <= set(fields) or any(isinstance(v, (dict, list)) for v in fields.values()):
+            continue
+        valid[item['doc_id']] = _map_fields({k: fields[k] for k in TARGET_FIELDS})
+    return valid
+
+def pack_documents(docs, token_budget=PACKED_TOKEN_BUDGET, max_docs=PACKED_MAX_DOCS):
+    """
+    Greedily group [(pack_id, text)] into packs whose prompt fits the token budget.
+    A document too large for any pack travels alone.
+    """
+    pack, pack_tokens = [], estimate_tokens(_build_packed_prompt([]))
+    for pack_id, text in docs:
+        doc_tokens = estimate_tokens(text) + 12  # Per-document header and quotes
+        if pack and (pack_tokens + doc_tokens > token_budget or len(pack) >= max_docs):
+            yield pack
+            pack, pack_tokens = [], estimate_tokens(_build_packed_prompt([]))
+        pack.append((pack_id, text))
+        pack_tokens += doc_tokens
+    if pack:
+        yield pack
+
+def extract_batch_with_azure(documents, token_budget=PACKED_TOKEN_BUDGET):
+    """
+    BATCH ENTRY: extract several certificates with packed requests.
+
+    Args:
+        documents (list): [(doc_id, text_content)] pairs; text_content may be a Document.
+        token_budget (int): Max estimated prompt tokens per packed request.
+
+    Returns:
+        list: One extractor output per input document (same order, same shape
+              as extract_with_azure). Documents whose packed answer was missing
+              or invalid are retried in one smaller packed request, then singly
+              through extract_with_azure; a valid packed answer that still needs
+              escalation under the voting policy is used as the first vote.
+              With VOTING_POLICY 'fixed', every document gets VOTING_MAX_CALLS
+              votes, the extra ones from further packed requests.
+    """
+    documents = [as_document(text) for _, text in documents]
+    if not model_available():
+        # Mock mode has nothing to amortize
+        return [extract_with_azure(document) for document in documents]
+
+    # Short internal ids keep the prompt small and avoid odd characters in file names
+    texts = {}
+    for i, document in enumerate(documents):
+        with span('prompt_compaction'):
+            texts[f"d{i}"] = document.compacted[0]
+
+    adaptive = VOTING_POLICY != "fixed"
+    first_temperature = VOTING_FIRST_TEMPERATURE if adaptive else VOTING_TEMPERATURE
+    votes = {}  # pack id -> [vote, ...]
+    pending = list(texts.items())
+    for attempt in range(2):
+        failed = []
+        for pack in pack_documents(pending, token_budget):
+            print(f"📦 Packed extraction: {len(pack)} certificate(s) in one request...")
+            with span('packed_extraction'):
+                answers = _extract_packed(pack, temperature=first_temperature)
+            for pack_id, answer in answers.items():
+                votes[pack_id] = [answer]
+            failed.extend(item for item in pack if item[0] not in answers)
+        pending = failed
+        if not pending:
+            break
+        print(f"   ↻ {len(pending)} certificate(s) failed validation, retrying...")
+    incr('packed_retry_docs', len(pending))
+
+    if not adaptive:
+        # Fixed policy: the remaining votes come from further packed requests too
+        answered = [(pack_id, text) for pack_id, text in texts.items() if pack_id in votes]
+        for _ in range(VOTING_MAX_CALLS - 1):
+            for pack in pack_documents(answered, token_budget):
+                with span('packed_extraction'):
+                    answers = _extract_packed(pack, temperature=VOTING_TEMPERATURE)
+                for pack_id, answer in answers.items():
+                    votes[pack_id].append(answer)
+
+    outputs = []
+    for i, document in enumerate(documents):
+        doc_votes = votes.get(f"d{i}", [])
+        if adaptive:
+            settled = bool(doc_votes) and not _escalation_reason(doc_votes)
+        else:
+            settled = len(doc_votes) >= VOTING_MAX_CALLS
+        if settled:
+            with span('consensus'):
+                output, voting_details = calculate_consensus(doc_votes)
+            voting_details['calls_spent'] = len(doc_votes)
+            voting_details['escalations'] = []
+            voting_details['method'] = 'packed'
+            output['_voting_debug'] = voting_details
+            outputs.append(output)
+        else:
+            # Per-document fallback keeps the usual consensus semantics (packed votes count towards it)
+            outputs.append(extract_with_azure(document, seed_votes=doc_votes or None))
+    return outputs
+
 def normalize_date(date_string):
     """Convert any date format to YYYY-MM-DD"""
     if not date_string:
@@ -218,9 +485,7 @@ def extract_fields(azure_output):
     """Clean raw extraction output into structured fields."""
     fields = {}
     confidence = {}
-    target_fields = ['issuer', 'certificate_number', 'issued_date', 'expiry_date', 'subject']
-    
-    for field_name in target_fields:
+    for field_name in TARGET_FIELDS:
         field_data = azure_output.get(field_name, {})
         if not field_data:
             fields[field_name] = None
@@ -231,7 +496,7 @@ def extract_fields(azure_output):
         conf = field_data.get('confidence', 0.0)
         
         # Normalize dates
-        if field_name in ['issued_date', 'expiry_date']:
+        if field_name in DATE_FIELDS:
             value = normalize_date(value)
         
         fields[field_name] = value
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from app.security import ALLOWED_DATA_DIR, redact_pii
+
+try:
+    from PIL import Image  # In requirements.txt; without it only byte-identical re-uploads are recognised
+except ImportError:
+    Image = None
+
+IMAGE_DEDUP = os.getenv('IMAGE_DEDUP', '1') != '0'
+IMAGE_HASH_MAX_DISTANCE = int(os.getenv('IMAGE_HASH_MAX_DISTANCE', '6'))  # Hamming bits out of 64
+IMAGE_HASH_MAX_DIFF = float(os.getenv('IMAGE_HASH_MAX_DIFF', '16'))  # Grey levels per thumbnail cell to confirm
+IMAGE_HASH_INDEX = os.getenv('IMAGE_HASH_INDEX', os.path.join(ALLOWED_DATA_DIR, 'image_hash_index.jsonl'))
+
+HASH_SIZE = 8  # 8x8 = 64-bit dHash
+DHASH_MARGIN = 1.0  # Grey levels; cell means of a flat area differ by less than this
+THUMB_SIZE = 32  # 32x32 grey thumbnail: too coarse to read, fine enough to see a changed name line
+
+# Perceptual fingerprint of an image: dHash, (width, height) and a uint8 THUMB_SIZE x THUMB_SIZE thumbnail
+ImageSignature = namedtuple('ImageSignature', ['hash', 'size', 'thumb'])
+
+
+def _resize_gray(gray, width, height):
+    """Area-average resize of a 2-D array (enough for hashing, no interpolation needed)."""
+    rows = np.array_split(np.arange(gray.shape[0]), height)
+    cols = np.array_split(np.arange(gray.shape[1]), width)
+    out = np.empty((height, width), dtype=np.float64)
+    for i, r in enumerate(rows):
+        band = gray[r[0]:r[-1] + 1].mean(axis=0)
+        for j, c in enumerate(cols):
+            out[i, j] = band[c[0]:c[-1] + 1].mean()
+    return out
+
+
+def dhash_array(gray, hash_size=HASH_SIZE):
+    """
+    Difference hash of a grayscale image array: shrink to (hash_size+1) x hash_size
+    and set one bit per horizontally adjacent pair that gets brighter by more than
+    DHASH_MARGIN, so flat areas (blank paper) hash to 0 instead of to their noise.
+    Stable under re-compression, resizing and small brightness changes.
+    """
+    gray = np.asarray(gray, dtype=np.float64)
+    if gray.shape[0] < hash_size or gray.shape[1] < hash_size + 1:
+        raise ValueError("Image too small to hash")
+    small = _resize_gray(gray, hash_size + 1, hash_size)
+    bits = (small[:, 1:] > small[:, :-1] + DHASH_MARGIN).flatten()
+    return int(''.join('1' if b else '0' for b in bits), 2)
+
+
+def thumbnail_array(gray, size=THUMB_SIZE):
+    """Area-averaged size x size uint8 thumbnail of a grayscale image array."""
+    return np.rint(_resize_gray(np.asarray(gray, dtype=np.float64), size, size)).astype(np.uint8)
+
+
+def signature_array(gray, size=None):
+    """ImageSignature of a grayscale array; `size` is the original (width, height) if it was downscaled."""
+    gray = np.asarray(gray, dtype=np.float64)
+    return ImageSignature(dhash_array(gray), tuple(size or (gray.shape[1], gray.shape[0])), thumbnail_array(gray))
+
+
+def thumbnail_diff(a, b):
+    """Largest per-cell difference of two thumbnails after removing overall brightness."""
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    return float(np.abs((a - a.mean()) - (b - b.mean())).max())
+
+
+def dhash_file(file_path):
+    """ImageSignature of an image file, or None when Pillow is missing or the image cannot be read."""
+    if Image is None:
+        return None
+    try:
+        with Image.open(file_path) as img:
+            size = img.size
+            img.draft('L', (128, 128))  # JPEG: decode at reduced scale, much cheaper than full size
+            return signature_array(np.asarray(img.convert('L')), size)
+    except Exception as e:
+        print(f"⚠️ Image hash failed for {file_path}: {e}")
+        return None
+
+
+def file_sha256(file_path):
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64-bit hashes with Hamming distance.
+    A radius query only descends into children whose edge distance is within
+    [d - radius, d + radius], so most of the tree is skipped.
+    """
+
+    def __init__(self):
+        self.root = None  # [hash, {distance: child_node}]
+        self.size = 0
+
+    def add(self, value):
+        if self.root is None:
+            self.root = [value, {}]
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            d = hamming(value, node[0])
+            if d == 0:
+                return
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = [value, {}]
+                self.size += 1
+                return
+            node = child
+
+    def search(self, value, radius):
+        """Return [(distance, hash)] within `radius`, nearest first."""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= radius:
+                found.append((d, node[0]))
+            for edge, child in node[1].items():
+                if d - radius <= edge <= d + radius:
+                    stack.append(child)
+        return sorted(found)
+
+
+class ImageOcrCache:
+    """
+    Index of images already read by Vision OCR, by file SHA-256 and perceptual hash.
+    Entries are appended to a JSONL file so matches survive restarts.
+
+    An 8x8 dHash cannot tell apart two certificates from one template that differ only
+    in name or number, so a dHash match within max_distance is only a candidate. It is
+    confirmed (and its OCR text may be reused) when the image has the same pixel size
+    and no thumbnail cell differs by more than max_diff grey levels; a byte-identical
+    file (same SHA-256) is always confirmed.
+
+    OCR text is held in memory only. Like the extraction log, the file keeps no
+    readable PII: hashes, size, the thumbnail and a redacted doc_id. After a restart
+    a match is still reported, and the next OCR of that image refills its text.
+    """
+
+    def __init__(self, path=IMAGE_HASH_INDEX, max_distance=IMAGE_HASH_MAX_DISTANCE, max_diff=IMAGE_HASH_MAX_DIFF):
+        self.path = path
+        self.max_distance = max_distance
+        self.max_diff = max_diff
+        self._lock = threading.Lock()
+        self._tree = BKTree()
+        self._entries = {}  # hash -> [record]; one template can share a hash across many images
+        self._by_sha = {}   # sha256 -> record
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Torn last line from an interrupted write
+                thumb = entry.get('thumb')
+                signature = ImageSignature(
+                    int(entry['hash'], 16), tuple(entry.get('size') or ()),
+                    np.frombuffer(bytes.fromhex(thumb), dtype=np.uint8).reshape(THUMB_SIZE, THUMB_SIZE)
+                    if thumb else None) if entry.get('hash') else None
+                self._put(signature, dict(entry, text=None))
+
+    def _put(self, signature, entry):
+        record = {'doc_id': entry.get('doc_id'), 'text': entry.get('text'), 'sha256': entry.get('sha256'),
+                  'signature': signature}
+        if signature is not None:
+            if signature.hash not in self._entries:
+                self._tree.add(signature.hash)
+            self._entries.setdefault(signature.hash, []).append(record)
+        if record['sha256']:
+            self._by_sha.setdefault(record['sha256'], record)
+        return record
+
+    def __len__(self):
+        return len({id(r) for r in [*(r for rs in self._entries.values() for r in rs), *self._by_sha.values()]})
+
+    def _confirms(self, record, signature):
+        stored = record['signature']
+        return (stored.size == signature.size and stored.thumb is not None and signature.thumb is not None
+                and thumbnail_diff(stored.thumb, signature.thumb) <= self.max_diff)
+
+    @staticmethod
+    def _result(record, distance, exact, confirmed):
+        return {'doc_id': record['doc_id'], 'text': record['text'], 'sha256': record['sha256'],
+                'distance': distance, 'exact': exact, 'confirmed': confirmed}
+
+    def lookup(self, signature=None, sha256=None):
+        """
+        Stored entry for the image as dict(doc_id, text, sha256, distance, exact, confirmed), or None.
+        exact is True for the same file bytes. Otherwise the nearest confirmed perceptual match
+        within max_distance is returned, else the nearest candidate (confirmed False).
+        """
+        with self._lock:
+            if sha256 and sha256 in self._by_sha:
+                return self._result(self._by_sha[sha256], 0, True, True)
+            if signature is None:
+                return None
+            matches = self._tree.search(signature.hash, self.max_distance)
+            for distance, stored in matches:
+                for record in self._entries[stored]:
+                    if self._confirms(record, signature):
+                        return self._result(record, distance, False, True)
+            if not matches:
+                return None
+            distance, stored = matches[0]
+            return self._result(self._entries[stored][0], distance, False, False)
+
+    def add(self, signature, doc_id, text, sha256=None):
+        with self._lock:
+            known = self._by_sha.get(sha256) if sha256 else None
+            if known is None and not sha256 and signature is not None:
+                known = next((r for r in self._entries.get(signature.hash, []) if self._confirms(r, signature)),
+                             None)
+            if known is not None:
+                if not known['text']:
+                    known['text'] = text  # Reloaded entry: text was not persisted
+                return
+            self._put(signature, {'doc_id': doc_id, 'text': text, 'sha256': sha256})
+            if self.path:
+                entry = redact_pii({'doc_id': doc_id})
+                entry.update({
+                    'hash': f"{signature.hash:016x}" if signature is not None else None,
+                    'size': list(signature.size) if signature is not None else None,
+                    'thumb': signature.thumb.tobytes().hex() if signature is not None else None,
+                    'sha256': sha256})
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry) + '\n')
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_warned = []
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageOcrCache()
+        return _cache
+
+
+def image_hash(file_path):
+    """ImageSignature used to match similar images, or None when deduplication is off or unavailable."""
+    if not IMAGE_DEDUP:
+        return None
+    if Image is None:
+        if not _warned:
+            _warned.append(True)
+            print("⚠️ Pillow not installed; only byte-identical image re-uploads are recognised before Vision OCR.")
+        return None
+    return dhash_file(file_path)
+
+
+def image_sha256(file_path):
+    """File SHA-256 used to confirm a cache match, or None when deduplication is off."""
+    return file_sha256(file_path) if IMAGE_DEDUP else None
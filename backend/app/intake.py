@@ -0,0 +1,186 @@
+import csv
+import glob
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from app.profiling import propagate
+from app.rate_limiter import TokenBucket
+from app.security import validate_secure_path
+
+# File types the pipeline can read (see ocr_module.extract_text_from_file)
+SUPPORTED_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg', '.txt')
+GLOB_CHARS = set('*?[')
+
+
+def iter_directory(root, recursive=True, extensions=SUPPORTED_EXTENSIONS):
+    """Yield supported files under `root` in a stable order, one directory listing at a time."""
+    root = validate_secure_path(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        if not recursive:
+            dirnames.clear()
+        for name in sorted(filenames):
+            if name.lower().endswith(extensions):
+                yield os.path.join(dirpath, name)
+
+
+def iter_glob(pattern):
+    """Yield paths matching a glob pattern ('**' recurses), without building the full list."""
+    for path in glob.iglob(pattern, recursive=True):
+        if os.path.isfile(path):
+            yield path
+
+
+def iter_csv(csv_file):
+    """Yield the first column of each non-empty CSV row."""
+    csv_file = validate_secure_path(csv_file)
+    with open(csv_file, 'r', newline='') as f:
+        for row in csv.reader(f):
+            if row and row[0].strip():
+                yield row[0].strip()
+
+
+def iter_lines(stream=None):
+    """Yield newline-separated paths (e.g. `find data -name '*.pdf' | python batch_processor.py -`)."""
+    for line in stream or sys.stdin:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def iter_source(spec):
+    """
+    Lazily yield file paths from one source spec:
+    '-' (stdin), a directory, a glob pattern, a CSV file, or a single file.
+    """
+    if spec == '-':
+        return iter_lines()
+    if GLOB_CHARS & set(spec):
+        return iter_glob(spec)
+    if os.path.isdir(spec):
+        return iter_directory(spec)
+    if spec.lower().endswith('.csv'):
+        return iter_csv(spec)
+    return iter([spec])
+
+
+def iter_sources(specs):
+    """Chain several source specs (or a single spec, or an already-iterable of paths)."""
+    if isinstance(specs, str):
+        specs = [specs]
+    for spec in specs:
+        yield from iter_source(spec)
+
+
+def run_bounded(func, items, concurrency=4, rate=0.0):
+    """
+    Apply func to each item on a thread pool and yield (item, result) as they finish.
+
+    Items are pulled from the iterator only when a worker slot frees up
+    (at most `concurrency` in flight plus as many queued), so memory does not
+    grow with the number of items. `rate` caps how many items start per second.
+    Exceptions from func are yielded as the result.
+    """
+    bucket = TokenBucket(rate, capacity=max(1.0, rate)) if rate else None
+    func = propagate(func)
+    max_pending = max(1, concurrency) * 2
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        pending = {}
+
+        def drain(block):
+            if not pending:
+                return []
+            done, _ = wait(list(pending), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            out = []
+            for future in done:
+                item = pending.pop(future)
+                try:
+                    out.append((item, future.result()))
+                except Exception as e:
+                    out.append((item, e))
+            return out
+
+        for item in items:
+            while len(pending) >= max_pending:
+                yield from drain(block=True)
+            if bucket:
+                bucket.acquire(1)
+            pending[pool.submit(func, item)] = item
+            yield from drain(block=False)
+        while pending:
+            yield from drain(block=True)
+
+
+def chunked(items, size):
+    """Group an iterator into lists of up to `size` items, lazily."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class JsonArrayWriter:
+    """
+    Write a JSON array one element at a time, so results never accumulate in memory.
+
+    Output goes to `path + '.tmp'` and replaces `path` only when the writer closes
+    cleanly; if the with-block raises, the temp file is removed and any previous
+    output at `path` is left as it was.
+    """
+
+    def __init__(self, path, dumps):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.file = open(self.tmp_path, 'w')
+        self.dumps = dumps
+        self.count = 0
+        self._start()
+
+    def _start(self):
+        self.file.write('[')
+
+    def _finish(self):
+        self.file.write('\n]\n' if self.count else ']\n')
+
+    def write(self, item):
+        self.file.write(('\n' if not self.count else ',\n') + self.dumps(item))
+        self.count += 1
+
+    def close(self):
+        self._finish()
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        """Drop the partial output, keeping whatever was at `path` before."""
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class JsonLinesWriter(JsonArrayWriter):
+    """Same interface as JsonArrayWriter, one JSON document per line."""
+
+    def _start(self):
+        pass
+
+    def _finish(self):
+        pass
+
+    def write(self, item):
+        self.file.write(self.dumps(item) + '\n')
+        self.count += 1
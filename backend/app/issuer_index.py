@@ -0,0 +1,170 @@
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+from app.date_validation import load_trusted_issuers, validate_issuer
+from app.deadline import DEADLINE_FLAG
+from app.records import dumps
+from app.status_assignment import resolve_final_status
+
+ISSUER_INDEX_DB = os.getenv('ISSUER_INDEX_DB', 'issuer_index.db')
+
+QUERY_CHUNK = 500     # Issuers per IN (...) query (SQLite variable limit)
+UPDATE_BATCH = 1000   # Re-scored certificates written per transaction / RAG batch
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS certificates (
+    doc_id TEXT PRIMARY KEY,
+    issuer TEXT,
+    final_status TEXT,
+    record TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS trusted_snapshot (
+    issuer TEXT PRIMARY KEY
+);
+CREATE INDEX IF NOT EXISTS idx_certificates_issuer ON certificates(issuer);
+"""
+
+
+def connect(db_path=ISSUER_INDEX_DB):
+    """Open (and initialise if needed) the issuer index database."""
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _as_dict(result):
+    return result.to_dict() if hasattr(result, 'to_dict') else result
+
+
+def record_certificates(conn, results):
+    """
+    Index stored certificates by issuer (upsert on doc_id).
+    The first call also snapshots the trusted list the statuses were computed with.
+    """
+    now = datetime.now().isoformat()
+    rows = []
+    for result in results:
+        data = _as_dict(result)
+        rows.append((data.get('doc_id'), (data.get('fields') or {}).get('issuer'),
+                     data.get('final_status'), dumps(data), now))
+    with conn:
+        if not conn.execute("SELECT 1 FROM trusted_snapshot LIMIT 1").fetchone():
+            _save_snapshot(conn, load_trusted_issuers())
+        conn.executemany(
+            "INSERT INTO certificates (doc_id, issuer, final_status, record, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(doc_id) DO UPDATE SET issuer=excluded.issuer, final_status=excluded.final_status, "
+            "record=excluded.record, updated_at=excluded.updated_at",
+            rows)
+    return len(rows)
+
+
+def trusted_snapshot(conn):
+    return {row[0] for row in conn.execute("SELECT issuer FROM trusted_snapshot")}
+
+
+def _save_snapshot(conn, issuers):
+    conn.execute("DELETE FROM trusted_snapshot")
+    conn.executemany("INSERT INTO trusted_snapshot (issuer) VALUES (?)", [(i,) for i in set(issuers)])
+
+
+def diff_trusted(conn, current=None):
+    """
+    Compare the current trusted list with the snapshot from the last run.
+
+    Returns:
+        tuple: (added, removed) sets of issuer names.
+    """
+    current = set(current if current is not None else load_trusted_issuers())
+    previous = trusted_snapshot(conn)
+    return current - previous, previous - current
+
+
+def certificates_for_issuers(conn, issuers):
+    """Yield (doc_id, record_dict) for every indexed certificate from the given issuers."""
+    issuers = sorted(issuers)
+    for start in range(0, len(issuers), QUERY_CHUNK):
+        chunk = issuers[start:start + QUERY_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        for doc_id, record in conn.execute(
+                f"SELECT doc_id, record FROM certificates WHERE issuer IN ({placeholders})", chunk):
+            yield doc_id, json.loads(record)
+
+
+def rescore(record):
+    """
+    Re-run issuer validation and status resolution against the current trusted list.
+    Returns the updated record dict, or None if nothing changed.
+    Deadline-cut extractions stay "Manual Review Required", as when they were first processed.
+    """
+    fields = record.get('fields') or {}
+    issuer_validation = validate_issuer(fields.get('issuer'))
+    if DEADLINE_FLAG in (record.get('confidence_flags') or []):
+        final_status, external = "Manual Review Required", None
+    else:
+        final_status, issuer_validation, external = resolve_final_status(
+            fields, record.get('confidence') or {}, record.get('validation') or {}, issuer_validation)
+    if (final_status == record.get('final_status') and issuer_validation == record.get('issuer_validation')
+            and external == record.get('external_verification')):
+        return None
+    return dict(record, final_status=final_status, issuer_validation=issuer_validation,
+                external_verification=external)
+
+
+def reverify(conn, rag=None, dry_run=False):
+    """
+    Re-score only certificates whose issuer was added to or removed from the
+    trusted list since the last run, then write changes back in bulk
+    (index rows, and the RAG store when `rag` is given).
+
+    Returns:
+        dict: 'added', 'removed' (issuer lists), 'checked' and 'changed' counts,
+              and 'transitions' {"old -> new": count}.
+    """
+    current = set(load_trusted_issuers())
+    if not conn.execute("SELECT 1 FROM trusted_snapshot LIMIT 1").fetchone():
+        # Fresh index: nothing was scored against an older list yet, just take the baseline
+        if not dry_run:
+            with conn:
+                _save_snapshot(conn, current)
+        return {'added': [], 'removed': [], 'checked': 0, 'changed': 0, 'transitions': {}}
+    added, removed = diff_trusted(conn, current)
+    summary = {'added': sorted(added), 'removed': sorted(removed), 'checked': 0, 'changed': 0, 'transitions': {}}
+    if not added and not removed:
+        return summary
+
+    pending = []
+
+    def flush():
+        batch = pending[:]
+        pending.clear()
+        if dry_run or not batch:
+            return
+        now = datetime.now().isoformat()
+        with conn:
+            conn.executemany("UPDATE certificates SET final_status = ?, record = ?, updated_at = ? WHERE doc_id = ?",
+                             [(r['final_status'], dumps(r), now, r['doc_id']) for r in batch])
+        if rag:
+            rag.ingest_many(batch)
+
+    # Materialise the affected doc list first so updates do not disturb the read cursor
+    affected = list(certificates_for_issuers(conn, added | removed))
+    for doc_id, record in affected:
+        summary['checked'] += 1
+        updated = rescore(record)
+        if not updated:
+            continue
+        transition = f"{record.get('final_status')} -> {updated['final_status']}"
+        summary['transitions'][transition] = summary['transitions'].get(transition, 0) + 1
+        summary['changed'] += 1
+        pending.append(updated)
+        if len(pending) >= UPDATE_BATCH:
+            flush()
+    flush()
+
+    if not dry_run:
+        with conn:
+            _save_snapshot(conn, current)
+    return summary
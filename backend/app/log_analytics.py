@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+from app.logging_utils import LOG_FILE
+
+LOG_INDEX_DB = os.getenv('LOG_INDEX_DB', 'extraction_logs.db')
+
+INGEST_CHUNK_BYTES = 8 * 1024 * 1024  # Read the log in 8MB slices
+INSERT_BATCH = 5000
+SIGNATURE_BYTES = 256  # Leading bytes used to recognise a file after rotation
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    doc_id TEXT,
+    ts TEXT,
+    day TEXT,
+    issuer TEXT,
+    needs_manual_review INTEGER,
+    expiry_status TEXT,
+    issued_date_valid INTEGER,
+    dates_consistent INTEGER,
+    date_error TEXT
+);
+CREATE TABLE IF NOT EXISTS flags (
+    entry_id INTEGER,
+    flag TEXT
+);
+CREATE TABLE IF NOT EXISTS watermark (
+    path TEXT PRIMARY KEY,
+    offset INTEGER,
+    signature TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_entries_ts ON entries(ts);
+CREATE INDEX IF NOT EXISTS idx_entries_issuer_ts ON entries(issuer, ts);
+CREATE INDEX IF NOT EXISTS idx_flags_flag ON flags(flag);
+CREATE INDEX IF NOT EXISTS idx_flags_entry ON flags(entry_id);
+"""
+
+
+def connect(db_path=LOG_INDEX_DB):
+    """Open (and initialise if needed) the log index database."""
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _file_signature(path, length=SIGNATURE_BYTES):
+    """
+    'length:sha1' of the first bytes of a file, used to detect rotation/truncation.
+    The length is stored with the hash so a small file that keeps growing still matches.
+    """
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(length)
+    except FileNotFoundError:
+        return None
+    return f"{len(head)}:{hashlib.sha1(head).hexdigest()}" if head else None
+
+
+def _same_file(path, signature):
+    length = int(signature.split(':', 1)[0])
+    return _file_signature(path, length) == signature
+
+
+def _row_from_entry(entry):
+    fields = entry.get('extracted_fields') or {}
+    dv = entry.get('date_validation') or {}
+    ts = entry.get('timestamp') or ''
+    return (
+        entry.get('doc_id'),
+        ts,
+        ts[:10],
+        fields.get('issuer'),
+        1 if entry.get('needs_manual_review') else 0,
+        dv.get('expiry_status'),
+        None if dv.get('issued_date_valid') is None else int(bool(dv.get('issued_date_valid'))),
+        None if dv.get('dates_consistent') is None else int(bool(dv.get('dates_consistent'))),
+        dv.get('error'),
+    )
+
+
+def _load_range(conn, path, offset):
+    """
+    Load complete lines from `path` starting at byte `offset`.
+    Returns (new_offset, rows_loaded). A trailing partial line is left for the next run.
+    """
+    loaded = 0
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        remainder = b''
+        rows, row_flags = [], []
+        while True:
+            chunk = f.read(INGEST_CHUNK_BYTES)
+            if not chunk:
+                break
+            data = remainder + chunk
+            last_nl = data.rfind(b'\n')
+            if last_nl == -1:
+                remainder = data
+                continue
+            remainder = data[last_nl + 1:]
+
+            for line in data[:last_nl].split(b'\n'):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Skip corrupt lines rather than stalling the watermark
+                rows.append(_row_from_entry(entry))
+                row_flags.append(entry.get('confidence_flags') or [])
+
+            if len(rows) >= INSERT_BATCH:
+                loaded += _insert(conn, rows, row_flags)
+                rows, row_flags = [], []
+
+        loaded += _insert(conn, rows, row_flags)
+        new_offset = f.tell() - len(remainder)
+    return new_offset, loaded
+
+
+def _insert(conn, rows, row_flags):
+    if not rows:
+        return 0
+    cur = conn.cursor()
+    for row, flags in zip(rows, row_flags):
+        cur.execute(
+            "INSERT INTO entries (doc_id, ts, day, issuer, needs_manual_review, expiry_status, "
+            "issued_date_valid, dates_consistent, date_error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            row,
+        )
+        if flags:
+            entry_id = cur.lastrowid
+            cur.executemany("INSERT INTO flags (entry_id, flag) VALUES (?, ?)",
+                            [(entry_id, flag) for flag in flags])
+    return len(rows)
+
+
+def ingest_logs(log_path=LOG_FILE, db_path=LOG_INDEX_DB):
+    """
+    Incrementally load new log lines into the index.
+
+    Only bytes past the stored watermark are read. If the log was rotated since
+    the last run, the rest of the rotated file ('.1') is loaded first and the
+    watermark restarts at the beginning of the new file.
+
+    Returns:
+        int: Number of entries loaded.
+    """
+    conn = connect(db_path)
+    key = os.path.abspath(log_path)
+    try:
+        row = conn.execute("SELECT offset, signature FROM watermark WHERE path = ?", (key,)).fetchone()
+        offset, signature = row if row else (0, None)
+
+        loaded = 0
+        if signature and not _same_file(log_path, signature):
+            rotated = f"{log_path}.1"
+            if os.path.exists(rotated) and _same_file(rotated, signature):
+                _, n = _load_range(conn, rotated, offset)
+                loaded += n
+            offset = 0
+
+        if os.path.exists(log_path):
+            if os.path.getsize(log_path) < offset:
+                offset = 0  # Truncated in place
+            offset, n = _load_range(conn, log_path, offset)
+            loaded += n
+        current_sig = _file_signature(log_path) if offset else None
+
+        conn.execute(
+            "INSERT OR REPLACE INTO watermark (path, offset, signature) VALUES (?, ?, ?)",
+            (key, offset, current_sig),
+        )
+        conn.commit()
+        return loaded
+    finally:
+        conn.close()
+
+
+def _since_clause(since):
+    """Translate '7d' / '24h' / an ISO date into a timestamp lower bound."""
+    if not since:
+        return None
+    if since[-1] in 'dh' and since[:-1].isdigit():
+        delta = timedelta(days=int(since[:-1])) if since[-1] == 'd' else timedelta(hours=int(since[:-1]))
+        return (datetime.now() - delta).isoformat()
+    return since
+
+
+def _where(since):
+    bound = _since_clause(since)
+    if not bound:
+        return "", []
+    return " WHERE e.ts >= ?", [bound]
+
+
+def review_rate_by_issuer(conn, since=None, limit=20):
+    """Manual-review rate per issuer: [(issuer, total, reviews, rate)]."""
+    where, params = _where(since)
+    sql = (
+        "SELECT COALESCE(e.issuer, '(none)'), COUNT(*), SUM(e.needs_manual_review), "
+        "ROUND(1.0 * SUM(e.needs_manual_review) / COUNT(*), 3) "
+        f"FROM entries e{where} GROUP BY e.issuer ORDER BY COUNT(*) DESC LIMIT ?"
+    )
+    return conn.execute(sql, params + [limit]).fetchall()
+
+
+def top_flags(conn, since=None, limit=20):
+    """Most common confidence flags: [(flag, count)]."""
+    where, params = _where(since)
+    sql = (
+        "SELECT f.flag, COUNT(*) FROM flags f JOIN entries e ON e.id = f.entry_id"
+        f"{where} GROUP BY f.flag ORDER BY COUNT(*) DESC LIMIT ?"
+    )
+    return conn.execute(sql, params + [limit]).fetchall()
+
+
+def date_validation_summary(conn, since=None):
+    """Counts by expiry status and consistency: [(expiry_status, dates_consistent, count)]."""
+    where, params = _where(since)
+    sql = (
+        "SELECT COALESCE(e.expiry_status, '(none)'), e.dates_consistent, COUNT(*) "
+        f"FROM entries e{where} GROUP BY e.expiry_status, e.dates_consistent ORDER BY COUNT(*) DESC"
+    )
+    return conn.execute(sql, params).fetchall()
+
+
+def daily_volume(conn, since=None):
+    """Documents and manual reviews per day: [(day, total, reviews)]."""
+    where, params = _where(since)
+    sql = (
+        "SELECT e.day, COUNT(*), SUM(e.needs_manual_review) "
+        f"FROM entries e{where} GROUP BY e.day ORDER BY e.day"
+    )
+    return conn.execute(sql, params).fetchall()
@@ -1,14 +1,201 @@
-import json
-from datetime import datetime
+import atexit
 import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
+from app.records import dumps
 from app.security import redact_pii
 
-LOG_FILE = 'extraction_logs.json'
+LOG_FILE = os.getenv('EXTRACTION_LOG_FILE', 'extraction_logs.json')
+
+# Background writer tuning
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))         # Max pending entries
+LOG_FLUSH_INTERVAL = float(os.getenv('LOG_FLUSH_INTERVAL', '1.0'))  # Seconds between flushes
+LOG_FLUSH_BATCH = int(os.getenv('LOG_FLUSH_BATCH', '200'))          # Flush early at this many entries
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(50 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+LOG_ENQUEUE_TIMEOUT = 0.5  # Seconds to wait on a full queue before writing inline
+
+
+class _FileLock:
+    """
+    Exclusive lock on a sidecar '.lock' file.
+    Serializes appends and rotation across processes sharing the same log.
+    """
+
+    def __init__(self, path):
+        self.path = path + '.lock'
+        self._fh = None
+
+    def __enter__(self):
+        self._fh = open(self.path, 'a+')
+        if fcntl:
+            fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+        else:
+            self._fh.seek(0)
+            msvcrt.locking(self._fh.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if fcntl:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+            else:
+                self._fh.seek(0)
+                msvcrt.locking(self._fh.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._fh.close()
+            self._fh = None
+
+
+class LogWriter:
+    """
+    Buffered JSONL writer running on a background thread.
+
+    Entries are queued by the request path and written in batches, either every
+    `flush_interval` seconds or as soon as `batch_size` lines are pending.
+    The file is rotated by size (log.1 ... log.N) and all writes happen under a
+    cross-process file lock, so several workers can share one log file.
+    """
+
+    def __init__(self, path=LOG_FILE, max_queue=LOG_QUEUE_SIZE, flush_interval=LOG_FLUSH_INTERVAL,
+                 batch_size=LOG_FLUSH_BATCH, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.pid = os.getpid()
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = _FileLock(path)
+        self._write_lock = threading.Lock()  # Inline writes (full queue, after close) race the writer thread
+        self._flush_requests = []
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='extraction-log-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, line):
+        """Queue one serialized line. Falls back to a direct write if the queue stays full."""
+        if self._closed:
+            self._write_batch([line])
+            return
+        try:
+            self._queue.put(line, timeout=LOG_ENQUEUE_TIMEOUT)
+        except queue.Full:
+            self._write_batch([line])
+
+    def flush(self, timeout=5.0):
+        """Block until everything queued so far has been written."""
+        if self._closed:
+            return
+        deadline = time.monotonic() + timeout
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(max(0.0, deadline - time.monotonic()))
+
+    def close(self, timeout=5.0):
+        """Flush pending entries and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return  # The daemon thread keeps draining what is queued
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+
+    def _run(self):
+        pending = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = ()
+
+            if isinstance(item, str):
+                pending.append(item)
+                if len(pending) < self.batch_size:
+                    continue
+
+            # Interval elapsed, batch full, flush requested or shutdown
+            if pending:
+                self._write_batch(pending)
+                pending = []
+            deadline = time.monotonic() + self.flush_interval
+
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is None:
+                return
+
+    def _write_batch(self, lines):
+        data = ''.join(lines)
+        try:
+            with self._write_lock, self._lock:
+                self._rotate_if_needed(len(data.encode('utf-8')))
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(data)
+        except Exception as e:
+            print(f"Error writing to log file: {e}")
+
+    def _rotate_if_needed(self, incoming_bytes):
+        if self.max_bytes <= 0 or not os.path.exists(self.path):
+            return
+        if os.path.getsize(self.path) + incoming_bytes <= self.max_bytes:
+            return
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_log_writer():
+    """Return the process-wide log writer, (re)starting it after a fork."""
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer.pid != os.getpid():
+            _writer = LogWriter()
+        return _writer
+
+
+def flush_logs():
+    """Write out any buffered log entries."""
+    if _writer is not None and _writer.pid == os.getpid():
+        _writer.flush()
+
+
+@atexit.register
+def _shutdown_log_writer():
+    if _writer is not None and _writer.pid == os.getpid():
+        _writer.close()
+
 
 def log_extraction(doc_id, fields, confidence, date_validation, flags):
     """
     Log extraction results to a JSON line file.
+    The entry is queued for the background writer; call flush_logs() to force it to disk.
     
     Args:
         doc_id (str): Unique identifier for the document.
@@ -35,12 +222,8 @@ def log_extraction(doc_id, fields, confidence, date_validation, flags):
         "needs_manual_review": len(flags) > 0
     }
     
-    # Write to log file (append mode)
-    try:
-        with open(LOG_FILE, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(log_entry) + '\n')
-    except Exception as e:
-        print(f"Error writing to log file: {e}")
+    # Hand off to the background writer (batched, rotated, process-safe)
+    get_log_writer().write(dumps(log_entry) + '\n')
     
     return log_entry
 
@@ -0,0 +1,153 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Upper bounds (seconds) for latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Counters that are always exported, even before the first increment
+DEFAULT_COUNTERS = ('extraction_reused', 'vision_ocr_reused', 'api_errors', 'retries', 'throttled')
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (cumulative buckets, Prometheus style)."""
+
+    __slots__ = ('buckets', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Approximate quantile: upper bound of the bucket containing the q-th observation."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        running = 0
+        for i, c in enumerate(self.counts):
+            running += c
+            if running >= target:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.total, 6),
+            'avg': round(self.total / self.count, 6) if self.count else 0.0,
+            'max': round(self.max, 6),
+            'p50': self.quantile(0.50),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class MetricsRegistry:
+    """
+    In-process store for latency histograms and counters.
+    Histograms are keyed by kind ('stage' or 'model_call') and name.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = {name: 0 for name in DEFAULT_COUNTERS}
+
+    def observe(self, kind, name, seconds):
+        with self._lock:
+            hist = self.histograms.get((kind, name))
+            if hist is None:
+                hist = self.histograms[(kind, name)] = Histogram()
+            hist.observe(seconds)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        """JSON-friendly copy of all metrics."""
+        with self._lock:
+            out = {'stages': {}, 'model_calls': {}, 'counters': dict(self.counters)}
+            for (kind, name), hist in sorted(self.histograms.items()):
+                section = 'stages' if kind == 'stage' else 'model_calls'
+                out[section][name] = hist.to_dict()
+            return out
+
+    def render_prometheus(self):
+        """Render metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for kind in ('stage', 'model_call'):
+                metric = f"certificate_{kind}_latency_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for (k, name), hist in sorted(self.histograms.items()):
+                    if k != kind:
+                        continue
+                    running = 0
+                    for bound, c in zip(hist.buckets, hist.counts):
+                        running += c
+                        lines.append(f'{metric}_bucket{{{kind}="{name}",le="{bound}"}} {running}')
+                    lines.append(f'{metric}_bucket{{{kind}="{name}",le="+Inf"}} {hist.count}')
+                    lines.append(f'{metric}_sum{{{kind}="{name}"}} {hist.total:.6f}')
+                    lines.append(f'{metric}_count{{{kind}="{name}"}} {hist.count}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE certificate_{name}_total counter")
+                lines.append(f"certificate_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def span(stage):
+    """Time a pipeline stage: `with span('ocr'): ...`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe('stage', stage, time.perf_counter() - start)
+
+
+@contextmanager
+def model_call(name):
+    """Time a single model API call; failures also count towards 'api_errors'."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        registry.incr('api_errors')
+        raise
+    finally:
+        registry.observe('model_call', name, time.perf_counter() - start)
+
+
+def timed(stage):
+    """Decorator form of span()."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def incr(name, amount=1):
+    registry.incr(name, amount)
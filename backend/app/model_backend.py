@@ -0,0 +1,239 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+from openai import AzureOpenAI
+
+from app.metrics import incr
+
+# live: Azure OpenAI. record: Azure OpenAI, saving every successful request/response pair
+# to the cassette. replay: cassette only, no keys or network needed (misses raise CassetteMiss).
+MODEL_BACKEND = os.getenv('MODEL_BACKEND', 'live')
+MODEL_CASSETTE_DIR = os.getenv('MODEL_CASSETTE_DIR', 'cassettes')
+MODEL_REPLAY_LATENCY = float(os.getenv('MODEL_REPLAY_LATENCY', '0'))      # Recorded latency scale on replay (1 = as recorded)
+
+# Call options that do not change the answer, left out of the request hash
+UNHASHED_OPTIONS = ('timeout', 'extra_headers', 'extra_query')
+
+_factory = None  # Client factory installed by set_client_factory (benchmarks, tests)
+
+
+class CassetteMiss(LookupError):
+    """Replay mode has no recorded response for this request."""
+
+
+def azure_endpoint():
+    """Base Azure endpoint if usable keys are configured, else None."""
+    api_key = os.getenv('AZURE_OPENAI_API_KEY')
+    endpoint = os.getenv('AZURE_OPENAI_ENDPOINT')
+    if not api_key or not endpoint or "your-key" in api_key:
+        return None
+    # Clean the endpoint if it contains the full path/query params
+    return endpoint.split("/openai/deployments")[0].split("?")[0]
+
+
+def available():
+    """True when model calls can be made: live keys, a cassette to replay, or an installed factory."""
+    return MODEL_BACKEND == 'replay' or _factory is not None or azure_endpoint() is not None
+
+
+def set_client_factory(factory):
+    """Route live/record clients through `factory()` instead of AzureOpenAI; returns the previous factory."""
+    global _factory
+    previous, _factory = _factory, factory
+    return previous
+
+
+def get_client():
+    """Client for the configured MODEL_BACKEND, exposing chat.completions.create and embeddings.create."""
+    if MODEL_BACKEND == 'replay':
+        return ReplayClient(get_cassette())
+    if _factory is not None:
+        client = _factory()
+    else:
+        client = AzureOpenAI(
+            api_key=os.getenv('AZURE_OPENAI_API_KEY'),
+            api_version=os.getenv('AZURE_OPENAI_API_VERSION', "2024-02-15-preview"),
+            azure_endpoint=azure_endpoint() or os.getenv('AZURE_OPENAI_ENDPOINT'),
+            max_retries=0  # Retries/backoff are handled by the shared rate limiter
+        )
+    if MODEL_BACKEND == 'record':
+        return RecordingClient(client, get_cassette())
+    return client
+
+
+# --- Request keys and response (de)serialization ------------------------------
+
+def _strip_images(messages):
+    """Messages with inline image data replaced by its digest (keeps cassettes small and readable)."""
+    out = []
+    for message in messages or []:
+        content = message.get('content')
+        if isinstance(content, list):
+            parts = []
+            for part in content:
+                if part.get('type') == 'image_url':
+                    url = part['image_url']['url']
+                    part = {'type': 'image_url', 'image_sha256': hashlib.sha256(url.encode('utf-8')).hexdigest()}
+                parts.append(part)
+            message = dict(message, content=parts)
+        out.append(message)
+    return out
+
+
+def describe_request(kind, options):
+    """(kind, JSON-safe request, key) for a create() call; the key ignores UNHASHED_OPTIONS."""
+    request = {k: v for k, v in options.items() if k not in UNHASHED_OPTIONS}
+    if 'messages' in request:
+        request['messages'] = _strip_images(request['messages'])
+    if kind == 'chat' and any(isinstance(m.get('content'), list) for m in request.get('messages', [])):
+        kind = 'vision'
+    canonical = json.dumps({'kind': kind, 'request': request}, sort_keys=True, ensure_ascii=False, default=str)
+    return kind, request, hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _to_data(obj):
+    if hasattr(obj, 'model_dump'):
+        return obj.model_dump(mode='json')
+    if isinstance(obj, SimpleNamespace):
+        obj = vars(obj)
+    if isinstance(obj, dict):
+        return {k: _to_data(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_to_data(v) for v in obj]
+    return obj
+
+
+def _to_namespace(data):
+    if isinstance(data, dict):
+        return SimpleNamespace(**{k: _to_namespace(v) for k, v in data.items()})
+    if isinstance(data, list):
+        return [_to_namespace(v) for v in data]
+    return data
+
+
+# --- Cassettes ---------------------------------------------------------------
+
+class Cassette:
+    """
+    Recorded responses: one JSONL file per kind (chat, vision, embeddings) in `directory`,
+    indexed by request key. Identical requests (temperature > 0 votes) are kept in
+    recording order and served back in that order.
+    """
+
+    def __init__(self, directory=MODEL_CASSETTE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> [entry, ...] in recording order
+        self._served = {}   # key -> responses served so far
+        self._load()
+
+    def _load(self):
+        if not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.jsonl'):
+                continue
+            with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line from an interrupted run
+                    self._entries.setdefault(entry['key'], []).append(entry)
+
+    def __len__(self):
+        return sum(len(v) for v in self._entries.values())
+
+    def record(self, kind, request, key, response, latency):
+        entry = {'key': key, 'kind': kind, 'latency': round(latency, 4),
+                 'request': request, 'response': _to_data(response)}
+        with self._lock:
+            self._entries.setdefault(key, []).append(entry)
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, f"{kind}.jsonl"), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+
+    def play(self, kind, key):
+        """Next recorded entry for the key (cycling once all have been served), or raise CassetteMiss."""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMiss(f"No recorded {kind} response for request {key[:12]} in {self.directory}")
+            served = self._served.get(key, 0)
+            self._served[key] = served + 1
+            return entries[served % len(entries)]
+
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+
+def get_cassette(directory=None):
+    """Process-wide cassette per directory (shared by every client and worker thread)."""
+    directory = directory or MODEL_CASSETTE_DIR
+    with _cassettes_lock:
+        if directory not in _cassettes:
+            _cassettes[directory] = Cassette(directory)
+        return _cassettes[directory]
+
+
+# --- Clients -----------------------------------------------------------------
+
+class _RecordingEndpoint:
+    def __init__(self, create, kind, cassette):
+        self._create = create
+        self._kind = kind
+        self._cassette = cassette
+
+    def create(self, **options):
+        kind, request, key = describe_request(self._kind, options)
+        started = time.perf_counter()
+        response = self._create(**options)
+        self._cassette.record(kind, request, key, response, time.perf_counter() - started)
+        return response
+
+
+class RecordingClient:
+    """Wraps a live client; successful responses are written to the cassette (errors are not)."""
+
+    def __init__(self, client, cassette):
+        self.chat = SimpleNamespace(completions=_RecordingEndpoint(client.chat.completions.create, 'chat', cassette))
+        self.embeddings = _RecordingEndpoint(client.embeddings.create, 'embeddings', cassette)
+
+
+class _ReplayEndpoint:
+    def __init__(self, kind, cassette):
+        self._kind = kind
+        self._cassette = cassette
+
+    def create(self, **options):
+        kind, _, key = describe_request(self._kind, options)
+        try:
+            entry = self._cassette.play(kind, key)
+        except CassetteMiss:
+            incr('model_replay_misses')
+            raise
+        incr('model_replay_hits')
+        delay = entry.get('latency', 0) * MODEL_REPLAY_LATENCY
+        timeout = options.get('timeout')
+        if timeout and delay > timeout:
+            # The recorded call would not have finished in time: fail the same way the live client does
+            time.sleep(timeout)
+            raise openai.APITimeoutError(request=httpx.Request('POST', f"replay://{kind}"))
+        if delay:
+            time.sleep(delay)
+        return _to_namespace(entry['response'])
+
+
+class ReplayClient:
+    """Serves recorded responses by request hash, optionally with the recorded latency."""
+
+    def __init__(self, cassette):
+        self.chat = SimpleNamespace(completions=_ReplayEndpoint('chat', cassette))
+        self.embeddings = _ReplayEndpoint('embeddings', cassette)
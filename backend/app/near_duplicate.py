@@ -0,0 +1,229 @@
+import copy
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from app.document import as_document
+
+NEAR_DUP_DETECTION = os.getenv('NEAR_DUP_DETECTION', '1') != '0'
+NEAR_DUP_THRESHOLD = float(os.getenv('NEAR_DUP_THRESHOLD', '0.8'))  # Estimated Jaccard to count as near-duplicate
+NEAR_DUP_REUSE = os.getenv('NEAR_DUP_REUSE', '0') == '1'             # Reuse the earlier extraction when safe
+NEAR_DUP_MAX_DOCS = int(os.getenv('NEAR_DUP_MAX_DOCS', '10000'))     # Oldest documents are evicted past this
+
+SHINGLE_SIZE = 5      # Character shingles survive OCR noise better than word shingles
+NUM_PERM = 128        # MinHash permutations
+LSH_BANDS = 32        # 32 bands x 4 rows: candidate probability ~0.999 at Jaccard 0.7, ~0.05 at 0.2
+_PRIME = (1 << 31) - 1
+
+_rng = np.random.default_rng(42)
+_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)
+
+
+def _normalize(text):
+    return ' '.join(re.findall(r'\w+', (text or '').lower()))
+
+
+def shingles(text, k=SHINGLE_SIZE, normalized=None):
+    """Set of k-character shingles of the lower-cased, punctuation-free text (or of `normalized`)."""
+    norm = _normalize(text) if normalized is None else normalized
+    if len(norm) <= k:
+        return {norm} if norm else set()
+    return {norm[i:i + k] for i in range(len(norm) - k + 1)}
+
+
+def minhash_signature(text, normalized=None):
+    """
+    MinHash signature (NUM_PERM uint64 values) of the text's shingle set,
+    or None for empty text. Matching positions estimate Jaccard similarity.
+    """
+    items = shingles(text, normalized=normalized)
+    if not items:
+        return None
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in items), dtype=np.uint64, count=len(items))
+    # (a * x + b) mod p, with x < 2^32 and a < 2^31 so the product fits in uint64
+    return ((_A[:, None] * (hashes % _PRIME)[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def document_signature(document):
+    """MinHash signature of a Document, computed once and cached on it."""
+    return document.memo('minhash', lambda: minhash_signature(None, normalized=document.normalized))
+
+
+def estimate_similarity(sig_a, sig_b):
+    return float(np.count_nonzero(sig_a == sig_b)) / len(sig_a)
+
+
+def _band_keys(signature):
+    rows = NUM_PERM // LSH_BANDS
+    return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(LSH_BANDS)]
+
+
+class NearDuplicateIndex:
+    """
+    In-memory MinHash + LSH index of recently ingested certificate texts.
+    Lookups touch only the documents sharing an LSH band, not the whole collection.
+    """
+
+    def __init__(self, threshold=NEAR_DUP_THRESHOLD, max_docs=NEAR_DUP_MAX_DOCS):
+        self.threshold = threshold
+        self.max_docs = max_docs
+        self._lock = threading.Lock()
+        self._docs = OrderedDict()  # doc_id -> (signature, text, extractor_output, content_hash)
+        self._buckets = {}          # (band, key) -> set of doc_ids
+        self._hashes = {}           # content_hash -> doc_ids with exactly that text
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, doc_id, text, extractor_output=None, signature=None, content_hash=None):
+        signature = signature if signature is not None else minhash_signature(text)
+        if signature is None:
+            return
+        with self._lock:
+            self._remove(doc_id)
+            self._docs[doc_id] = (signature, text, extractor_output, content_hash)
+            for key in _band_keys(signature):
+                self._buckets.setdefault(key, set()).add(doc_id)
+            if content_hash:
+                self._hashes.setdefault(content_hash, set()).add(doc_id)
+            while len(self._docs) > self.max_docs:
+                self._remove(next(iter(self._docs)))
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        entry = self._docs.pop(doc_id, None)
+        if entry is None:
+            return
+        for key in _band_keys(entry[0]):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(doc_id)
+                if not bucket:
+                    del self._buckets[key]
+        if entry[3]:
+            same = self._hashes.get(entry[3])
+            if same is not None:
+                same.discard(doc_id)
+                if not same:
+                    del self._hashes[entry[3]]
+
+    def find_exact(self, content_hash, exclude=None):
+        """An indexed doc_id with exactly this content hash (dict lookup, no signature needed), or None."""
+        with self._lock:
+            return min((d for d in self._hashes.get(content_hash, ()) if d != exclude), default=None)
+
+    def query(self, text=None, signature=None, exclude=None):
+        """
+        Find indexed documents similar to the text.
+
+        Returns:
+            list: (doc_id, similarity) pairs at or above the threshold, most similar first.
+        """
+        signature = signature if signature is not None else minhash_signature(text)
+        if signature is None:
+            return []
+        with self._lock:
+            candidates = set()
+            for key in _band_keys(signature):
+                candidates.update(self._buckets.get(key, ()))
+            candidates.discard(exclude)
+            scored = [(doc_id, estimate_similarity(signature, self._docs[doc_id][0])) for doc_id in candidates]
+        matches = [(doc_id, sim) for doc_id, sim in scored if sim >= self.threshold]
+        return sorted(matches, key=lambda m: (-m[1], m[0]))
+
+    def entry(self, doc_id):
+        with self._lock:
+            return self._docs.get(doc_id)
+
+
+def _field_values(extractor_output):
+    values = []
+    for name, data in (extractor_output or {}).items():
+        if name.startswith('_'):
+            continue
+        value = data.get('value') if isinstance(data, dict) else data
+        if value:
+            values.append(_normalize(str(value)))
+    return [v for v in values if v]
+
+
+def changed_lines(old_text, new_text):
+    """Normalized lines present in only one of the two texts."""
+    old = {_normalize(line) for line in (old_text or '').splitlines()}
+    new = {_normalize(line) for line in (new_text or '').splitlines()}
+    return (old ^ new) - {''}
+
+
+def can_reuse_extraction(old_text, new_text, extractor_output):
+    """
+    Cheap diff check: the earlier extraction is reusable when no line that differs
+    between the two texts carries digits (dates, certificate numbers) or any of the
+    earlier field values. A recipient-name change passes; a new date or number does not.
+    """
+    if not extractor_output:
+        return False
+    values = _field_values(extractor_output)
+    for line in changed_lines(old_text, new_text):
+        if any(ch.isdigit() for ch in line) or any(v in line for v in values):
+            return False
+    return True
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Process-wide index (shared by upload and batch workers)."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = NearDuplicateIndex()
+        return _index
+
+
+def check(doc_id, text_content, reuse=NEAR_DUP_REUSE):
+    """
+    Look up the closest earlier near-duplicate of a document (a string or an app.document.Document).
+    Exact copies are found by content hash before any MinHash work.
+
+    Returns:
+        tuple: (match, extractor_output). match is None or
+               {'doc_id', 'similarity', 'reused_extraction'}; extractor_output is a
+               copy of the earlier extraction when it can be reused, else None.
+               Identical text (e.g. OCR text reused for a matching image) is always reused.
+    """
+    if not NEAR_DUP_DETECTION:
+        return None, None
+    document = as_document(text_content)
+    index = get_index()
+    exact = index.find_exact(document.content_hash, exclude=doc_id)
+    if exact:
+        match_id, similarity = exact, 1.0
+    else:
+        matches = index.query(signature=document_signature(document), exclude=doc_id)
+        if not matches:
+            return None, None
+        match_id, similarity = matches[0]
+    entry = index.entry(match_id)
+    reused = None
+    if entry and (reuse or entry[3] == document.content_hash) and \
+            can_reuse_extraction(entry[1], document.text, entry[2]):
+        reused = copy.deepcopy(entry[2])
+    return {'doc_id': match_id, 'similarity': round(similarity, 3), 'reused_extraction': reused is not None}, reused
+
+
+def register(doc_id, text_content, extractor_output):
+    """Add a processed document (a string or an app.document.Document) so later ones can be matched against it."""
+    if NEAR_DUP_DETECTION:
+        document = as_document(text_content)
+        get_index().add(doc_id, document.text, extractor_output,
+                        signature=document_signature(document), content_hash=document.content_hash)
@@ -2,17 +2,27 @@ import os
 import base64
 import mimetypes
 from pypdf import PdfReader
-from openai import AzureOpenAI
 
+from app.deadline import DeadlineExceeded
+from app.image_dedup import image_hash, image_sha256, get_cache
+from app.metrics import incr
+from app.model_backend import get_client
+from app.rate_limiter import call_model
 from app.security import validate_secure_path, check_file_size
 
-def extract_text_from_file(file_path):
+# Rough prompt cost of one high-detail certificate image
+VISION_IMAGE_TOKENS = 1100
+VISION_CALL_TIMEOUT = 120  # Seconds; a request deadline can only shorten it
+
+def extract_text_from_file(file_path, deadline=None):
     """
     Extract text from a file.
     Strategies:
     1. Direct Text Read (TXT)
     2. Digital PDF Extraction (PyPDF)
     3. Vision OCR (Azure GPT-4) - For images & scanned PDFs
+
+    Raises DeadlineExceeded if `deadline` runs out before Vision OCR completes.
     """
     # --- SECURITY CHECKS ---
     safe_path = validate_secure_path(file_path)
@@ -47,24 +57,40 @@ def extract_text_from_file(file_path):
                 pass 
 
         elif ext in ['jpg', 'jpeg', 'png', 'bmp', 'tiff']:
-            print(f"📷 Image detected ({ext}). Using Azure Vision OCR...")
-            text_content = extract_with_vision(file_path)
+            # Byte-identical re-uploads, and copies confirmed by size and thumbnail (re-encoded or
+            # re-compressed), reuse the earlier OCR text. A dHash match alone is only flagged:
+            # same-template certificates for different people look alike.
+            signature, sha256 = image_hash(file_path), image_sha256(file_path)
+            cached = get_cache().lookup(signature, sha256) if (signature is not None or sha256) else None
+            if cached and cached['confirmed'] and cached['text']:
+                match = 'is identical to' if cached['exact'] else f"matches (hash distance {cached['distance']})"
+                print(f"🖼️  Image {match} {cached['doc_id']}. Reusing its OCR text...")
+                incr('vision_ocr_reused')
+                text_content = cached['text']
+            else:
+                if cached:
+                    print(f"🖼️  Image resembles {cached['doc_id']} (hash distance {cached['distance']}); "
+                          "running OCR anyway.")
+                    incr('vision_ocr_similar')
+                print(f"📷 Image detected ({ext}). Using Azure Vision OCR...")
+                text_content = extract_with_vision(file_path, deadline=deadline)
+                if (signature is not None or sha256) and text_content:
+                    get_cache().add(signature, os.path.basename(file_path).split('.')[0], text_content, sha256)
             used_ocr = True
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"❌ Critical Reading Error: {e}")
 
     return text_content, used_ocr
 
-def extract_with_vision(file_path):
+def extract_with_vision(file_path, deadline=None):
     """
     Use Azure OpenAI (GPT-4 Vision) to read text from an image.
+    The call's timeout is cut to what is left of `deadline`, if given.
     """
-    client = AzureOpenAI(
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-    )
+    client = get_client()
     
     # Determine MIME type
     mime_type, _ = mimetypes.guess_type(file_path)
@@ -78,7 +104,9 @@ def extract_with_vision(file_path):
     try:
         deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4")
         
-        response = client.chat.completions.create(
+        response = call_model(
+            'vision_ocr', client.chat.completions.create,
+            tokens=VISION_IMAGE_TOKENS + 2000,
             model=deployment,
             messages=[
                 {
@@ -98,9 +126,13 @@ def extract_with_vision(file_path):
                     ]
                 }
             ],
-            max_tokens=2000
+            max_tokens=2000,
+            timeout=VISION_CALL_TIMEOUT,
+            deadline=deadline
         )
         return response.choices[0].message.content
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"❌ Vision OCR Failed: {e}")
         return ""
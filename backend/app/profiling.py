@@ -0,0 +1,211 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+# Off unless one of these switches it on for a request
+PROFILE_REQUESTS = os.getenv('PROFILE_REQUESTS', '0') == '1'           # Profile every request
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))     # Fraction of requests, e.g. 0.01
+PROFILE_HEADER = os.getenv('PROFILE_HEADER', 'X-Profile')              # Per-request opt-in header ...
+PROFILE_HEADER_ENABLED = os.getenv('PROFILE_HEADER_ENABLED', '0') == '1'  # ... honoured only when enabled
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'sampling')                   # 'sampling' or 'deterministic'
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))       # Seconds between stack samples
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', '25'))                      # Functions listed in the summary
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))         # Oldest reports are removed past this
+
+
+def should_profile(header_value=None):
+    """Decide once per request; cheap enough to call on every request when profiling is off."""
+    if PROFILE_REQUESTS:
+        return True
+    if PROFILE_HEADER_ENABLED and header_value and header_value.lower() not in ('0', 'false', 'no'):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampler: a helper thread records every other thread's stack (or only
+    `thread_id`'s) every `interval` seconds, rooted at the thread's name, so work a
+    request hands to a thread pool is sampled too. Time spent waiting on model calls
+    shows up as well, which is usually where an upload's latency goes.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id  # None: all threads but the sampler's own
+        self.stacks = Counter()  # ('[thread name]', frame labels root first...) -> samples
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (self.thread_id and ident != self.thread_id):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[(f"[{names.get(ident, ident)}]", *reversed(stack))] += 1
+
+    @property
+    def samples(self):
+        return sum(self.stacks.values())
+
+    def collapsed(self):
+        """Folded stacks ('root;child;leaf count' per line) for flamegraph.pl or speedscope."""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit=PROFILE_TOP):
+        """[(label, self_samples, total_samples)] ordered by self samples."""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        return [(label, n, total[label]) for label, n in own.most_common(limit)]
+
+    def summary(self, wall_seconds):
+        samples = self.samples or 1
+        threads = Counter()
+        for stack, count in self.stacks.items():
+            threads[stack[0]] += count
+        lines = [f"{self.samples} samples every {self.interval * 1000:g} ms over {wall_seconds:.3f}s wall time",
+                 "threads: " + ", ".join(f"{name} {n}" for name, n in threads.most_common()),
+                 "", f"{'self %':>7} {'total %':>8}  function"]
+        for label, own, total in self.top_functions():
+            lines.append(f"{100 * own / samples:7.1f} {100 * total / samples:8.1f}  {label}")
+        return "\n".join(lines) + "\n"
+
+
+class RequestProfile:
+    """
+    One profiled request: start(), then finish() writes the reports and returns the base path.
+
+    cProfile only sees the thread that enabled it, so in deterministic mode calls
+    handed to worker threads through propagate() are profiled separately and
+    merged into the request's stats.
+    """
+
+    def __init__(self, name, mode=PROFILE_MODE, directory=PROFILE_DIR):
+        self.name = name
+        self.mode = mode
+        self.directory = directory
+        self._profiler = None
+        self._workers = []  # cProfile.Profile per propagated worker call
+        self._lock = threading.Lock()
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        if self.mode == 'deterministic':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._profiler = SamplingProfiler().start()
+        _active.profile = self
+        return self
+
+    def run_in_worker(self, func, *args, **kwargs):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # This thread is already being profiled
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._workers.append(profiler)
+
+    def finish(self):
+        wall = time.perf_counter() - self._started
+        if getattr(_active, 'profile', None) is self:
+            _active.profile = None
+        if self.mode == 'deterministic':
+            self._profiler.disable()
+        else:
+            self._profiler.stop()
+
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        base = os.path.join(self.directory, f"{stamp}_{self.name}_{os.getpid()}_{threading.get_ident()}")
+        if self.mode == 'deterministic':
+            # Binary stats load in pstats / snakeviz; the summary is sorted by cumulative time
+            out = io.StringIO()
+            with self._lock:
+                stats = pstats.Stats(self._profiler, *self._workers, stream=out)
+                workers = len(self._workers)
+            stats.dump_stats(base + '.prof')
+            stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+            summary = f"{wall:.3f}s wall time, {workers} worker call(s) merged\n{out.getvalue()}"
+        else:
+            with open(base + '.collapsed', 'w') as f:
+                f.write(self._profiler.collapsed())
+            summary = self._profiler.summary(wall)
+        with open(base + '.txt', 'w') as f:
+            f.write(f"{self.name}: {summary}")
+        _prune(self.directory)
+        print(f"🔬 Profile for {self.name} written to {base}.* ({wall:.2f}s)")
+        return base
+
+
+_active = threading.local()  # .profile: the RequestProfile started on this thread, if any
+
+
+def propagate(func):
+    """
+    Wrap `func` before handing it to a worker thread, so the deterministic profile
+    of the current request (if any) covers its calls too. Sampling needs no help:
+    it already samples every thread.
+    """
+    profile = getattr(_active, 'profile', None)
+    if profile is None or profile.mode != 'deterministic':
+        return func
+
+    def run(*args, **kwargs):
+        return profile.run_in_worker(func, *args, **kwargs)
+    return run
+
+
+def _prune(directory, keep=PROFILE_MAX_FILES):
+    """Keep the newest `keep` reports (a report is a .txt summary plus its stack/stats file)."""
+    summaries = sorted(f for f in os.listdir(directory) if f.endswith('.txt'))
+    for name in summaries[:max(0, len(summaries) - keep)]:
+        stem = os.path.join(directory, name[:-4])
+        for ext in ('.txt', '.collapsed', '.prof'):
+            if os.path.exists(stem + ext):
+                os.remove(stem + ext)
+
+
+def start_request_profile(name, header_value=None):
+    """RequestProfile already started for this request, or None when it is not selected."""
+    if not should_profile(header_value):
+        return None
+    return RequestProfile(name).start()
@@ -0,0 +1,103 @@
+import os
+import re
+
+from app.text_windows import estimate_tokens, CHARS_PER_TOKEN
+
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv('RAG_CONTEXT_TOKEN_BUDGET', '600'))
+
+# Labels written by CertificateRAG._searchable_text -> short column names, in display order
+COLUMNS = [
+    ('Certificate ID', 'id'),
+    ('Issuer', 'issuer'),
+    ('Subject', 'subject'),
+    ('Issued Date', 'issued'),
+    ('Expiry Date', 'expires'),
+    ('Certificate Number', 'number'),
+    ('Validation Status', 'status'),
+]
+LABEL_TO_COLUMN = {label.lower(): column for label, column in COLUMNS}
+EMPTY_VALUES = {'', 'unknown', 'n/a', 'none', 'null'}
+LINE_RE = re.compile(r'^\s*([A-Za-z][A-Za-z ]*?)\s*:\s*(.*?)\s*$')
+
+
+def parse_record(document):
+    """
+    {column: value} for the known 'Label: value' lines of a stored document,
+    dropping empty / placeholder values. Unrecognised text goes under 'text'.
+    """
+    record, other = {}, []
+    for line in (document or '').splitlines():
+        match = LINE_RE.match(line)
+        column = LABEL_TO_COLUMN.get(match.group(1).lower()) if match else None
+        if column:
+            value = ' '.join(match.group(2).split())
+            if value.lower() not in EMPTY_VALUES:
+                record[column] = value
+        elif line.strip():
+            other.append(' '.join(line.split()))
+    if other:
+        record['text'] = ' '.join(other)
+    return record
+
+
+def _dedup_key(record):
+    # Same certificate content under different ids (re-uploads, copies) collapses to one row
+    return tuple(sorted((k, v.casefold()) for k, v in record.items() if k != 'id'))
+
+
+def _cell(value):
+    return (value or '-').replace('|', '/')
+
+
+def build_context(documents, token_budget=RAG_CONTEXT_TOKEN_BUDGET):
+    """
+    Render retrieved certificate documents as one compact table for the answer prompt.
+
+    Records are kept in retrieval order (most relevant first); duplicates merge
+    their ids into one row, columns that are empty for every row are dropped,
+    and rows stop being added once the table would exceed `token_budget`.
+
+    Returns:
+        tuple: (context_text, stats) with stats 'records', 'rows', 'duplicates',
+               'truncated', 'tokens_before' and 'tokens'.
+    """
+    rows, seen = [], {}
+    for document in documents or []:
+        record = parse_record(document)
+        if not record:
+            continue
+        key = _dedup_key(record)
+        if key in seen:
+            if record.get('id'):
+                seen[key]['id'] = ', '.join(filter(None, [seen[key].get('id'), record['id']]))
+            continue
+        seen[key] = record
+        rows.append(record)
+
+    stats = {'records': len(documents or []), 'rows': 0, 'duplicates': len(documents or []) - len(rows),
+             'truncated': 0, 'tokens_before': estimate_tokens("\n---\n".join(documents or [])), 'tokens': 0}
+    if not rows:
+        return "", stats
+
+    columns = [c for _, c in COLUMNS if any(c in r for r in rows)]
+    if any('text' in r for r in rows):
+        columns.append('text')
+    lines = [' | '.join(columns)]
+    tokens = estimate_tokens(lines[0])
+    for record in rows:
+        line = ' | '.join(_cell(record.get(c)) for c in columns)
+        cost = estimate_tokens(line) + 1
+        if tokens + cost > token_budget:
+            if stats['rows']:
+                stats['truncated'] = len(rows) - stats['rows']
+                break
+            # Always keep the best match, cut to fit (only free text can be this long)
+            line = line[:max(0, token_budget - tokens - 1) * CHARS_PER_TOKEN]
+            cost = estimate_tokens(line) + 1
+        lines.append(line)
+        tokens += cost
+        stats['rows'] += 1
+
+    context = "\n".join(lines)
+    stats['tokens'] = estimate_tokens(context)
+    return context, stats
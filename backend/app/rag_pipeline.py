@@ -1,40 +1,47 @@
-import chromadb
-from openai import AzureOpenAI
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from app.deadline import DeadlineExceeded
+from app.metrics import span, incr
+from app.model_backend import available as model_available, get_client
+from app.profiling import propagate
+from app.rag_context import build_context
+from app.rate_limiter import call_model
+from app.text_windows import estimate_tokens
+from app.vector_store import get_vector_store, store_root, active_collection
+
+EMBEDDING_BATCH_SIZE = 64  # Texts per embeddings API call
+RAG_ANSWER_CONCURRENCY = int(os.getenv('RAG_ANSWER_CONCURRENCY', '8'))  # Parallel answers in answer_many
+RAG_N_RESULTS = int(os.getenv('RAG_N_RESULTS', '8'))  # Records retrieved per question (context is token-budgeted)
+EMBEDDING_FAILED_ANSWER = "I could not search the certificates for this question (embedding failed). Please try again."
+
+def embedding_deployment():
+    """Embedding model in use; stamped into every record so stale vectors can be found."""
+    return os.getenv("AZURE_EMBEDDING_DEPLOYMENT", "text-embedding-ada-002")
+
 class CertificateRAG:
     def __init__(self):
-        """Initialize RAG pipeline with Chroma vector DB"""
+        """Initialize RAG pipeline with the configured vector store"""
         
-        # Initialize Chroma (Persistent Storage)
-        db_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'chroma_db')
-        self.chroma_client = chromadb.PersistentClient(path=db_path)
+        # Vector store (Chroma by default, or the NumPy mmap index via VECTOR_STORE_BACKEND=numpy)
+        self.store_root = store_root()
+        self.store = get_vector_store(path=self.store_root)
         
-        self.collection = self.chroma_client.get_or_create_collection(
-            name="certificates",
-            metadata={"hnsw:space": "cosine"}
-        )
-        
-        # Initialize Azure OpenAI - check for sanitized keys
-        raw_key = os.getenv('AZURE_OPENAI_API_KEY')
-        if not raw_key or "your-key" in str(raw_key):
+        # Initialize the model client - live Azure needs sanitized keys, replay needs none
+        if not model_available():
              print("⚠️  RAG Warning: Valid Azure API Key not found. RAG will not function correctly.")
              self.client = None
         else:
-            self.client = AzureOpenAI(
-                api_key=raw_key,
-                api_version=os.getenv('AZURE_OPENAI_API_VERSION', "2024-02-15-preview"),
-                azure_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT')
-            )
+            self.client = get_client()
             
         self.deployment = os.getenv('AZURE_OPENAI_DEPLOYMENT', 'gpt-4') 
         # Ideally use text-embedding-3-small, but checking availability. 
         # Fallback to simple deterministic embeddings if no model.
     
-    def get_embeddings(self, text):
-        """Generate embeddings using Azure OpenAI"""
+    def get_embeddings(self, text, deadline=None):
+        """Generate embeddings using Azure OpenAI (raises DeadlineExceeded if `deadline` runs out)"""
         if not self.client:
              # Fallback: simple hash vector for demo without keys
              return [0.1] * 1536
@@ -48,28 +55,55 @@ class CertificateRAG:
             # often typically deployed as same name.
             
             # Using a common default or Env variable would be best.
-            embedding_model = os.getenv("AZURE_EMBEDDING_DEPLOYMENT", "text-embedding-ada-002")
+            embedding_model = embedding_deployment()
             
-            response = self.client.embeddings.create(
+            response = call_model(
+                'embedding', self.client.embeddings.create,
+                tokens=estimate_tokens(text),
                 input=text,
-                model=embedding_model
+                model=embedding_model,
+                deadline=deadline
             )
             return response.data[0].embedding
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"⚠️ Embedding error: {e}")
             print("   (Ensure you have an embedding model deployed and AZURE_EMBEDDING_DEPLOYMENT set)")
             return [0.0] * 1536
-    
-    def ingest_certificate(self, cert_data):
+
+    def get_embeddings_batch(self, texts, model=None):
         """
-        Add extracted certificate to vector database.
-        Idempotent: Overwrites if ID exists.
+        Embed several texts in one API call (order preserved).
+        Unlike get_embeddings(), errors are raised so callers never store zero vectors.
         """
+        if not self.client:
+            return [[0.1] * 1536 for _ in texts]
+        response = call_model(
+            'embedding_batch', self.client.embeddings.create,
+            tokens=sum(estimate_tokens(t) for t in texts),
+            input=list(texts),
+            model=model or embedding_deployment()
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+    def record_embedding_model(self):
+        """Value stamped into metadata['embedding_model'] for newly embedded records."""
+        return embedding_deployment() if self.client else 'fallback'
+
+    def active_store(self):
+        """The store queries should hit; reopened when a reindex swaps the active collection."""
+        name = active_collection(self.store_root)
+        if name != self.store.name:
+            print(f"🔁 Vector store switched to collection '{name}'")
+            self.store = get_vector_store(path=self.store_root, collection=name)
+        return self.store
+    
+    def _searchable_text(self, cert_data):
+        """Create searchable text representation"""
         doc_id = cert_data.get('doc_id', 'unknown')
-        
-        # Create searchable text representation
         fields = cert_data.get('fields', {})
-        searchable_text = f"""
+        return f"""
         Certificate ID: {doc_id}
         Issuer: {fields.get('issuer', 'Unknown')}
         Subject: {fields.get('subject', 'Unknown')}
@@ -78,30 +112,80 @@ class CertificateRAG:
         Certificate Number: {fields.get('certificate_number', 'N/A')}
         Validation Status: {cert_data.get('final_status', 'Unknown')}
         """
-        
-        embedding = self.get_embeddings(searchable_text)
-        
+
+    def _metadata(self, cert_data):
         # Metadata must be flat dict
-        metadata = {
+        return {
             "status": str(cert_data.get('final_status')),
-            "issuer": str(fields.get('issuer')),
-            "ingested_at": datetime.now().isoformat()
+            "issuer": str(cert_data.get('fields', {}).get('issuer')),
+            "ingested_at": datetime.now().isoformat(),
+            "embedding_model": self.record_embedding_model()
         }
+
+    def ingest_certificate(self, cert_data, deadline=None):
+        """
+        Add extracted certificate to vector database.
+        Idempotent: Overwrites if ID exists.
+        Raises DeadlineExceeded (nothing is stored) if `deadline` runs out first.
+        """
+        doc_id = cert_data.get('doc_id', 'unknown')
+        searchable_text = self._searchable_text(cert_data)
         
-        self.collection.upsert(
-            ids=[doc_id],
-            embeddings=[embedding],
-            documents=[searchable_text],
-            metadatas=[metadata]
-        )
+        with span('rag_ingestion'):
+            embedding = self.get_embeddings(searchable_text, deadline=deadline)
+            
+            self.active_store().upsert(
+                ids=[doc_id],
+                embeddings=[embedding],
+                documents=[searchable_text],
+                metadatas=[self._metadata(cert_data)]
+            )
         
         return {"success": True, "doc_id": doc_id}
+
+    def ingest_many(self, cert_list, batch_size=EMBEDDING_BATCH_SIZE):
+        """
+        Add or overwrite several certificates with batched embedding calls
+        and one store write per batch. If a batch call fails, its certificates are
+        embedded one by one; any that still fail are left out (listed in 'failed')
+        rather than stored with a zero vector.
+        """
+        ingested, failed = [], []
+        with span('rag_ingestion'):
+            for start in range(0, len(cert_list), batch_size):
+                batch = cert_list[start:start + batch_size]
+                texts = [self._searchable_text(c) for c in batch]
+                try:
+                    embeddings = self.get_embeddings_batch(texts)
+                except Exception as e:
+                    print(f"⚠️ Batch embedding error: {e}; embedding one by one")
+                    embeddings = [self._embed_or_none(t) for t in texts]
+                kept = [(c, t, e) for c, t, e in zip(batch, texts, embeddings) if e is not None]
+                failed.extend(c.get('doc_id', 'unknown') for c, e in zip(batch, embeddings) if e is None)
+                if not kept:
+                    continue
+                ids = [c.get('doc_id', 'unknown') for c, _, _ in kept]
+                self.active_store().upsert(ids=ids, embeddings=[e for _, _, e in kept],
+                                           documents=[t for _, t, _ in kept],
+                                           metadatas=[self._metadata(c) for c, _, _ in kept])
+                ingested.extend(ids)
+        if failed:
+            print(f"⚠️ Not indexed (embedding failed): {', '.join(failed)}")
+        return {"success": not failed, "doc_ids": ingested, "failed": failed}
+
+    def _embed_or_none(self, text):
+        """Embedding of a single text, or None if the call fails (never a zero vector)."""
+        try:
+            return self.get_embeddings_batch([text])[0]
+        except Exception as e:
+            print(f"⚠️ Embedding error: {e}")
+            return None
     
-    def query(self, question, n_results=3):
+    def query(self, question, n_results=RAG_N_RESULTS):
         """Query certificates using natural language"""
         q_embedding = self.get_embeddings(question)
         
-        results = self.collection.query(
+        results = self.active_store().query(
             query_embeddings=[q_embedding],
             n_results=n_results
         )
@@ -111,14 +195,69 @@ class CertificateRAG:
     def answer_question(self, question):
         """Generate answer to user question based on RAG context"""
         # 1. Retrieve
-        results = self.query(question)
+        with span('rag_retrieval'):
+            results = self.query(question)
         
-        if not results or not results['documents'] or not results['documents'][0]:
+        if not results or not results['documents']:
+            return "No relevant certificates found in the database."
+        return self._answer_from_documents(question, results['documents'][0])
+
+    def _embed_questions(self, questions):
+        """
+        Embed questions in batched API calls, one by one only if a batch fails.
+        Questions that still fail get None (never a zero vector, which would retrieve arbitrary records).
+        """
+        embeddings = []
+        for start in range(0, len(questions), EMBEDDING_BATCH_SIZE):
+            batch = questions[start:start + EMBEDDING_BATCH_SIZE]
+            try:
+                embeddings.extend(self.get_embeddings_batch(batch))
+            except Exception as e:
+                print(f"⚠️ Batch embedding error: {e}; embedding one by one")
+                embeddings.extend(self._embed_or_none(q) for q in batch)
+        return embeddings
+
+    def answer_many(self, questions, n_results=RAG_N_RESULTS, concurrency=RAG_ANSWER_CONCURRENCY):
+        """
+        Answer a list of questions: batched question embeddings, one multi-query
+        retrieval, then answers generated concurrently on a bounded pool.
+
+        Returns:
+            list: Answers in the same order as `questions`; EMBEDDING_FAILED_ANSWER
+                  for a question that could not be embedded (it is not searched).
+        """
+        questions = [q or '' for q in questions]
+        if not questions:
+            return []
+        answers = [EMBEDDING_FAILED_ANSWER] * len(questions)
+        with span('rag_retrieval'):
+            embeddings = self._embed_questions(questions)
+            embedded = [i for i, e in enumerate(embeddings) if e is not None]
+            if not embedded:
+                return answers
+            results = self.active_store().query(query_embeddings=[embeddings[i] for i in embedded],
+                                                n_results=n_results)
+        documents = (results or {}).get('documents') or [[] for _ in embedded]
+
+        # Generation is I/O bound; the shared rate limiter still caps calls process-wide
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(embedded)))) as pool:
+            generated = pool.map(propagate(self._answer_from_documents), [questions[i] for i in embedded], documents)
+            for i, answer in zip(embedded, generated):
+                answers[i] = answer
+        return answers
+
+    def _answer_from_documents(self, question, context_docs):
+        """Generate one answer from already-retrieved context documents."""
+        if not context_docs:
             return "No relevant certificates found in the database."
         
-        # 2. Contextualize
-        context_docs = results['documents'][0] # List of strings
-        context_text = "\n---\n".join(context_docs)
+        # 2. Contextualize: compact, deduplicated field table under a token budget
+        context_text, context_stats = build_context(context_docs)
+        incr('rag_context_tokens_before', context_stats['tokens_before'])
+        incr('rag_context_tokens_after', context_stats['tokens'])
+        print(f"📚 RAG context: {context_stats['rows']} record(s), {context_stats['tokens']} tokens "
+              f"(raw {context_stats['tokens_before']}, {context_stats['duplicates']} duplicate(s), "
+              f"{context_stats['truncated']} over budget)")
         
         if not self.client:
             return "Answer generation disabled (No API Key). Context found: " + context_text[:100] + "..."
@@ -130,13 +269,15 @@ class CertificateRAG:
             Answer the user question using ONLY the context provided below.
             If the answer is not in the context, say "I cannot find that information in the certificate records."
             
-            Context:
+            Context (one certificate per row, '-' means not recorded):
             {context_text}
             
             User Question: {question}
             """
             
-            response = self.client.chat.completions.create(
+            response = call_model(
+                'rag_answer', self.client.chat.completions.create,
+                tokens=estimate_tokens(prompt) + 300,
                 model=self.deployment,
                 messages=[
                     {"role": "system", "content": "You are a helpful assistant."},
@@ -0,0 +1,263 @@
+import os
+import random
+import threading
+import time
+
+import openai
+
+from app.deadline import DeadlineExceeded
+from app.metrics import model_call, registry, incr
+
+# Deployment quota (0 = no limit). Set these to the Azure deployment's RPM/TPM.
+MODEL_RPM = float(os.getenv('MODEL_RPM', '0'))
+MODEL_TPM = float(os.getenv('MODEL_TPM', '0'))
+MODEL_MAX_CONCURRENCY = int(os.getenv('MODEL_MAX_CONCURRENCY', '16'))
+MODEL_MIN_CONCURRENCY = int(os.getenv('MODEL_MIN_CONCURRENCY', '1'))
+MODEL_MAX_RETRIES = int(os.getenv('MODEL_MAX_RETRIES', '5'))
+MODEL_BACKOFF_BASE = float(os.getenv('MODEL_BACKOFF_BASE', '0.5'))   # Seconds
+MODEL_BACKOFF_MAX = float(os.getenv('MODEL_BACKOFF_MAX', '30'))      # Seconds
+
+# Errors worth waiting out; anything else (bad request, auth, content filter) fails immediately
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                    openai.InternalServerError)
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` units refill per second up to `capacity`.
+    The level may go negative when a call turns out to cost more than estimated;
+    later callers then wait for the debt to refill.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate * 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1, max_wait=None):
+        """
+        Block until `amount` units are available; returns seconds waited.
+        With `max_wait`, returns None (taking nothing) instead of waiting longer than that.
+        """
+        if self.rate <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)  # A single oversized request must still get through
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.level >= amount:
+                    self.level -= amount
+                    return waited
+                delay = (amount - self.level) / self.rate
+            if max_wait is not None and waited + delay > max_wait:
+                return None
+            time.sleep(delay)
+            waited += delay
+
+    def adjust(self, amount):
+        """Debit (positive) or refund (negative) units after the real cost is known."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level - amount)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on in-flight calls: +1 after a full window of successes,
+    halved on throttling (at most once per window so one burst of 429s
+    does not collapse the limit to the floor).
+    """
+
+    def __init__(self, initial, minimum=1, maximum=None):
+        self.minimum = max(1, minimum)
+        self.maximum = maximum or initial
+        self.limit = float(max(self.minimum, min(initial, self.maximum)))
+        self.in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """Wait for a free slot; returns False if none freed up within `timeout`."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def on_success(self):
+        with self._cond:
+            self._successes += 1
+            if self._successes >= int(self.limit) and self.limit < self.maximum:
+                self._successes = 0
+                self.limit = min(self.maximum, self.limit + 1)
+                self._cond.notify()
+
+    def on_throttle(self, cooldown):
+        with self._cond:
+            now = time.monotonic()
+            if now - self._last_decrease < cooldown:
+                return
+            self._last_decrease = now
+            self._successes = 0
+            self.limit = max(self.minimum, self.limit / 2)
+
+
+def retry_after_seconds(error):
+    """Server-suggested wait from a 429/503 response (retry-after-ms or retry-after), or None."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        pass  # HTTP-date form is not used by Azure OpenAI
+    return None
+
+
+class RateLimiter:
+    """
+    Process-wide gate for model API calls: request and token buckets, an AIMD
+    concurrency limit, and retries with jittered exponential backoff.
+    """
+
+    def __init__(self, rpm=MODEL_RPM, tpm=MODEL_TPM, max_concurrency=MODEL_MAX_CONCURRENCY,
+                 min_concurrency=MODEL_MIN_CONCURRENCY, max_retries=MODEL_MAX_RETRIES,
+                 backoff_base=MODEL_BACKOFF_BASE, backoff_max=MODEL_BACKOFF_MAX):
+        self.requests = TokenBucket(rpm / 60.0, capacity=max(1.0, rpm / 6)) if rpm else TokenBucket(0)
+        self.tokens = TokenBucket(tpm / 60.0, capacity=max(1.0, tpm / 6)) if tpm else TokenBucket(0)
+        self.concurrency = AdaptiveConcurrency(max_concurrency, min_concurrency, max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _wait_for_pause(self, deadline=None):
+        # A Retry-After from one call holds back every caller, not just the one that was throttled
+        with self._lock:
+            delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            if deadline and delay >= deadline.remaining():
+                raise DeadlineExceeded("Deadline exceeded while rate limited (Retry-After)")
+            time.sleep(delay)
+            registry.observe('stage', 'rate_limit_wait', delay)
+
+    def _acquire_quota(self, tokens, deadline=None):
+        """Take one request and `tokens` from the buckets; returns seconds waited."""
+        if not deadline:
+            return self.requests.acquire(1) + self.tokens.acquire(tokens)
+        waited = self.requests.acquire(1, max_wait=deadline.remaining())
+        if waited is not None:
+            more = self.tokens.acquire(tokens, max_wait=deadline.remaining())
+            if more is not None:
+                return waited + more
+            self.requests.adjust(-1)  # Give the request slot back
+        raise DeadlineExceeded("Deadline exceeded waiting for model quota")
+
+    def _pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def call(self, name, func, *args, tokens=0, deadline=None, **kwargs):
+        """
+        Run func(*args, **kwargs) under the limiter, timed as model call `name`.
+
+        Args:
+            tokens: Estimated prompt + completion tokens, charged to the token bucket.
+                    Corrected from `response.usage` when the API reports it.
+            deadline: Optional app.deadline.Deadline. Each attempt's `timeout` kwarg is
+                      capped at the remaining budget, and no retry is started past it.
+
+        Raises the last error once retries are exhausted, or immediately for
+        non-retryable errors. Raises DeadlineExceeded when the budget runs out first.
+        """
+        attempt = 0
+        cap = kwargs.get('timeout')
+        while True:
+            self._wait_for_pause(deadline)
+            waited = self._acquire_quota(tokens, deadline)
+            if waited:
+                registry.observe('stage', 'rate_limit_wait', waited)
+
+            if not self.concurrency.acquire(timeout=deadline.remaining() if deadline else None):
+                raise DeadlineExceeded(f"Deadline exceeded waiting for a free slot for {name}")
+            try:
+                if deadline:
+                    kwargs['timeout'] = deadline.timeout(cap, name)
+                with model_call(name):
+                    response = func(*args, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                error = e
+            else:
+                self.concurrency.on_success()
+                usage = getattr(response, 'usage', None)
+                if tokens and getattr(usage, 'total_tokens', None):
+                    self.tokens.adjust(usage.total_tokens - tokens)
+                return response
+            finally:
+                self.concurrency.release()
+
+            retry_after = retry_after_seconds(error)
+            if isinstance(error, openai.RateLimitError):
+                incr('throttled')
+                self.concurrency.on_throttle(cooldown=retry_after or self.backoff_base)
+            if attempt >= self.max_retries:
+                raise error
+
+            delay = max(retry_after or 0.0, self._backoff(attempt))
+            if deadline and delay >= deadline.remaining():
+                raise DeadlineExceeded(f"Deadline exceeded while retrying {name}") from error
+            if retry_after:
+                self._pause(retry_after)
+            incr('retries')
+            attempt += 1
+            time.sleep(delay)
+
+    def stats(self):
+        return {
+            'concurrency_limit': int(self.concurrency.limit),
+            'in_flight': self.concurrency.in_flight,
+            'request_tokens': round(self.requests.level, 2) if self.requests.rate else None,
+            'token_tokens': round(self.tokens.level, 2) if self.tokens.rate else None,
+        }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Shared limiter for every model call in this process."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
+
+
+def call_model(name, func, *args, tokens=0, deadline=None, **kwargs):
+    """Shortcut for get_rate_limiter().call(...)."""
+    return get_rate_limiter().call(name, func, *args, tokens=tokens, deadline=deadline, **kwargs)
@@ -0,0 +1,196 @@
+import json
+from dataclasses import dataclass, field
+from typing import Optional
+
+try:
+    import orjson  # Optional fast JSON backend
+except ImportError:
+    orjson = None
+
+from app.security import is_sensitive_field, mask_value
+
+
+@dataclass(slots=True)
+class CertificateFields:
+    issuer: Optional[str] = None
+    certificate_number: Optional[str] = None
+    issued_date: Optional[str] = None
+    expiry_date: Optional[str] = None
+    subject: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(*(data.get(name) for name in cls.__slots__))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def get(self, name, default=None):
+        return getattr(self, name, default) if name in self.__slots__ else default
+
+
+@dataclass(slots=True)
+class FieldConfidence:
+    issuer: float = 0.0
+    certificate_number: float = 0.0
+    issued_date: float = 0.0
+    expiry_date: float = 0.0
+    subject: float = 0.0
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(*(data.get(name, 0.0) for name in cls.__slots__))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def average(self):
+        return sum(getattr(self, name) for name in self.__slots__) / len(self.__slots__)
+
+
+@dataclass(slots=True)
+class DateValidation:
+    issued_date_valid: bool = False
+    expiry_status: str = 'invalid_format'
+    dates_consistent: bool = False
+    error: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(data.get('issued_date_valid', False), data.get('expiry_status', 'invalid_format'),
+                   data.get('dates_consistent', False), data.get('error'))
+
+    def to_dict(self):
+        out = {'issued_date_valid': self.issued_date_valid, 'expiry_status': self.expiry_status,
+               'dates_consistent': self.dates_consistent}
+        if self.error is not None:
+            out['error'] = self.error
+        return out
+
+
+@dataclass(slots=True)
+class IssuerValidation:
+    issuer: Optional[str] = None
+    is_trusted: bool = False
+    status: str = 'Untrusted Issuer'
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(data.get('issuer'), data.get('is_trusted', False), data.get('status', 'Untrusted Issuer'))
+
+    def to_dict(self):
+        return {'issuer': self.issuer, 'is_trusted': self.is_trusted, 'status': self.status}
+
+
+@dataclass(slots=True)
+class CertificateResult:
+    """
+    Final pipeline output for one certificate.
+    to_dict() keeps the JSON shape the API and batch_results.json have always used.
+    """
+    doc_id: str
+    fields: CertificateFields
+    confidence: FieldConfidence
+    confidence_flags: list = field(default_factory=list)
+    validation: Optional[DateValidation] = None
+    issuer_validation: Optional[IssuerValidation] = None
+    external_verification: Optional[dict] = None
+    final_status: Optional[str] = None
+    near_duplicate: Optional[dict] = None
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            doc_id=data.get('doc_id'),
+            fields=CertificateFields.from_dict(data.get('fields')),
+            confidence=FieldConfidence.from_dict(data.get('confidence')),
+            confidence_flags=list(data.get('confidence_flags') or []),
+            validation=DateValidation.from_dict(data['validation']) if data.get('validation') else None,
+            issuer_validation=(IssuerValidation.from_dict(data['issuer_validation'])
+                               if data.get('issuer_validation') else None),
+            external_verification=data.get('external_verification'),
+            final_status=data.get('final_status'),
+            near_duplicate=data.get('near_duplicate'),
+        )
+
+    def to_dict(self, fields=None):
+        out = {
+            'doc_id': self.doc_id,
+            'fields': fields if fields is not None else self.fields.to_dict(),
+            'confidence': self.confidence.to_dict(),
+            'confidence_flags': self.confidence_flags,
+            'validation': self.validation.to_dict() if self.validation else None,
+            'issuer_validation': self.issuer_validation.to_dict() if self.issuer_validation else None,
+            'external_verification': self.external_verification,
+            'final_status': self.final_status,
+        }
+        if self.near_duplicate is not None:
+            out['near_duplicate'] = self.near_duplicate
+        return out
+
+
+class RedactedView:
+    """
+    Read-only view of a CertificateResult with PII fields masked on access.
+    Nothing is copied until to_dict() is called for serialization.
+    """
+
+    __slots__ = ('record',)
+
+    def __init__(self, record):
+        self.record = record
+
+    def field(self, name):
+        value = getattr(self.record.fields, name)
+        return mask_value(value) if value and is_sensitive_field(name) else value
+
+    @property
+    def fields(self):
+        return {name: self.field(name) for name in CertificateFields.__slots__}
+
+    def __getattr__(self, name):
+        return getattr(self.record, name)
+
+    def to_dict(self):
+        return self.record.to_dict(fields=self.fields)
+
+
+def _default(obj):
+    if hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """Compact JSON for a record, view or plain dict (orjson when installed)."""
+    if orjson is not None:
+        # Passthrough so records go through to_dict() and keep the established JSON shape
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_PASSTHROUGH_DATACLASS).decode('utf-8')
+    return json.dumps(obj, default=_default, separators=(',', ':'), ensure_ascii=False)
+
+
+def loads(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def write_jsonl(fp, records):
+    """Write one compact JSON document per line; returns the number written."""
+    count = 0
+    for record in records:
+        fp.write(dumps(record) + '\n')
+        count += 1
+    return count
+
+
+def iter_jsonl(fp, record_type=None):
+    """Yield dicts (or `record_type.from_dict(...)` instances) from a JSONL stream."""
+    for line in fp:
+        if line.strip():
+            data = loads(line)
+            yield record_type.from_dict(data) if record_type else data
@@ -0,0 +1,142 @@
+import json
+import os
+import re
+from datetime import datetime
+
+from app.vector_store import (
+    DEFAULT_COLLECTION, get_vector_store, active_collection, set_active_collection, delete_collection,
+)
+
+REINDEX_PAGE_SIZE = int(os.getenv('REINDEX_PAGE_SIZE', '256'))   # Records read from the store at a time
+REINDEX_BATCH_SIZE = int(os.getenv('REINDEX_BATCH_SIZE', '64'))  # Texts per embeddings API call
+CHECKPOINT_FILE = 'reindex_checkpoint.json'
+CATCH_UP_PASSES = 3
+
+
+def _checkpoint_path(root):
+    return os.path.join(root, CHECKPOINT_FILE)
+
+
+def load_checkpoint(root):
+    try:
+        with open(_checkpoint_path(root)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _save_checkpoint(root, state):
+    tmp = _checkpoint_path(root) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, _checkpoint_path(root))
+
+
+def shadow_collection_name(model):
+    """e.g. certificates__text-embedding-3-small__20250101T120000 (fits Chroma's 63-char limit)"""
+    slug = re.sub(r'[^A-Za-z0-9_-]+', '-', model).strip('-')[:30] or 'model'
+    return f"{DEFAULT_COLLECTION}__{slug}__{datetime.now().strftime('%Y%m%dT%H%M%S')}"
+
+
+def _copy_records(rag, target, page, model, batch_size):
+    """Re-embed one page of records and write them to the target collection."""
+    reindexed_at = datetime.now().isoformat()
+    for start in range(0, len(page['ids']), batch_size):
+        ids = page['ids'][start:start + batch_size]
+        documents = page['documents'][start:start + batch_size]
+        embeddings = rag.get_embeddings_batch([d or '' for d in documents], model=model)
+        metadatas = []
+        for meta in page['metadatas'][start:start + batch_size]:
+            meta = dict(meta or {})
+            meta['embedding_model'] = model if rag.client else 'fallback'
+            meta['reindexed_at'] = reindexed_at
+            metadatas.append(meta)
+        target.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+
+def _catch_up(rag, source, target, model, page_size, batch_size):
+    """
+    Copy records written to the source after the paged copy passed them
+    (new ids, or re-ingested ones with a newer ingested_at). Returns the count copied.
+    """
+    copied, offset = 0, 0
+    while True:
+        page = source.get(limit=page_size, offset=offset)
+        if not page['ids']:
+            return copied
+        offset += len(page['ids'])
+        existing = target.get(ids=page['ids'])
+        copied_at = {i: (m or {}).get('ingested_at') for i, m in zip(existing['ids'], existing['metadatas'])}
+        stale = [n for n, (i, m) in enumerate(zip(page['ids'], page['metadatas']))
+                 if i not in copied_at or copied_at[i] != (m or {}).get('ingested_at')]
+        if stale:
+            subset = {key: [page[key][n] for n in stale] for key in ('ids', 'documents', 'metadatas')}
+            _copy_records(rag, target, subset, model, batch_size)
+            copied += len(stale)
+
+
+def reindex_collection(rag, model=None, page_size=REINDEX_PAGE_SIZE, batch_size=REINDEX_BATCH_SIZE,
+                       restart=False, drop_old=False):
+    """
+    Re-embed every record of the active collection into a shadow collection,
+    then atomically make the shadow collection active.
+
+    Progress is checkpointed after every page, so an interrupted run resumes
+    where it stopped (unless `restart`). Queries keep using the old collection
+    until the swap; writes that land in it meanwhile are picked up by catch-up passes.
+
+    Returns:
+        dict: Summary with 'source', 'target', 'model', 'copied' and 'caught_up'.
+    """
+    from app.rag_pipeline import embedding_deployment
+
+    model = model or embedding_deployment()
+    root = rag.store_root
+    source_name = active_collection(root)
+
+    state = load_checkpoint(root)
+    if restart or not state or state.get('source') != source_name or state.get('model') != model:
+        if state and state.get('target') != source_name:
+            delete_collection(None, root, state['target'])  # Abandoned shadow from an earlier run
+        state = {'source': source_name, 'target': shadow_collection_name(model), 'model': model,
+                 'offset': 0, 'copied': 0, 'started_at': datetime.now().isoformat()}
+        _save_checkpoint(root, state)
+    else:
+        print(f"↩️  Resuming reindex into '{state['target']}' at record {state['offset']}")
+
+    source = get_vector_store(path=root, collection=source_name)
+    target = get_vector_store(path=root, collection=state['target'])
+    total = source.count()
+    print(f"🔄 Re-embedding {total} records: '{source_name}' -> '{state['target']}' with {model}")
+
+    # 1. Paged copy, checkpointed after each page
+    while True:
+        page = source.get(limit=page_size, offset=state['offset'])
+        if not page['ids']:
+            break
+        _copy_records(rag, target, page, model, batch_size)
+        state['offset'] += len(page['ids'])
+        state['copied'] += len(page['ids'])
+        _save_checkpoint(root, state)
+        print(f"   {state['copied']}/{total} records re-embedded")
+
+    # 2. Catch up on writes that happened during the copy, then swap
+    caught_up = 0
+    for _ in range(CATCH_UP_PASSES):
+        copied = _catch_up(rag, source, target, model, page_size, batch_size)
+        caught_up += copied
+        if not copied:
+            break
+    set_active_collection(root, state['target'])
+    print(f"✅ Active collection is now '{state['target']}'")
+
+    # 3. Writers still holding the old collection may have raced the swap
+    caught_up += _catch_up(rag, source, target, model, page_size, batch_size)
+    os.remove(_checkpoint_path(root))
+
+    if drop_old:
+        delete_collection(None, root, source_name)
+        print(f"🗑️  Dropped old collection '{source_name}'")
+
+    return {'source': source_name, 'target': state['target'], 'model': model,
+            'copied': state['copied'], 'caught_up': caught_up}
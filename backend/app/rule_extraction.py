@@ -0,0 +1,168 @@
+import os
+import re
+
+from app.date_validation import load_trusted_issuers
+from app.document import as_document
+from app.field_extraction import extract_with_azure, normalize_date, TARGET_FIELDS, ISO_DATE_RE
+from app.metrics import span, incr
+from app.status_assignment import CRITICAL_FIELDS
+
+RULE_FAST_PATH = os.getenv('RULE_FAST_PATH', '1') != '0'
+RULE_CONFIDENCE_THRESHOLD = float(os.getenv('RULE_CONFIDENCE_THRESHOLD', '0.9'))
+
+# Confidence assigned per kind of evidence
+CONF_TRUSTED_ISSUER = 0.97   # Exact name from trusted_issuers.json
+CONF_LABELLED = 0.95         # "Label: value" on one line
+CONF_LABELLED_ISSUER = 0.85  # Labelled issuer that is not on the trusted list
+CONF_PHRASE = 0.9            # "has completed the ..." style subject
+CONF_UNPARSED_DATE = 0.6     # Labelled date that normalize_date could not convert
+
+_SEP = r'\s*[:\-#]?\s*'
+LABELS = {
+    'issuer': re.compile(r'^\s*(?:issued\s+by|issuer|awarded\s+by)' + _SEP + r'(.+?)\s*$', re.IGNORECASE | re.MULTILINE),
+    'certificate_number': re.compile(
+        r'(?:certificate\s*(?:number|no\.?|id)|credential\s*id)' + _SEP + r'([A-Za-z0-9][A-Za-z0-9\-/.]*[A-Za-z0-9])',
+        re.IGNORECASE),
+    'subject': re.compile(r'^\s*subject' + _SEP + r'(.+?)\s*$', re.IGNORECASE | re.MULTILINE),
+}
+# Labels that must end right before a candidate date (Document.date_spans) for it to count
+DATE_LABELS = {
+    'issued_date': re.compile(r'(?:issued\s+on|issue\s+date|date\s+of\s+issue|issued\s+date)' + _SEP + r'$', re.IGNORECASE),
+    'expiry_date': re.compile(
+        r'(?:valid\s+(?:until|till|through)|expiry\s+date|expiration\s+date|expires(?:\s+on)?)' + _SEP + r'$',
+        re.IGNORECASE),
+}
+DATE_LABEL_LOOKBEHIND = 40  # Characters before a date searched for its label
+COMPLETED_PHRASE = re.compile(r'has\s+(?:successfully\s+)?completed(?:\s+the)?[ \t]*(.*)$', re.IGNORECASE | re.MULTILINE)
+SUBJECT_CONTINUATION = re.compile(r'^(?:certification\s+)?(?:program(?:me)?|course|training|certification)\.?$', re.IGNORECASE)
+
+_issuer_regex_cache = {'issuers': None, 'regex': None}
+
+
+def _trusted_issuer_regex():
+    """
+    Trusted issuer names (longest first) as a whole line: a name that only appears
+    inside a longer line or label ("Not IEEE Affiliated Academy") does not match.
+    Rebuilt when the list changes.
+    """
+    issuers = load_trusted_issuers()
+    if _issuer_regex_cache['issuers'] != issuers:
+        names = sorted(issuers, key=len, reverse=True)
+        alternation = '|'.join(r'\s+'.join(map(re.escape, n.split())) for n in names)
+        pattern = r'^[ \t]*(' + alternation + r')[ \t]*[.,]?[ \t]*$' if names else r'(?!x)x'
+        _issuer_regex_cache['regex'] = re.compile(pattern, re.IGNORECASE | re.MULTILINE)
+        _issuer_regex_cache['issuers'] = list(issuers)
+    return _issuer_regex_cache['regex'], _issuer_regex_cache['issuers']
+
+
+def _field(value, confidence):
+    return {'value': value, 'confidence': confidence if value else 0.0}
+
+
+def _match_issuer(text):
+    """
+    A labelled issuer is trusted only when the whole label value is a trusted name;
+    otherwise it is kept as labelled, below the fast-path threshold, so the LLM
+    (and then status assignment) decides. Trusted names elsewhere in the body never
+    override a label, and without a label only count on a line of their own.
+    """
+    regex, issuers = _trusted_issuer_regex()
+    canonical = {' '.join(name.lower().split()): name for name in issuers}
+
+    labelled = LABELS['issuer'].search(text)
+    if labelled:
+        trusted = regex.fullmatch(labelled.group(1))
+        if trusted:
+            return _field(canonical[' '.join(trusted.group(1).lower().split())], CONF_TRUSTED_ISSUER)
+        return _field(labelled.group(1), CONF_LABELLED_ISSUER)
+    trusted = regex.search(text)
+    if trusted:
+        return _field(canonical[' '.join(trusted.group(1).lower().split())], CONF_TRUSTED_ISSUER)
+    return _field(None, 0.0)
+
+
+def _match_date(field, document):
+    """First candidate date directly preceded by the field's label."""
+    text, label = document.text, DATE_LABELS[field]
+    for start, end in document.date_spans:
+        if label.search(text, max(0, start - DATE_LABEL_LOOKBEHIND), start):
+            value = text[start:end]
+            normalized = normalize_date(value.strip())
+            if ISO_DATE_RE.match(normalized or ''):
+                return _field(normalized, CONF_LABELLED)
+            return _field(value, CONF_UNPARSED_DATE)
+    return _field(None, 0.0)
+
+
+def _match_subject(text):
+    labelled = LABELS['subject'].search(text)
+    if labelled:
+        return _field(labelled.group(1), CONF_LABELLED)
+
+    phrase = COMPLETED_PHRASE.search(text)
+    if not phrase:
+        return _field(None, 0.0)
+    # Subject is either on the same line or on the following line(s)
+    subject = phrase.group(1).strip().rstrip('.')
+    following = [line.strip() for line in text[phrase.end():].splitlines() if line.strip()]
+    if not subject and following:
+        subject = following.pop(0).rstrip('.')
+    if subject and following and SUBJECT_CONTINUATION.match(following[0]):
+        subject = f"{subject} {following[0].rstrip('.')}"
+    return _field(subject or None, CONF_PHRASE)
+
+
+def extract_with_rules(text_content):
+    """
+    Deterministic regex/lexicon extraction of the five certificate fields.
+
+    `text_content` may be a plain string or an app.document.Document.
+
+    Returns:
+        dict: {field: {'value': ..., 'confidence': ...}} for every target field,
+              in the same shape as extract_with_azure().
+    """
+    document = as_document(text_content)
+    text = document.text
+    number = LABELS['certificate_number'].search(text)
+    result = {
+        'issuer': _match_issuer(text),
+        'certificate_number': _field(number.group(1) if number else None, CONF_LABELLED),
+        'issued_date': _match_date('issued_date', document),
+        'expiry_date': _match_date('expiry_date', document),
+        'subject': _match_subject(text),
+    }
+    return {field: result[field] for field in TARGET_FIELDS}
+
+
+def is_confident(rule_output, threshold=RULE_CONFIDENCE_THRESHOLD):
+    """True when every field assign_certificate_status treats as critical was found with high confidence."""
+    return all(
+        (rule_output.get(f) or {}).get('value') and rule_output[f].get('confidence', 0.0) >= threshold
+        for f in CRITICAL_FIELDS
+    )
+
+
+def try_rule_fast_path(text_content):
+    """
+    Rule-based extraction if it is confident about the critical fields, else None.
+    """
+    if not RULE_FAST_PATH:
+        return None
+    with span('rule_extraction'):
+        rule_output = extract_with_rules(text_content)
+    if not is_confident(rule_output):
+        incr('rule_fast_path_misses')
+        return None
+    print("⚡ Rule-based fast path: critical fields found, skipping LLM extraction.")
+    incr('rule_fast_path_hits')
+    rule_output['_voting_debug'] = {'method': 'rules', 'calls_spent': 0}
+    return rule_output
+
+
+def extract_with_fast_path(text_content, deadline=None):
+    """
+    Try the rule-based extractor first and only call the LLM consensus engine
+    when it is not confident about the critical fields.
+    """
+    return try_rule_fast_path(text_content) or extract_with_azure(text_content, deadline=deadline)
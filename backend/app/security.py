@@ -3,7 +3,13 @@ import re
 
 # Security Constants
 MAX_FILE_SIZE_MB = 10
-MAX_BATCH_SIZE = 50
+# Batch DoS protection: bound work in flight and intake rate instead of the total batch size
+MAX_BATCH_CONCURRENCY = int(os.getenv('MAX_BATCH_CONCURRENCY', '4'))
+MAX_BATCH_FILES_PER_SEC = float(os.getenv('MAX_BATCH_FILES_PER_SEC', '20'))
+# Files accepted by one /upload/batch request
+MAX_UPLOAD_BATCH_FILES = int(os.getenv('MAX_UPLOAD_BATCH_FILES', '50'))
+# Questions accepted by one /query/batch request
+MAX_QUERY_BATCH = int(os.getenv('MAX_QUERY_BATCH', '100'))
 ALLOWED_DATA_DIR = os.path.abspath('data')
 
 def validate_secure_path(file_path):
@@ -37,6 +43,20 @@ def check_file_size(file_path):
     if size_bytes > (MAX_FILE_SIZE_MB * 1024 * 1024):
         raise ValueError(f"File too large. Limit is {MAX_FILE_SIZE_MB}MB")
 
+# Fields to mask
+SENSITIVE_FIELDS = ['certificate_number', 'subject', 'name', 'recipient']
+
+def is_sensitive_field(key):
+    key = key.lower()
+    return key in SENSITIVE_FIELDS or 'id' in key
+
+def mask_value(value):
+    """Keep first 2 chars, mask rest"""
+    val = str(value)
+    if len(val) > 2:
+        return val[:2] + "***REDACTED***"
+    return "***REDACTED***"
+
 def redact_pii(data_dict):
     """
     Redact sensitive fields from a dictionary (e.g. for logging).
@@ -46,17 +66,9 @@ def redact_pii(data_dict):
         
     safe_copy = data_dict.copy()
     
-    # Fields to mask
-    sensitive_fields = ['certificate_number', 'subject', 'name', 'recipient']
-    
     for key in safe_copy:
-        if key.lower() in sensitive_fields or 'id' in key.lower():
+        if is_sensitive_field(key):
             if safe_copy[key]:
-                # Keep first 2 chars, mask rest
-                val = str(safe_copy[key])
-                if len(val) > 2:
-                    safe_copy[key] = val[:2] + "***REDACTED***"
-                else:
-                    safe_copy[key] = "***REDACTED***"
+                safe_copy[key] = mask_value(safe_copy[key])
                     
     return safe_copy
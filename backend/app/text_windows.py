@@ -0,0 +1,142 @@
+import os
+import re
+
+# Prompt budget for the certificate text sent with each extraction call
+EXTRACTION_TOKEN_BUDGET = int(os.getenv('EXTRACTION_TOKEN_BUDGET', '400'))
+PROMPT_COMPACTION = os.getenv('PROMPT_COMPACTION', '1') != '0'
+
+CHARS_PER_TOKEN = 4      # Rule of thumb for English text with GPT tokenizers
+HEAD_SEGMENTS = 3        # Title/issuer usually sit in the first few lines
+CONTEXT_SEGMENTS = 1     # Neighbouring segments kept around each hit
+MAX_SEGMENT_CHARS = 300  # Longer lines (flattened OCR) are split into sentences/chunks
+SEPARATOR = "\n...\n"
+
+MONTHS = r'jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|jun(?:e)?|jul(?:y)?|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?'
+
+DATE_PATTERN = re.compile(
+    r'\b\d{4}[-/.]\d{1,2}[-/.]\d{1,2}\b'
+    r'|\b\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4}\b'
+    rf'|\b\d{{1,2}}(?:st|nd|rd|th)?\s+(?:{MONTHS})\.?,?\s+\d{{4}}\b'
+    rf'|\b(?:{MONTHS})\.?\s+\d{{1,2}}(?:st|nd|rd|th)?,?\s+\d{{4}}\b',
+    re.IGNORECASE,
+)
+
+# (name, pattern, priority) - higher priority windows survive a tight budget
+RELEVANCE_PATTERNS = [
+    ('date', DATE_PATTERN, 3),
+    ('issuer', re.compile(r'issued\s+by|issuer|awarded\s+by|presented\s+by|organi[sz]ation|institute|university|authority', re.IGNORECASE), 3),
+    ('number', re.compile(r'certificate\s*(?:no|number|id|#)|credential\s*id|serial|registration\s*no|\b[A-Z]{2,}[-/]?\d{2,}[-/A-Z0-9]*\b', re.IGNORECASE), 3),
+    ('validity', re.compile(r'valid\s+(?:until|till|through)|expir|issued\s+on|issue\s+date|date\s+of\s+issue', re.IGNORECASE), 3),
+    ('title', re.compile(r'certificate\s+of|certif(?:y|ies)\s+that|has\s+(?:successfully\s+)?completed|diploma|awarded|in\s+recognition', re.IGNORECASE), 2),
+]
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token)."""
+    if not text:
+        return 0
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+
+def split_segments(text):
+    """Split text into lines, breaking overly long lines into sentences or word-bounded chunks."""
+    segments = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if len(line) <= MAX_SEGMENT_CHARS:
+            segments.append(line)
+            continue
+        for sentence in re.split(r'(?<=[.!?;])\s+', line):
+            # Unpunctuated OCR runs are chunked on word boundaries
+            while len(sentence) > MAX_SEGMENT_CHARS:
+                cut = sentence.rfind(' ', 0, MAX_SEGMENT_CHARS)
+                cut = cut if cut > 0 else MAX_SEGMENT_CHARS
+                segments.append(sentence[:cut])
+                sentence = sentence[cut:].lstrip()
+            if sentence:
+                segments.append(sentence)
+    return segments
+
+
+def find_relevant_windows(text, context=CONTEXT_SEGMENTS):
+    """
+    Locate the parts of a document likely to hold the five certificate fields.
+
+    Returns:
+        tuple: (segments, windows) where each window is a dict with
+               'start'/'end' segment indices (inclusive), 'priority' and 'kinds'.
+    """
+    segments = split_segments(text or '')
+    hits = {}
+    for i, segment in enumerate(segments):
+        for kind, pattern, priority in RELEVANCE_PATTERNS:
+            if pattern.search(segment):
+                entry = hits.setdefault(i, {'priority': 0, 'kinds': set()})
+                entry['priority'] += priority
+                entry['kinds'].add(kind)
+
+    windows = []
+    if segments:
+        windows.append({'start': 0, 'end': min(HEAD_SEGMENTS, len(segments)) - 1, 'priority': 1, 'kinds': {'head'}})
+    for i in sorted(hits):
+        start, end = max(0, i - context), min(len(segments) - 1, i + context)
+        last = windows[-1] if windows else None
+        if last and start <= last['end'] + 1:
+            last['end'] = max(last['end'], end)
+            last['priority'] += hits[i]['priority']
+            last['kinds'] |= hits[i]['kinds']
+        else:
+            windows.append({'start': start, 'end': end, 'priority': hits[i]['priority'],
+                            'kinds': set(hits[i]['kinds'])})
+    return segments, windows
+
+
+def compact_text(text, token_budget=EXTRACTION_TOKEN_BUDGET, windows=None):
+    """
+    Reduce a document to its relevant windows under a token budget.
+
+    Falls back to the full text when it already fits, or when no window
+    carries a date (the windows are then unlikely to hold the fields).
+    `windows` may be a callable returning find_relevant_windows(text), for
+    callers that already cache it; it is only called when compaction is needed.
+
+    Returns:
+        tuple: (text_for_prompt, stats) with stats keys
+               'original_tokens', 'compacted_tokens', 'windows' and 'fallback'.
+    """
+    original_tokens = estimate_tokens(text)
+    stats = {'original_tokens': original_tokens, 'compacted_tokens': original_tokens,
+             'windows': 0, 'fallback': None}
+
+    if not PROMPT_COMPACTION or not text:
+        stats['fallback'] = 'disabled' if text else 'empty'
+        return text, stats
+    if original_tokens <= token_budget:
+        stats['fallback'] = 'within_budget'
+        return text, stats
+
+    segments, windows = windows() if windows else find_relevant_windows(text)
+    if not any('date' in w['kinds'] for w in windows):
+        stats['fallback'] = 'no_windows'
+        return text, stats
+
+    # Highest-value windows first; trim the last one that does not fit
+    chosen, used = [], 0
+    for w in sorted(windows, key=lambda w: (-w['priority'], w['start'])):
+        block = "\n".join(segments[w['start']:w['end'] + 1])
+        cost = estimate_tokens(block) + estimate_tokens(SEPARATOR)
+        if used + cost > token_budget:
+            remaining = (token_budget - used) * CHARS_PER_TOKEN
+            if remaining < 40:
+                continue
+            block = block[:remaining]
+            cost = estimate_tokens(block)
+        chosen.append((w['start'], block))
+        used += cost
+
+    compacted = SEPARATOR.join(block for _, block in sorted(chosen))
+    stats['compacted_tokens'] = estimate_tokens(compacted)
+    stats['windows'] = len(chosen)
+    return compacted, stats
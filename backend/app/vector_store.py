@@ -0,0 +1,486 @@
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+# 'chroma' (default) or 'numpy' (memory-mapped brute-force index, no chromadb import)
+VECTOR_STORE_BACKEND = os.getenv('VECTOR_STORE_BACKEND', 'chroma')
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'chroma_db')
+DEFAULT_NUMPY_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'vector_store')
+
+# Collection queries are served from; a reindex swaps it by rewriting the pointer file
+DEFAULT_COLLECTION = 'certificates'
+ACTIVE_COLLECTION_FILE = 'active_collection.json'
+
+VECTOR_BLOCK_ROWS = int(os.getenv('VECTOR_BLOCK_ROWS', '65536'))        # Rows scored per matmul
+VECTOR_COMPACT_RATIO = float(os.getenv('VECTOR_COMPACT_RATIO', '0.3'))  # Dead-row fraction that triggers compaction
+
+# Candidate search on quantized copies ('none', 'float16' or 'int8'), then exact float32 rerank
+VECTOR_QUANTIZATION = os.getenv('VECTOR_QUANTIZATION', 'none')
+VECTOR_RERANK_FACTOR = int(os.getenv('VECTOR_RERANK_FACTOR', '10'))  # Candidates per requested result
+VECTOR_RERANK_MIN = int(os.getenv('VECTOR_RERANK_MIN', '50'))
+QUANTIZED_DTYPES = {'float16': np.float16, 'int8': np.int8}
+
+
+def quantize(matrix, mode):
+    """
+    Quantize unit-normalised rows.
+
+    Returns:
+        tuple: (codes, scales). scales is a per-row float32 array for int8
+               (value ~= code * scale) and None for float16.
+    """
+    if mode == 'float16':
+        return matrix.astype(np.float16), None
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def blocked_top_k(queries, matrix, live, k, scales=None, block_rows=None):
+    """
+    Top-k inner products of each query against `matrix` rows (skipping rows
+    where `live` is False), scoring VECTOR_BLOCK_ROWS rows at a time.
+
+    Returns:
+        tuple: (scores, rows) arrays of shape (n_queries, <=k), unordered.
+    """
+    block_rows = block_rows or VECTOR_BLOCK_ROWS
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(matrix), block_rows):
+        block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+        scores = queries @ block.T
+        if scales is not None:
+            scores *= scales[start:start + len(block)]
+        scores[:, ~live[start:start + len(block)]] = -np.inf
+        if scores.shape[1] > k:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            scores = np.take_along_axis(scores, top, axis=1)
+        else:
+            top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        best_scores = np.concatenate([best_scores, scores], axis=1)
+        best_rows = np.concatenate([best_rows, top + start], axis=1)
+        if best_scores.shape[1] > k:
+            keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+            best_rows = np.take_along_axis(best_rows, keep, axis=1)
+    return best_scores, best_rows
+
+
+def _query_result(rows):
+    """Chroma-shaped query result for a list of per-query hit lists [(id, document, metadata, distance)]."""
+    return {
+        'ids': [[h[0] for h in hits] for hits in rows],
+        'documents': [[h[1] for h in hits] for hits in rows],
+        'metadatas': [[h[2] for h in hits] for hits in rows],
+        'distances': [[h[3] for h in hits] for hits in rows],
+    }
+
+
+class VectorStore:
+    """
+    Interface used by CertificateRAG. Results follow Chroma's shapes so
+    callers can switch backends without changes.
+    """
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        raise NotImplementedError
+
+    def query(self, query_embeddings, n_results=3):
+        """Returns {'ids', 'documents', 'metadatas', 'distances'}, one list per query embedding."""
+        raise NotImplementedError
+
+    def get(self, ids=None, limit=None, offset=0, include_embeddings=False):
+        """Returns {'ids', 'documents', 'metadatas'} (and 'embeddings' if requested)."""
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+
+class ChromaVectorStore(VectorStore):
+    """Chroma persistent collection (cosine space)."""
+
+    def __init__(self, path=None, collection_name=DEFAULT_COLLECTION):
+        import chromadb  # Heavy import; only paid when this backend is selected
+
+        self.path = path or DEFAULT_DB_PATH
+        self.name = collection_name
+        self.client = chromadb.PersistentClient(path=self.path)
+        self.collection = self.client.get_or_create_collection(
+            name=collection_name,
+            metadata={"hnsw:space": "cosine"}
+        )
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def query(self, query_embeddings, n_results=3):
+        return self.collection.query(query_embeddings=query_embeddings, n_results=n_results)
+
+    def get(self, ids=None, limit=None, offset=0, include_embeddings=False):
+        include = ['documents', 'metadatas'] + (['embeddings'] if include_embeddings else [])
+        return self.collection.get(ids=ids, limit=limit, offset=offset or None, include=include)
+
+    def delete(self, ids):
+        self.collection.delete(ids=ids)
+
+    def count(self):
+        return self.collection.count()
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Exact cosine search over a float32 matrix memory-mapped from disk.
+
+    Layout of `path`:
+        vectors.f32    - unit-normalised rows, appended in write order
+        records.jsonl  - one line per row: {"row", "id", "document", "metadata"},
+                         or {"id", "deleted": true} tombstones
+        meta.json      - {"dim", "rows"}; rewritten last (atomically), so rows
+                         past meta['rows'] from an interrupted write are ignored
+
+    Upserts append a new row and leave the old one dead; compaction rewrites
+    the files once dead rows exceed VECTOR_COMPACT_RATIO. Single writer process.
+
+    With quantization ('float16' or 'int8'), a derived vectors.f16 / vectors.i8
+    (+ scales.f32) copy is scanned for candidates and only those rows are read
+    from vectors.f32 for exact rescoring, so the float32 file stays mostly
+    out of memory. The copy is rebuilt from vectors.f32 whenever it is missing
+    or out of step, so the mode can be switched on an existing store.
+    """
+
+    def __init__(self, path=None, quantization=None):
+        self.path = path or os.path.join(DEFAULT_NUMPY_PATH, DEFAULT_COLLECTION)
+        self.name = os.path.basename(os.path.normpath(self.path))
+        self.quantization = (quantization or VECTOR_QUANTIZATION).lower()
+        if self.quantization not in ('none', *QUANTIZED_DTYPES):
+            raise ValueError(f"Unknown VECTOR_QUANTIZATION: {self.quantization}")
+        os.makedirs(self.path, exist_ok=True)
+        self.vectors_file = os.path.join(self.path, 'vectors.f32')
+        self.records_file = os.path.join(self.path, 'records.jsonl')
+        self.meta_file = os.path.join(self.path, 'meta.json')
+        suffix = {'float16': 'f16', 'int8': 'i8'}.get(self.quantization)
+        self.quantized_file = os.path.join(self.path, f'vectors.{suffix}') if suffix else None
+        self.scales_file = os.path.join(self.path, 'scales.f32') if self.quantization == 'int8' else None
+        self._lock = threading.RLock()
+        self._load()
+
+    # --- Loading -------------------------------------------------------------
+
+    def _load(self):
+        meta = {'dim': None, 'rows': 0}
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file) as f:
+                meta = json.load(f)
+        self.dim = meta['dim']
+        self.rows = meta['rows']
+        if self.dim and os.path.exists(self.vectors_file):
+            # Never map past the end of the vectors file (interrupted compaction)
+            self.rows = min(self.rows, os.path.getsize(self.vectors_file) // (self.dim * 4))
+
+        self.id_to_row = {}
+        self.row_ids = [None] * self.rows
+        self.documents = [None] * self.rows
+        self.metadatas = [None] * self.rows
+        if os.path.exists(self.records_file):
+            with open(self.records_file, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Torn final line from an interrupted write
+                    if record.get('deleted'):
+                        self.id_to_row.pop(record['id'], None)
+                        continue
+                    row = record['row']
+                    if row >= self.rows:
+                        continue
+                    previous = self.row_ids[row]
+                    if previous is not None and self.id_to_row.get(previous) == row:
+                        del self.id_to_row[previous]  # Row re-written after an interrupted append
+                    self.row_ids[row] = record['id']
+                    self.documents[row] = record.get('document')
+                    self.metadatas[row] = record.get('metadata')
+                    self.id_to_row[record['id']] = row
+
+        self.live = np.zeros(self.rows, dtype=bool)
+        if self.id_to_row:
+            self.live[list(self.id_to_row.values())] = True
+        self._map()
+
+    def _map(self):
+        """(Re)open the memory maps; pages are loaded lazily by the OS."""
+        if self.rows and self.dim:
+            self.matrix = np.memmap(self.vectors_file, dtype=np.float32, mode='r', shape=(self.rows, self.dim))
+        else:
+            self.matrix = np.zeros((0, self.dim or 0), dtype=np.float32)
+
+        self.codes, self.scales = None, None
+        if not self.quantized_file:
+            return
+        self._sync_quantized()
+        if self.rows and self.dim:
+            dtype = QUANTIZED_DTYPES[self.quantization]
+            self.codes = np.memmap(self.quantized_file, dtype=dtype, mode='r', shape=(self.rows, self.dim))
+            if self.scales_file:
+                self.scales = np.memmap(self.scales_file, dtype=np.float32, mode='r', shape=(self.rows,))
+        else:
+            self.codes = np.zeros((0, self.dim or 0), dtype=QUANTIZED_DTYPES[self.quantization])
+            self.scales = np.zeros(0, dtype=np.float32) if self.scales_file else None
+
+    def _sync_quantized(self):
+        """Bring the quantized copy in line with vectors.f32 (append missing rows, drop torn ones)."""
+        if not self.dim:
+            return
+        itemsize = np.dtype(QUANTIZED_DTYPES[self.quantization]).itemsize
+        have = os.path.getsize(self.quantized_file) // (self.dim * itemsize) if os.path.exists(self.quantized_file) else 0
+        if self.scales_file:
+            have = min(have, os.path.getsize(self.scales_file) // 4 if os.path.exists(self.scales_file) else 0)
+        have = min(have, self.rows)
+
+        with open(self.quantized_file, 'ab') as qf:
+            qf.truncate(have * self.dim * itemsize)
+            sf = open(self.scales_file, 'ab') if self.scales_file else None
+            try:
+                if sf:
+                    sf.truncate(have * 4)
+                for start in range(have, self.rows, VECTOR_BLOCK_ROWS):
+                    codes, scales = quantize(np.asarray(self.matrix[start:start + VECTOR_BLOCK_ROWS]), self.quantization)
+                    qf.write(codes.tobytes())
+                    if sf:
+                        sf.write(scales.tobytes())
+            finally:
+                if sf:
+                    sf.close()
+
+    def _write_meta(self):
+        tmp = self.meta_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'dim': self.dim, 'rows': self.rows}, f)
+        os.replace(tmp, self.meta_file)
+
+    # --- Writes --------------------------------------------------------------
+
+    @staticmethod
+    def _normalise(embeddings):
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0  # Zero (fallback) embeddings stay zero: distance 1 to everything
+        return matrix / norms
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        matrix = self._normalise(embeddings)
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+        with self._lock:
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+            if matrix.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {matrix.shape[1]} does not match store dimension {self.dim}")
+
+            # Keep the files aligned with meta['rows'] if a previous write was interrupted
+            with open(self.vectors_file, 'ab') as f:
+                f.truncate(self.rows * self.dim * 4)
+                f.write(matrix.tobytes())
+
+            first = self.rows
+            with open(self.records_file, 'a', encoding='utf-8') as f:
+                for i, doc_id in enumerate(ids):
+                    f.write(json.dumps({'row': first + i, 'id': doc_id, 'document': documents[i],
+                                        'metadata': metadatas[i]}) + '\n')
+
+            self.rows += len(ids)
+            self._write_meta()
+
+            self.row_ids.extend(ids)
+            self.documents.extend(documents)
+            self.metadatas.extend(metadatas)
+            self.live = np.concatenate([self.live, np.ones(len(ids), dtype=bool)])
+            for i, doc_id in enumerate(ids):
+                old = self.id_to_row.get(doc_id)
+                if old is not None:
+                    self.live[old] = False
+                self.id_to_row[doc_id] = first + i
+            self._map()
+            self._maybe_compact()
+
+    def delete(self, ids):
+        with self._lock:
+            with open(self.records_file, 'a', encoding='utf-8') as f:
+                for doc_id in ids:
+                    row = self.id_to_row.pop(doc_id, None)
+                    if row is not None:
+                        self.live[row] = False
+                        f.write(json.dumps({'id': doc_id, 'deleted': True}) + '\n')
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        dead = self.rows - len(self.id_to_row)
+        if self.rows and dead / self.rows > VECTOR_COMPACT_RATIO:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the files with live rows only (crash-safe: new files replace old ones at the end)."""
+        with self._lock:
+            keep = [row for row in range(self.rows) if self.live[row]]
+            with open(self.vectors_file + '.tmp', 'wb') as f:
+                for start in range(0, len(keep), VECTOR_BLOCK_ROWS):
+                    f.write(np.ascontiguousarray(self.matrix[keep[start:start + VECTOR_BLOCK_ROWS]]).tobytes())
+            with open(self.records_file + '.tmp', 'w', encoding='utf-8') as f:
+                for new_row, row in enumerate(keep):
+                    f.write(json.dumps({'row': new_row, 'id': self.row_ids[row], 'document': self.documents[row],
+                                        'metadata': self.metadatas[row]}) + '\n')
+
+            # Drop the maps before replacing the files they point at; quantized copies are rebuilt on load
+            self.matrix = self.codes = self.scales = None
+            for derived in (self.quantized_file, self.scales_file):
+                if derived and os.path.exists(derived):
+                    os.remove(derived)
+            os.replace(self.vectors_file + '.tmp', self.vectors_file)
+            os.replace(self.records_file + '.tmp', self.records_file)
+            self.rows = len(keep)
+            self._write_meta()
+            self._load()
+
+    # --- Reads ---------------------------------------------------------------
+
+    def query(self, query_embeddings, n_results=3):
+        queries = self._normalise(query_embeddings)
+        with self._lock:
+            matrix, live, codes, scales = self.matrix, self.live, self.codes, self.scales
+            # Append-only until compact() swaps in new lists, so these references stay row-aligned
+            row_ids, documents, metadatas = self.row_ids, self.documents, self.metadatas
+        k = min(n_results, int(live.sum()))
+        if not k or queries.shape[1] != matrix.shape[1]:
+            return _query_result([[] for _ in range(len(queries))])
+
+        if self.quantization == 'none' or codes is None:
+            best_scores, best_rows = blocked_top_k(queries, matrix, live, k)
+        else:
+            # Cheap candidate scan on the quantized copy, then exact float32 rescoring
+            candidates = min(int(live.sum()), max(k * VECTOR_RERANK_FACTOR, VECTOR_RERANK_MIN))
+            _, candidate_rows = blocked_top_k(queries, codes, live, candidates, scales=scales)
+            best_scores = np.empty((len(queries), k), dtype=np.float32)
+            best_rows = np.empty((len(queries), k), dtype=np.int64)
+            for i, rows_i in enumerate(candidate_rows):
+                rows_i = np.sort(rows_i)  # Sequential reads from the mmap
+                exact = np.asarray(matrix[rows_i]) @ queries[i]
+                top = np.argpartition(-exact, k - 1)[:k] if len(exact) > k else np.arange(len(exact))
+                best_scores[i], best_rows[i] = exact[top], rows_i[top]
+
+        results = []
+        for scores, found in zip(best_scores, best_rows):
+            order = np.argsort(-scores, kind='stable')
+            results.append([(row_ids[r], documents[r], metadatas[r], float(1.0 - s))
+                            for s, r in zip(scores[order], found[order]) if np.isfinite(s)])
+        return _query_result(results)
+
+    def get(self, ids=None, limit=None, offset=0, include_embeddings=False):
+        with self._lock:
+            if ids is None:
+                rows = sorted(self.id_to_row.values())
+            else:
+                rows = [self.id_to_row[i] for i in ids if i in self.id_to_row]
+            rows = rows[offset:offset + limit if limit is not None else None]
+            out = {
+                'ids': [self.row_ids[r] for r in rows],
+                'documents': [self.documents[r] for r in rows],
+                'metadatas': [self.metadatas[r] for r in rows],
+            }
+            if include_embeddings:
+                out['embeddings'] = [self.matrix[r].tolist() for r in rows]
+        return out
+
+    def count(self):
+        return len(self.id_to_row)
+
+    def index_bytes(self):
+        """Bytes scanned per query: the quantized copy when enabled, else the float32 matrix."""
+        if self.codes is not None:
+            return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+        return self.matrix.nbytes
+
+
+def store_root(backend=None):
+    """Directory holding every collection of a backend."""
+    backend = (backend or VECTOR_STORE_BACKEND).lower()
+    if backend == 'numpy':
+        return os.getenv('VECTOR_STORE_PATH') or DEFAULT_NUMPY_PATH
+    if backend == 'chroma':
+        return os.getenv('CHROMA_DB_PATH') or DEFAULT_DB_PATH
+    raise ValueError(f"Unknown VECTOR_STORE_BACKEND: {backend}")
+
+
+_active_cache = {}
+
+
+def active_collection(root):
+    """Name of the collection queries should use (cached on the pointer file's mtime)."""
+    pointer = os.path.join(root, ACTIVE_COLLECTION_FILE)
+    try:
+        mtime = os.stat(pointer).st_mtime_ns
+    except FileNotFoundError:
+        return DEFAULT_COLLECTION
+    cached = _active_cache.get(pointer)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(pointer) as f:
+            name = json.load(f).get('collection') or DEFAULT_COLLECTION
+    except ValueError:
+        return DEFAULT_COLLECTION
+    _active_cache[pointer] = (mtime, name)
+    return name
+
+
+def set_active_collection(root, name):
+    """Atomically point readers at another collection."""
+    os.makedirs(root, exist_ok=True)
+    pointer = os.path.join(root, ACTIVE_COLLECTION_FILE)
+    tmp = pointer + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'collection': name}, f)
+    os.replace(tmp, pointer)
+
+
+def get_vector_store(backend=None, path=None, quantization=None, collection=None):
+    """
+    Build the configured vector store.
+
+    Args:
+        backend: 'chroma' or 'numpy' (defaults to VECTOR_STORE_BACKEND).
+        path: Root directory (defaults to CHROMA_DB_PATH / VECTOR_STORE_PATH, then data/).
+        quantization: 'none', 'float16' or 'int8' (numpy backend only; defaults to VECTOR_QUANTIZATION).
+        collection: Collection name (defaults to the active collection under the root).
+    """
+    backend = (backend or VECTOR_STORE_BACKEND).lower()
+    root = path or store_root(backend)
+    collection = collection or active_collection(root)
+    if backend == 'numpy':
+        return NumpyVectorStore(os.path.join(root, collection), quantization)
+    if (quantization or VECTOR_QUANTIZATION).lower() != 'none':
+        print("⚠️  Vector quantization is only supported by the numpy backend; using full-precision Chroma.")
+    return ChromaVectorStore(root, collection)
+
+
+def delete_collection(backend, root, name):
+    """Remove a whole collection (used to clean up shadow/old collections after a reindex)."""
+    backend = (backend or VECTOR_STORE_BACKEND).lower()
+    if backend == 'numpy':
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        return
+    import chromadb
+    try:
+        chromadb.PersistentClient(path=root).delete_collection(name)
+    except Exception:
+        pass  # Already gone
@@ -1,5 +1,4 @@
-import csv
-import json
+import copy
 import os
 import argparse
 from datetime import datetime
@@ -13,15 +12,32 @@ load_dotenv()
 # Import existing modules
 from app.ocr_module import extract_text_from_file
 from app.certificate_identification import is_certificate
-from app.field_extraction import extract_with_azure, extract_fields, create_json_output
+from app.field_extraction import extract_fields, extract_batch_with_azure, PACKED_MAX_DOCS
+from app.rule_extraction import extract_with_fast_path, try_rule_fast_path
 from app.date_validation import validate_dates, validate_issuer
 from app.logging_utils import log_extraction, check_for_issues
-from app.security import validate_secure_path, MAX_BATCH_SIZE, redact_pii
-from app.status_assignment import assign_certificate_status
-from app.external_verification import verify_external_issuer
+from app.security import MAX_BATCH_CONCURRENCY, MAX_BATCH_FILES_PER_SEC
+from app.intake import iter_sources, run_bounded, chunked, JsonArrayWriter, JsonLinesWriter
+from app.records import (
+    CertificateResult, CertificateFields, FieldConfidence, DateValidation, IssuerValidation, RedactedView, dumps,
+)
+from app.status_assignment import resolve_final_status
+from app import near_duplicate, issuer_index
+from app.deadline import DeadlineExceeded, DEADLINE_FLAG
+from app.document import Document
+from app.metrics import span, incr
 
-def process_single_file(file_path):
-    """Run the entire extraction pipeline on a single file"""
+def _doc_id(file_path):
+    return os.path.basename(file_path).split('.')[0]
+
+def prepare_document(file_path, deadline=None):
+    """
+    Stage 1 of the pipeline: read a file and check it is a certificate.
+    Returns (doc_id, document), or None if the file is rejected. The
+    app.document.Document is handed to every later stage, so features derived
+    from the text (lower-cased text, hashes, date spans, windows) are computed once.
+    Raises DeadlineExceeded if `deadline` runs out during OCR.
+    """
     print(f"--- Processing: {file_path} ---")
     
     # Security: Path validation handled inside extract_text_from_file -> validate_secure_path
@@ -37,131 +53,244 @@ def process_single_file(file_path):
     # Use centralized extraction module
     # Note: validate_secure_path is called inside here now
     try:
-        text_content, used_ocr = extract_text_from_file(file_path)
+        with span('ocr'):
+            text_content, used_ocr = extract_text_from_file(file_path, deadline=deadline)
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"⛔ Security/Error: {e}")
         return None
 
     if not text_content:
         print("⚠️  No text could be extracted.")
+    document = Document(text_content, doc_id=_doc_id(file_path), file_type=file_ext, used_ocr=used_ocr)
 
     # Check identification
-    is_valid = is_certificate(file_ext, text_content)
+    with span('identification'):
+        is_valid = is_certificate(file_ext, document)
     if not is_valid:
         print("❌ Document is NOT classified as a certificate.")
         return None
 
     print("✅ Identified as certificate.")
+    return document.doc_id, document
 
-    # 2. Extraction
-    print("⏳ Extracting fields...")
-    extractor_output = extract_with_azure(text_content)
-    fields, confidence = extract_fields(extractor_output)
+def finalize_document(doc_id, extractor_output, duplicate_of=None):
+    """
+    Stage 3 of the pipeline: validate extracted fields, log, and assign the final status.
+    `duplicate_of` is the near_duplicate.check() match, if any.
+    """
+    with span('extraction'):
+        fields, confidence = extract_fields(extractor_output)
 
     # 3. Validation
-    val_result = validate_dates(fields.get('issued_date'), fields.get('expiry_date'))
-    
-    # New: Issuer Validation
-    issuer_validation = validate_issuer(fields.get('issuer'))
-    
-    # 4. JSON & Logging
-    flags = check_for_issues(fields, confidence)
-    doc_id = os.path.basename(file_path).split('.')[0]
+    with span('validation'):
+        val_result = validate_dates(fields.get('issued_date'), fields.get('expiry_date'))
+        
+        # New: Issuer Validation
+        issuer_validation = validate_issuer(fields.get('issuer'))
+        
+        # 4. JSON & Logging
+        flags = check_for_issues(fields, confidence)
+        if duplicate_of:
+            flags.append("NEAR_DUPLICATE")
+        timed_out = extractor_output.get('_deadline_exceeded', False)
+        if timed_out:
+            flags.append(DEADLINE_FLAG)
     
     # Extract voting debug info if present (Available for debug if needed, but not logged)
     voting_details = extractor_output.get('_voting_debug', {})
     
     # output = create_json_output(doc_id, fields, confidence, flags) # Old call
     # We need to log it. Let's pass it to log_extraction
-    log_extraction(doc_id, fields, confidence, val_result, flags)
-    
-    output = create_json_output(doc_id, fields, confidence, flags)
-    
-    # New: Final Status
-    final_status = assign_certificate_status(output, val_result, issuer_validation)
-    
-    # --- TASK 7 IMPLEMENTATION: External Verification ---
-    # If standard validation says "Untrusted Issuer", we try External API
-    external_verification = None
+    with span('logging'):
+        log_extraction(doc_id, fields, confidence, val_result, flags)
     
-    if final_status == "Untrusted Issuer" or issuer_validation['status'] == 'Untrusted Issuer':
-        print("🔍 Internal validation failed. Attempting Task 7: External Verification...")
-        external_stats = verify_external_issuer(fields.get('issuer'), fields)
-        
-        # Override final status if external check returned a decisive status
-        if "Verified" in external_stats['status']:
-            final_status = "Verified"
-            issuer_validation['status'] = "Verified via External API"
-        elif "Manual" in external_stats['status']:
-            final_status = "Manual Review Required"
-            
-        external_verification = external_stats
-
-    output['validation'] = val_result
-    output['issuer_validation'] = issuer_validation
-    output['external_verification'] = external_verification
-    output['final_status'] = final_status
+    # New: Final Status (with Task 7 external verification for untrusted issuers)
+    if timed_out:
+        # Partial extraction: never auto-verify what the pipeline did not finish reading
+        final_status, external_verification = "Manual Review Required", None
+    else:
+        final_status, issuer_validation, external_verification = resolve_final_status(
+            fields, confidence, val_result, issuer_validation)
+
     # output['voting_analysis'] = voting_details 
     
-    return output
+    return CertificateResult(
+        doc_id=doc_id,
+        fields=CertificateFields.from_dict(fields),
+        confidence=FieldConfidence.from_dict(confidence),
+        confidence_flags=flags,
+        validation=DateValidation.from_dict(val_result),
+        issuer_validation=IssuerValidation.from_dict(issuer_validation),
+        external_verification=external_verification,
+        final_status=final_status,
+        near_duplicate=duplicate_of,
+    )
 
-def process_batch(csv_file):
-    """Read a CSV and process all files listed"""
-    results = []
-    
-    # Security: Validate CSV path
+def _register(doc_id, document, extractor_output):
+    # Empty or deadline-cut extractions must not be handed to later duplicates
+    if extractor_output and not extractor_output.get('_deadline_exceeded'):
+        near_duplicate.register(doc_id, document, extractor_output)
+
+def process_single_file(file_path, deadline=None):
+    """
+    Run the entire extraction pipeline on a single file (returns a CertificateResult or None).
+
+    With a `deadline` (app.deadline.Deadline), OCR and extraction calls are bounded by
+    the remaining budget; if it runs out, the partial result is returned flagged
+    DEADLINE_EXCEEDED with status "Manual Review Required".
+    """
     try:
-        csv_file = validate_secure_path(csv_file)
-    except Exception as e:
-        print(f"⛔ Security Error: {e}")
-        return
+        prepared = prepare_document(file_path, deadline)
+    except DeadlineExceeded as e:
+        print(f"⏱️  {e}. Returning an empty result for manual review.")
+        incr('deadline_exceeded')
+        return finalize_document(_doc_id(file_path), {'_deadline_exceeded': True})
+    if not prepared:
+        return None
+    doc_id, document = prepared
 
-    print(f"🚀 Starting Batch Processing from: {csv_file}")
-    
-    valid_files = []
-    with open(csv_file, 'r') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if row:
-                valid_files.append(row[0])
-                
-    # Security: DoS Protection
-    if len(valid_files) > MAX_BATCH_SIZE:
-         print(f"⛔ Batch too large! Limit is {MAX_BATCH_SIZE}. Found: {len(valid_files)}")
-         return
-
-    print(f"Found {len(valid_files)} files to process.\n")
-
-    for file_path in valid_files:
-        # Security: Allow relative paths in CSV to be resolved against data dir if needed
-        # But our simple validator expects absolute or correct relative paths.
-        # Let's rely on process_single_file calling extract_text_from_file which validates it.
-        result = process_single_file(file_path.strip())
-        if result:
-            results.append(result)
+    # Near-duplicate check (template clones, re-scans) before paying for extraction
+    with span('near_duplicate'):
+        duplicate_of, extractor_output = near_duplicate.check(doc_id, document)
+    if duplicate_of:
+        print(f"👯 Near-duplicate of {duplicate_of['doc_id']} (similarity {duplicate_of['similarity']})")
+
+    # 2. Extraction
+    if extractor_output:
+        print("♻️  Reusing earlier extraction (no field-bearing lines changed)")
+        incr('extraction_reused')
+    else:
+        print("⏳ Extracting fields...")
+        with span('extraction'):
+            extractor_output = extract_with_fast_path(document, deadline=deadline)
+    _register(doc_id, document, extractor_output)
+
+    return finalize_document(doc_id, extractor_output, duplicate_of)
+
+def _process_packed(file_paths):
+    """
+    Batch pipeline with packed extraction: certificates the rule fast path
+    cannot handle share multi-document LLM requests instead of 1-3 calls each.
+    """
+    prepared = []
+    for file_path in file_paths:
+        doc = prepare_document(file_path)
+        if doc:
+            prepared.append(doc)
         print("-" * 30)
 
-    # Save Batch Results
-    output_file = 'batch_results.json'
-    
+    extractor_outputs = {}
+    duplicates = {}
+    needs_llm = []
+    waiting = {}  # content hash -> first document in this pack sent to the LLM with that text
+    copies = {}   # index -> index of an identical document earlier in this pack
+    for i, (doc_id, document) in enumerate(prepared):
+        duplicates[i], reused = near_duplicate.check(doc_id, document)
+        if reused:
+            incr('extraction_reused')
+            extractor_outputs[i] = reused
+        elif document.content_hash in waiting:
+            # Identical to a document still waiting for the packed call: share its answer
+            first = waiting[document.content_hash]
+            copies[i] = first
+            duplicates[i] = {'doc_id': prepared[first][0], 'similarity': 1.0, 'reused_extraction': True}
+            continue
+        else:
+            rule_output = try_rule_fast_path(document)
+            if not rule_output:
+                waiting[document.content_hash] = i
+                needs_llm.append(i)
+                continue
+            extractor_outputs[i] = rule_output
+        # Index right away so later documents in the same pack can match this one
+        _register(doc_id, document, extractor_outputs[i])
+
+    if needs_llm:
+        print(f"⏳ Extracting fields for {len(needs_llm)} certificate(s) with packed requests...")
+        with span('extraction'):
+            packed = extract_batch_with_azure([prepared[i] for i in needs_llm])
+        extractor_outputs.update(zip(needs_llm, packed))
+        for i in needs_llm:
+            _register(*prepared[i], extractor_outputs[i])
+    for i, first in copies.items():
+        incr('extraction_reused')
+        extractor_outputs[i] = copy.deepcopy(extractor_outputs[first])
+
+    return [finalize_document(doc_id, extractor_outputs[i], duplicates[i]) for i, (doc_id, _) in enumerate(prepared)]
+
+def _redacted(result):
     # Security: Redact PII in Batch Output
-    safe_results = []
-    for res in results:
-        res_copy = res.copy()
-        if 'fields' in res_copy:
-            res_copy['fields'] = redact_pii(res_copy['fields'])
-        safe_results.append(res_copy)
-        
-    with open(output_file, 'w') as f:
-        json.dump(safe_results, f, indent=2)
+    return dumps(RedactedView(result))
+
+def process_batch(sources, output_file='batch_results.json', packed=False,
+                  concurrency=MAX_BATCH_CONCURRENCY, rate=MAX_BATCH_FILES_PER_SEC):
+    """
+    Process every file from one or more sources and stream results to output_file.
+
+    Args:
+        sources: CSV file, directory, glob pattern, '-' for stdin, or a list of these.
+        concurrency: Files (or packs, with `packed`) processed at the same time.
+        rate: Maximum files started per second (0 = unlimited).
+    """
+    print(f"🚀 Starting Batch Processing from: {sources}")
+    seen = [0]
+
+    def counted(paths):
+        for path in paths:
+            seen[0] += 1
+            yield path.strip()
+
+    try:
+        paths = counted(iter_sources(sources))
+        if packed:
+            # Packs are formed from consecutive files; each pack is one unit of work
+            work = run_bounded(_process_packed, chunked(paths, PACKED_MAX_DOCS * 2), concurrency, rate / PACKED_MAX_DOCS / 2)
+        else:
+            # Paths are validated inside extract_text_from_file -> validate_secure_path
+            work = run_bounded(process_single_file, paths, concurrency, rate)
+
+        processed = 0
+        writer_type = JsonLinesWriter if output_file.endswith('.jsonl') else JsonArrayWriter
+        # Issuer -> certificate index (same as /upload), so trusted-list edits can re-verify batch results
+        conn = issuer_index.connect()
+        try:
+            with writer_type(output_file, _redacted) as writer:
+                to_index = []
+                for item, result in work:
+                    if isinstance(result, Exception):
+                        print(f"❌ Failed: {item}: {result}")
+                        continue
+                    for res in (result if packed else [result]):
+                        if res:
+                            writer.write(res)
+                            to_index.append(res)
+                            processed += 1
+                    if len(to_index) >= issuer_index.UPDATE_BATCH:
+                        issuer_index.record_certificates(conn, to_index)
+                        to_index = []
+                    print("-" * 30)
+                issuer_index.record_certificates(conn, to_index)
+        finally:
+            conn.close()
+    except (PermissionError, FileNotFoundError) as e:
+        print(f"⛔ Security Error: {e}")
+        return
 
     print(f"\n✅ Batch Processing Complete.")
     print(f"📄 Results saved to: {output_file} (PII Redacted)")
-    print(f"📊 Processed {len(results)}/{len(valid_files)} certificates successfully.")
+    print(f"📊 Processed {processed}/{seen[0]} certificates successfully.")
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Batch process certificates from CSV')
-    parser.add_argument('--csv', default='data/batch_test.csv', help='Path to CSV file containing file paths')
+    parser = argparse.ArgumentParser(description='Batch process certificates from CSV files, directories, globs or stdin')
+    parser.add_argument('sources', nargs='*', help="CSV file, directory, glob pattern or '-' for paths on stdin")
+    parser.add_argument('--csv', default='data/batch_test.csv', help='Path to CSV file containing file paths (used when no sources are given)')
+    parser.add_argument('--output', default='batch_results.json', help='Where to stream the results (.json array or .jsonl)')
+    parser.add_argument('--packed', action='store_true', help='Pack several certificates into each LLM request')
+    parser.add_argument('--concurrency', type=int, default=MAX_BATCH_CONCURRENCY, help='Files processed in parallel')
+    parser.add_argument('--rate', type=float, default=MAX_BATCH_FILES_PER_SEC, help='Max files started per second (0 = unlimited)')
     args = parser.parse_args()
     
-    process_batch(args.csv)
+    process_batch(args.sources or args.csv, output_file=args.output, packed=args.packed,
+                  concurrency=args.concurrency, rate=args.rate)
@@ -0,0 +1,102 @@
+"""
+Synthetic certificate corpus for benchmarks and load tests.
+Texts mimic OCR/PDF output: a few labelled fields buried in boilerplate and noise.
+"""
+import os
+import random
+from datetime import date, timedelta
+
+ISSUERS_TRUSTED = ["ISO Authority", "Global Tech Institute", "IEEE", "Oracle University",
+                   "Microsoft Training", "AWS Training", "University of Kerala"]
+ISSUERS_OTHER = ["Acme Learning Hub", "Northwind Academy", "AWS", "Coursera", "Skyline Skills Centre"]
+SUBJECTS = ["Quality Management System", "Advanced Python Systems Engineering", "Cloud Fundamentals",
+            "Data Privacy Essentials", "Project Management Professional", "Network Security Basics"]
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%B %d, %Y', '%d-%m-%Y', '%d %B %Y']
+
+NOISE_WORDS = ("the of and in to with for this that on is by as at an be are from was it has "
+               "program module assessment grade credit hours participant record page seal").split()
+
+TEMPLATES = [
+    """CERTIFICATE OF COMPLETION
+This is to certify that {name} has completed the {subject}.
+Certificate Number: {number}
+Issued By: {issuer}
+Issued On: {issued}
+Valid Until: {expiry}
+{noise}
+Authorized Signature""",
+    """{issuer}
+{noise}
+Certificate of Achievement
+Awarded to {name}
+Subject: {subject}
+Certificate No: {number}
+Issue Date: {issued}
+Expiry Date: {expiry}
+Signature""",
+    """TO WHOMSOEVER IT MAY CONCERN
+{noise}
+This is to certify that {name} has successfully completed {subject}.
+Credential ID: {number}
+Issuer: {issuer}
+Date of Issue: {issued}
+Expires: {expiry}
+{noise}""",
+]
+
+NON_CERTIFICATE = """Meeting notes
+{noise}
+Action items were discussed and the next sync is on Friday."""
+
+NAMES = ["Asha Menon", "Rahul Nair", "Jacob Thomas", "Priya Iyer", "Wei Zhang", "Maria Garcia"]
+
+
+def _noise(rng, words):
+    return " ".join(rng.choice(NOISE_WORDS) for _ in range(words))
+
+
+def generate_text(rng, noise_words=80, certificate=True):
+    """One synthetic document text."""
+    if not certificate:
+        return NON_CERTIFICATE.format(noise=_noise(rng, noise_words))
+
+    issued = date(2020, 1, 1) + timedelta(days=rng.randrange(0, 2000))
+    expiry = issued + timedelta(days=rng.choice([365, 730, 1095, 1825]))
+    fmt = rng.choice(DATE_FORMATS)
+    issuer = rng.choice(ISSUERS_TRUSTED if rng.random() < 0.7 else ISSUERS_OTHER)
+    return rng.choice(TEMPLATES).format(
+        name=rng.choice(NAMES),
+        subject=rng.choice(SUBJECTS),
+        number=f"{issuer[:3].upper()}-{issued.year}-{rng.randrange(10000, 99999)}",
+        issuer=issuer,
+        issued=issued.strftime(fmt),
+        expiry=expiry.strftime(fmt),
+        noise=_noise(rng, noise_words),
+    )
+
+
+def generate_texts(n, seed=0, noise_words=80, certificate_ratio=0.9):
+    """In-memory corpus: list of (is_certificate, text)."""
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        is_cert = rng.random() < certificate_ratio
+        out.append((is_cert, generate_text(rng, noise_words, is_cert)))
+    return out
+
+
+def generate_corpus(out_dir, n, seed=0, noise_words=80, certificate_ratio=0.9):
+    """
+    Write `n` synthetic .txt documents into `out_dir` (must live under data/).
+
+    Returns:
+        list: File paths, in generation order.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i, (_, text) in enumerate(generate_texts(n, seed, noise_words, certificate_ratio)):
+        path = os.path.join(out_dir, f"bench_{i:05d}.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        paths.append(path)
+    return paths
@@ -0,0 +1,212 @@
+"""
+Local stand-in for the Azure OpenAI client.
+
+Mimics the parts of `AzureOpenAI` the pipeline uses (chat completions, vision
+and embeddings) with configurable latency, error rate and response variety, so
+benchmarks and load tests can exercise the real code paths without network access.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+EMBEDDING_DIM = 1536
+FAKE_ENDPOINT = "https://fake-azure.local"
+
+
+class FakeConfig:
+    """Behaviour knobs shared by every fake client instance."""
+
+    def __init__(self, latency=0.05, jitter=0.0, error_rate=0.0, variety=0.0,
+                 embedding_latency=None, seed=None):
+        self.latency = latency                # Mean seconds per chat/vision call
+        self.jitter = jitter                  # +/- fraction of latency
+        self.error_rate = error_rate          # Probability a call raises a 429
+        self.variety = variety                # Probability a field answer is perturbed
+        self.embedding_latency = latency / 5 if embedding_latency is None else embedding_latency
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {'chat': 0, 'vision': 0, 'embeddings': 0, 'errors': 0}
+
+    def _sleep(self, base):
+        with self.lock:
+            factor = 1 + self.rng.uniform(-self.jitter, self.jitter) if self.jitter else 1
+        time.sleep(max(0.0, base * factor))
+
+    def _roll(self, probability):
+        if probability <= 0:
+            return False
+        with self.lock:
+            return self.rng.random() < probability
+
+    def _count(self, kind):
+        with self.lock:
+            self.calls[kind] += 1
+
+
+def _rate_limit_error():
+    request = httpx.Request('POST', f"{FAKE_ENDPOINT}/openai/deployments/fake/chat/completions")
+    response = httpx.Response(429, headers={'retry-after': '0.1'}, request=request)
+    return openai.RateLimitError("Rate limit exceeded (fake backend)", response=response, body=None)
+
+
+def _usage(prompt, completion):
+    return SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=len(completion) // 4,
+                           total_tokens=(len(prompt) + len(completion)) // 4)
+
+
+def _chat_response(content, prompt=''):
+    message = SimpleNamespace(role='assistant', content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason='stop', index=0)],
+                           usage=_usage(prompt, content))
+
+
+# --- Field answers -----------------------------------------------------------
+
+_LABELS = {
+    'issuer': r'(?:issued by|issuer|awarded by)\s*[:\-]?\s*(.+)',
+    'certificate_number': r'(?:certificate (?:number|no\.?|id)|credential id)\s*[:\-]?\s*([A-Za-z0-9\-/]+)',
+    'issued_date': r'(?:issued on|issue date|date of issue)\s*[:\-]?\s*(.+)',
+    'expiry_date': r'(?:valid until|expiry date|expires on|expires|expiry)\s*[:\-]?\s*(.+)',
+    'subject': r'(?:has (?:successfully )?completed(?: the)?|subject\s*:)\s*(.+?)(?:\.|$)',
+}
+
+
+def _answer_fields(certificate_text):
+    """Pull the five fields out of a synthetic certificate like a well-behaved model would."""
+    answer = {}
+    for field, pattern in _LABELS.items():
+        match = re.search(pattern, certificate_text, re.IGNORECASE | re.MULTILINE)
+        answer[field] = match.group(1).strip() if match else None
+    return answer
+
+
+def _perturb(value, rng):
+    """Trivially different phrasing of the same answer (case, spacing), or a miss."""
+    if value is None:
+        return None
+    choice = rng.randrange(4)
+    if choice == 0:
+        return value.upper()
+    if choice == 1:
+        return f" {value}  "
+    if choice == 2:
+        return value.lower()
+    return None
+
+
+class _ChatCompletions:
+    def __init__(self, config):
+        self.config = config
+
+    def create(self, model=None, messages=None, temperature=None, timeout=None, max_tokens=None, **kwargs):
+        config = self.config
+        user_content = messages[-1]['content'] if messages else ''
+
+        if isinstance(user_content, list):
+            return self._vision(user_content)
+
+        config._count('chat')
+        config._sleep(config.latency)
+        if config._roll(config.error_rate):
+            config._count('errors')
+            raise _rate_limit_error()
+
+        packed = re.findall(r'Certificate (d\d+):\s*"""(.*?)"""', user_content, re.DOTALL)
+        blocks = re.findall(r'"""(.*?)"""', user_content, re.DOTALL)
+        if packed:
+            content = json.dumps([dict(json.loads(self._extraction(text)), doc_id=doc_id)
+                                  for doc_id, text in packed])
+        elif blocks and 'Fields to extract' in user_content:
+            content = self._extraction(blocks[-1])
+        else:
+            content = "Based on the certificate records, the certificate is issued by a trusted issuer."
+        return _chat_response(content, user_content)
+
+    def _extraction(self, certificate_text):
+        answer = _answer_fields(certificate_text)
+        if self.config.variety:
+            with self.config.lock:
+                rng = self.config.rng
+                for field in answer:
+                    if rng.random() < self.config.variety:
+                        answer[field] = _perturb(answer[field], rng)
+        return json.dumps(answer)
+
+    def _vision(self, parts):
+        config = self.config
+        config._count('vision')
+        config._sleep(config.latency * 2)  # Vision calls are the slowest
+        if config._roll(config.error_rate):
+            config._count('errors')
+            raise _rate_limit_error()
+        image_url = next((p['image_url']['url'] for p in parts if p.get('type') == 'image_url'), '')
+        digest = hashlib.sha1(image_url.encode('utf-8')).hexdigest()[:8].upper()
+        text = (
+            "CERTIFICATE OF COMPLETION\n"
+            "This is to certify that the holder has completed the Cloud Fundamentals course.\n"
+            f"Certificate Number: IMG-{digest}\n"
+            "Issued By: Global Tech Institute\n"
+            "Issued On: 2024-03-10\n"
+            "Valid Until: 2027-03-10\n"
+        )
+        return _chat_response(text)
+
+
+class _Embeddings:
+    def __init__(self, config):
+        self.config = config
+
+    def create(self, input=None, model=None, **kwargs):
+        config = self.config
+        config._count('embeddings')
+        config._sleep(config.embedding_latency)
+        texts = input if isinstance(input, list) else [input]
+        data = [SimpleNamespace(embedding=fake_embedding(t), index=i, object='embedding')
+                for i, t in enumerate(texts)]
+        return SimpleNamespace(data=data, model=model, usage=_usage(''.join(texts), ''))
+
+
+def fake_embedding(text, dim=EMBEDDING_DIM):
+    """Deterministic hashed bag-of-words vector, so similar texts land close together."""
+    vec = [0.0] * dim
+    for token in re.findall(r'\w+', (text or '').lower()):
+        h = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=4).digest(), 'little')
+        vec[h % dim] += 1.0
+    norm = sum(v * v for v in vec) ** 0.5 or 1.0
+    return [v / norm for v in vec]
+
+
+class FakeAzureOpenAI:
+    """Drop-in for `openai.AzureOpenAI` backed by a FakeConfig."""
+
+    def __init__(self, config=None, **client_kwargs):
+        self.config = config or FakeConfig()
+        self.chat = SimpleNamespace(completions=_ChatCompletions(self.config))
+        self.embeddings = _Embeddings(self.config)
+
+
+@contextmanager
+def fake_backend(config=None):
+    """
+    Route every model call in the pipeline to a FakeAzureOpenAI for the duration of the block.
+
+    Usage:
+        with fake_backend(FakeConfig(latency=0.02)) as config:
+            process_single_file('data/...')
+    """
+    from app import model_backend
+
+    config = config or FakeConfig()
+    previous = model_backend.set_client_factory(lambda: FakeAzureOpenAI(config))
+    try:
+        yield config
+    finally:
+        model_backend.set_client_factory(previous)
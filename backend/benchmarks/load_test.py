@@ -0,0 +1,341 @@
+"""
+Concurrent load generator for the Flask /upload and /query endpoints.
+
+Run from the backend directory:
+    python -m benchmarks.load_test --concurrency 8 --duration 30
+    python -m benchmarks.load_test --rate 20 --duration 60 --mix upload=1,query=4
+    python -m benchmarks.load_test --url http://127.0.0.1:5000 --concurrency 16
+
+Without --url, the app is started in-process on a random port with every model
+call routed to the fake backend (benchmarks/fake_azure.py), so the numbers
+reflect our own request handling plus the simulated model latency. Every store
+(vector store, logs, issuer index, OCR cache, profiles) lives in a temp directory,
+and OCR/extraction reuse is off unless --reuse is given: uploads cycle through
+the same few samples, so with reuse on most requests would only measure cache hits.
+With MODEL_BACKEND=replay the calls are served from a recorded cassette instead
+(app/model_backend.py); add MODEL_REPLAY_LATENCY=1 to keep the recorded timing.
+
+Closed-loop mode (--concurrency) keeps N requests in flight. Open-loop mode
+(--rate) fires Poisson arrivals at a target rate; latency is measured from the
+scheduled send time so queueing delay is not hidden.
+"""
+import argparse
+import contextlib
+import glob
+import importlib.util
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from urllib.parse import urlparse
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+os.chdir(BACKEND_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.fake_azure import FakeConfig, fake_backend  # noqa: E402
+
+SAMPLE_GLOB = os.path.join('data', 'uploads', '*')
+UPLOAD_PREFIX = 'loadtest_'
+QUESTIONS = [
+    "Which certificates were issued by ISO Authority?",
+    "Is the Global Tech Institute certificate still valid?",
+    "List certificates that expire in 2026.",
+    "Who issued the Quality Management System certificate?",
+]
+
+
+# --- HTTP helpers ------------------------------------------------------------
+
+_local = threading.local()
+
+
+def _connection(base):
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = HTTPConnection(base.hostname, base.port or 80, timeout=300)
+    return conn
+
+
+def _request(base, method, path, body, headers):
+    """Send one request on this thread's keep-alive connection; returns (status, body)."""
+    for attempt in range(2):
+        conn = _connection(base)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            return resp.status, resp.read()
+        except (ConnectionError, OSError):
+            conn.close()
+            _local.conn = None
+            if attempt:
+                raise
+
+
+def _multipart(filename, payload):
+    boundary = uuid.uuid4().hex
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+    body = head + payload + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return body, {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+
+# --- Workload ----------------------------------------------------------------
+
+class Workload:
+    def __init__(self, base, mix, samples, seed=0):
+        self.base = base
+        self.endpoints = [name for name, weight in mix.items() for _ in range(weight)]
+        self.samples = samples
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counter = 0
+
+    def next_request(self):
+        with self.lock:
+            self.counter += 1
+            endpoint = self.rng.choice(self.endpoints)
+            if endpoint == 'upload':
+                name, payload = self.rng.choice(self.samples)
+                return endpoint, f"{UPLOAD_PREFIX}{self.counter}_{name}", payload
+            return endpoint, None, self.rng.choice(QUESTIONS)
+
+    def execute(self, endpoint, name, payload):
+        """Returns an error label, or None on success."""
+        if endpoint == 'upload':
+            body, headers = _multipart(name, payload)
+            status, data = _request(self.base, 'POST', '/upload', body, headers)
+        else:
+            body = json.dumps({'question': payload}).encode('utf-8')
+            status, data = _request(self.base, 'POST', '/query', body, {'Content-Type': 'application/json'})
+
+        if status != 200:
+            return f"HTTP {status}"
+        if endpoint == 'upload':
+            try:
+                if not json.loads(data).get('success'):
+                    return "success=false"
+            except ValueError:
+                return "invalid JSON"
+        return None
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+
+    def record(self, endpoint, seconds, error):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            if error:
+                self.errors[endpoint][error] += 1
+
+    def report(self, elapsed):
+        out = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            n = len(values)
+
+            def pct(q):
+                return round(1000 * values[min(n - 1, int(q * n))], 2)
+
+            errors = dict(self.errors[endpoint])
+            out[endpoint] = {
+                'requests': n,
+                'errors': sum(errors.values()),
+                'error_breakdown': errors,
+                'throughput_rps': round(n / elapsed, 2) if elapsed else 0.0,
+                'p50_ms': pct(0.50),
+                'p95_ms': pct(0.95),
+                'p99_ms': pct(0.99),
+                'max_ms': round(1000 * values[-1], 2),
+            }
+        return out
+
+
+def _timed_call(workload, recorder, scheduled=None):
+    endpoint, name, payload = workload.next_request()
+    start = scheduled if scheduled is not None else time.perf_counter()
+    try:
+        error = workload.execute(endpoint, name, payload)
+    except Exception as e:
+        error = type(e).__name__
+    recorder.record(endpoint, time.perf_counter() - start, error)
+
+
+def run_closed_loop(workload, recorder, concurrency, duration, total):
+    stop_at = time.perf_counter() + duration
+    issued = [0]
+    lock = threading.Lock()
+
+    def worker():
+        while time.perf_counter() < stop_at:
+            with lock:
+                if total and issued[0] >= total:
+                    return
+                issued[0] += 1
+            _timed_call(workload, recorder)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def run_open_loop(workload, recorder, rate, duration, max_inflight, seed):
+    rng = random.Random(seed)
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        start = time.perf_counter()
+        next_at = start
+        while next_at - start < duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(_timed_call, workload, recorder, next_at)
+            next_at += rng.expovariate(rate)
+
+
+# --- Local server ------------------------------------------------------------
+
+@contextlib.contextmanager
+def _env(**values):
+    saved = {k: os.environ.get(k) for k in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+@contextlib.contextmanager
+def local_server(config, quiet=True, reuse=False):
+    """
+    Start backend/app.py in-process (fake model backend) on a random port.
+    With `reuse`, near-duplicate extraction reuse and the image OCR cache stay on.
+    """
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    with fake_backend(config), contextlib.ExitStack() as stack:
+        # Keep load-test writes out of the real stores, logs and caches
+        tmp = stack.enter_context(tempfile.TemporaryDirectory(prefix='loadtest_'))
+        stack.enter_context(_env(CHROMA_DB_PATH=os.path.join(tmp, 'chroma_db'),
+                                 VECTOR_STORE_PATH=os.path.join(tmp, 'vector_store'),
+                                 EXTRACTION_LOG_FILE=os.path.join(tmp, 'extraction_logs.json'),
+                                 LOG_INDEX_DB=os.path.join(tmp, 'extraction_logs.db'),
+                                 ISSUER_INDEX_DB=os.path.join(tmp, 'issuer_index.db'),
+                                 IMAGE_HASH_INDEX=os.path.join(tmp, 'image_hash_index.jsonl'),
+                                 PROFILE_DIR=os.path.join(tmp, 'profiles')))
+        if not reuse:
+            stack.enter_context(_env(NEAR_DUP_DETECTION='0', IMAGE_DEDUP='0'))
+        if quiet:
+            stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        spec = importlib.util.spec_from_file_location('flask_app', os.path.join(BACKEND_DIR, 'app.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        server = make_server('127.0.0.1', 0, module.app, threaded=True,
+                             request_handler=QuietHandler if quiet else WSGIRequestHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield f"http://127.0.0.1:{server.server_port}"
+        finally:
+            server.shutdown()
+            for path in glob.glob(os.path.join(module.UPLOAD_FOLDER, f"{UPLOAD_PREFIX}*")):
+                os.remove(path)
+
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('upload', 'query'):
+            raise argparse.ArgumentTypeError(f"Unknown endpoint in mix: {name}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def _load_samples(pattern):
+    samples = []
+    for path in sorted(glob.glob(pattern)):
+        if os.path.basename(path).startswith(UPLOAD_PREFIX):
+            continue
+        with open(path, 'rb') as f:
+            samples.append((os.path.basename(path), f.read()))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test /upload and /query')
+    parser.add_argument('--url', help='Target an already running server instead of starting one')
+    parser.add_argument('--mix', type=_parse_mix, default={'upload': 1, 'query': 1},
+                        help="Endpoint weights, e.g. 'upload=1,query=4'")
+    parser.add_argument('--concurrency', type=int, default=4, help='Closed-loop: requests kept in flight')
+    parser.add_argument('--rate', type=float, help='Open-loop: target arrivals per second')
+    parser.add_argument('--max-inflight', type=int, default=256, help='Open-loop: cap on concurrent requests')
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds to run')
+    parser.add_argument('--requests', type=int, default=0, help='Closed-loop: stop after this many requests')
+    parser.add_argument('--samples', default=SAMPLE_GLOB, help='Glob of files to upload')
+    parser.add_argument('--latency', type=float, default=0.05, help='Fake backend: seconds per model call')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fake backend: probability of a 429')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reuse', action='store_true',
+                        help='Local server: keep OCR/extraction reuse on (repeated samples then mostly hit caches)')
+    parser.add_argument('--output', help='Write the report as JSON to this path')
+    args = parser.parse_args()
+
+    samples = _load_samples(args.samples)
+    if 'upload' in args.mix and not samples:
+        parser.error(f"No upload samples match {args.samples}")
+
+    with contextlib.ExitStack() as stack:
+        url = args.url or stack.enter_context(
+            local_server(FakeConfig(latency=args.latency, error_rate=args.error_rate, seed=args.seed),
+                         reuse=args.reuse))
+        workload = Workload(urlparse(url), args.mix, samples, args.seed)
+        recorder = Recorder()
+
+        mode = f"open-loop {args.rate}/s" if args.rate else f"closed-loop x{args.concurrency}"
+        print(f"🚀 Load test against {url} ({mode}, {args.duration}s, mix={args.mix})")
+        start = time.perf_counter()
+        if args.rate:
+            run_open_loop(workload, recorder, args.rate, args.duration, args.max_inflight, args.seed)
+        else:
+            run_closed_loop(workload, recorder, args.concurrency, args.duration, args.requests)
+        elapsed = time.perf_counter() - start
+
+    report = recorder.report(elapsed)
+    print(f"\n{'endpoint':<8} {'reqs':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for endpoint, r in report.items():
+        print(f"{endpoint:<8} {r['requests']:>6} {r['throughput_rps']:>8} {r['p50_ms']:>9} {r['p95_ms']:>9} "
+              f"{r['p99_ms']:>9} {r['errors']:>7}")
+        for label, count in r['error_breakdown'].items():
+            print(f"         ↳ {label}: {count}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'elapsed_seconds': round(elapsed, 3), 'mode': mode, 'endpoints': report}, f, indent=2)
+        print(f"📄 Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
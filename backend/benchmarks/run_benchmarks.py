@@ -0,0 +1,273 @@
+"""
+Pipeline throughput benchmarks.
+
+Run from the backend directory:
+    python -m benchmarks.run_benchmarks                       # run and compare to baseline
+    python -m benchmarks.run_benchmarks --save-baseline       # refresh the stored baseline
+    python -m benchmarks.run_benchmarks --latency 0.2 --error-rate 0.05
+
+Model calls go to the local fake backend (benchmarks/fake_azure.py), so results
+measure our own overhead plus the configured simulated latency.
+Exits with status 1 if any benchmark is slower than baseline by more than --tolerance.
+
+CPU-bound micro benchmarks are compared relative to a calibration loop timed
+alongside every pass, so a baseline recorded on another machine (or a CPU whose
+clock drifts during the run) stays meaningful.
+Pipeline benchmarks are dominated by the simulated latency and compare as-is.
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND_DIR)
+if __name__ == "__main__":  # Not when imported (e.g. by the tests for compare/main)
+    os.chdir(BACKEND_DIR)  # Security checks resolve data/ against the working directory
+    os.environ.setdefault('EXTRACTION_LOG_FILE', os.path.join(tempfile.gettempdir(), 'bench_extraction_logs.json'))
+    os.environ.setdefault('ISSUER_INDEX_DB', os.path.join(tempfile.gettempdir(), 'bench_issuer_index.db'))
+
+from app.certificate_identification import is_certificate  # noqa: E402
+from app.field_extraction import normalize_date, calculate_consensus  # noqa: E402
+from app import near_duplicate  # noqa: E402
+from batch_processor import process_single_file, process_batch  # noqa: E402
+from benchmarks.corpus import generate_texts, generate_corpus  # noqa: E402
+from benchmarks.fake_azure import FakeConfig, fake_backend  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+CORPUS_DIR = os.path.join('data', 'benchmark_corpus')
+CPU_BOUND = ('is_certificate', 'normalize_date', 'calculate_consensus')  # Compared relative to calibration
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def _measure(name, func, items, repeat=1, reference=None, setup=None):
+    """
+    Call func(item) for every item, `repeat` times; return throughput and latency stats.
+    Throughput comes from the fastest pass (like timeit) to damp scheduler noise.
+    With `reference` (a callable timing one calibration pass), each pass is paired
+    with a calibration pass and 'relative' is the median of their speed ratios.
+    `setup` runs untimed before every pass.
+    """
+    latencies = []
+    passes = []
+    ratios = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        reference_seconds = reference() if reference else None
+        start = time.perf_counter()
+        for item in items:
+            t0 = time.perf_counter()
+            func(item)
+            latencies.append(time.perf_counter() - t0)
+        passes.append(time.perf_counter() - start)
+        if reference_seconds:
+            ratios.append(reference_seconds / passes[-1])
+    elapsed = min(passes)
+    latencies.sort()
+    result = {
+        'ops': len(latencies),
+        'seconds': round(sum(passes), 4),
+        'ops_per_sec': round(len(items) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(1000 * elapsed / max(1, len(items)), 4),
+        'p50_ms': round(1000 * _percentile(latencies, 0.50), 4),
+        'p95_ms': round(1000 * _percentile(latencies, 0.95), 4),
+    }
+    if ratios:
+        result['relative'] = round(statistics.median(ratios), 4)
+    print(f"  {name:<22} {result['ops_per_sec']:>12.2f} ops/s   p50 {result['p50_ms']:.3f} ms   "
+          f"p95 {result['p95_ms']:.3f} ms")
+    return result
+
+
+def _calibration_work(text):
+    # Fixed pure-Python work (regex, string and dict operations) like the micro benchmarks do
+    counts = {}
+    for token in re.findall(r'\w+', text.lower()):
+        counts[token] = counts.get(token, 0) + 1
+    return sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:10]
+
+
+CALIBRATION_ITEMS = [' '.join(f"Certificate {i} issued by Issuer {i % 7} on 2024-01-{i % 28 + 1:02d}"
+                              for i in range(40))] * 800
+
+
+def calibration_pass():
+    """Seconds for one pass of a fixed workload (the machine's speed right now)."""
+    start = time.perf_counter()
+    for text in CALIBRATION_ITEMS:
+        _calibration_work(text)
+    return time.perf_counter() - start
+
+
+def calibrate(repeat=5):
+    """ops/s of the calibration workload, recorded in the report for reference."""
+    return _measure('calibration', _calibration_work, CALIBRATION_ITEMS, repeat)['ops_per_sec']
+
+
+def _fresh_caches():
+    # Each pipeline pass starts cold: no near-duplicate reuse from the previous pass or benchmark
+    near_duplicate._index = near_duplicate.NearDuplicateIndex()
+
+
+def _vote_sets(texts):
+    """Synthetic 3-vote result lists built from the corpus for consensus benchmarking."""
+    sets = []
+    for i, (_, text) in enumerate(texts):
+        base = {
+            'issuer': {'value': f"Issuer {i % 7}", 'confidence': 0.95},
+            'certificate_number': {'value': f"CN-{i}", 'confidence': 0.95},
+            'issued_date': {'value': '2024-01-15', 'confidence': 0.95},
+            'expiry_date': {'value': '2026-01-15', 'confidence': 0.95},
+            'subject': {'value': text[:40], 'confidence': 0.95},
+        }
+        variant = dict(base, subject={'value': text[:40].upper(), 'confidence': 0.9})
+        sets.append([base, variant, base])
+    return sets
+
+
+def run(args):
+    # Passes of ~0.1 s or more: shorter ones are dominated by scheduler noise
+    texts = generate_texts(args.docs * 40, seed=args.seed, noise_words=args.noise_words)
+    date_inputs = ['15/01/2024', 'January 15, 2024', '2024-01-15', '15-01-2024', '15 January 2024',
+                   'NotADate', None] * 1200
+    results = {}
+
+    print("⚙️  Micro benchmarks")
+    calibration = calibrate(args.repeat)
+    results['is_certificate'] = _measure('is_certificate', lambda t: is_certificate('txt', t[1]), texts,
+                                         args.repeat, calibration_pass)
+    results['normalize_date'] = _measure('normalize_date', normalize_date, date_inputs, args.repeat,
+                                         calibration_pass)
+    results['calculate_consensus'] = _measure('calculate_consensus', calculate_consensus,
+                                              _vote_sets(texts), args.repeat, calibration_pass)
+
+    print(f"⚙️  Pipeline benchmarks (fake backend: latency={args.latency}s, "
+          f"error_rate={args.error_rate}, variety={args.variety})")
+    shutil.rmtree(CORPUS_DIR, ignore_errors=True)
+    paths = generate_corpus(CORPUS_DIR, args.docs, seed=args.seed, noise_words=args.noise_words)
+    csv_path = os.path.join(CORPUS_DIR, 'batch.csv')
+    with open(csv_path, 'w', newline='') as f:
+        csv.writer(f).writerows([[p] for p in paths])
+    batch_output = os.path.join(tempfile.gettempdir(), 'bench_batch_results.json')
+
+    config = FakeConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        variety=args.variety, seed=args.seed)
+    try:
+        with fake_backend(config), contextlib.redirect_stdout(io.StringIO()):
+            results['process_single_file'] = _measure('process_single_file', process_single_file, paths,
+                                                      args.pipeline_repeat, setup=_fresh_caches)
+            results['process_batch'] = _measure('process_batch',
+                                                lambda p: process_batch(p, output_file=batch_output), [csv_path],
+                                                args.pipeline_repeat, setup=_fresh_caches)
+            results['process_batch_packed'] = _measure(
+                'process_batch_packed', lambda p: process_batch(p, output_file=batch_output, packed=True), [csv_path],
+                args.pipeline_repeat, setup=_fresh_caches)
+        for name in ('process_batch', 'process_batch_packed'):
+            results[name]['docs_per_sec'] = round(len(paths) * results[name]['ops_per_sec'], 2)
+    finally:
+        shutil.rmtree(CORPUS_DIR, ignore_errors=True)
+
+    for name in ('process_single_file', 'process_batch', 'process_batch_packed'):
+        r = results[name]
+        print(f"  {name:<22} {r['ops_per_sec']:>12.2f} ops/s   p50 {r['p50_ms']:.1f} ms   p95 {r['p95_ms']:.1f} ms")
+    print(f"  model calls: {config.calls}")
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'docs': args.docs,
+            'latency': args.latency,
+            'error_rate': args.error_rate,
+            'variety': args.variety,
+            'model_calls': config.calls,
+            'calibration_ops_per_sec': calibration,
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Return a list of (name, baseline_score, current_score, change) for regressions beyond tolerance.
+    CPU_BOUND scores are their 'relative' speed when both runs have one, else plain ops/s.
+    """
+    regressions = []
+    for name, current in report['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base or not base.get('ops_per_sec'):
+            continue
+        relative = name in CPU_BOUND and bool(base.get('relative') and current.get('relative'))
+        key = 'relative' if relative else 'ops_per_sec'
+        before, now = base[key], current[key]
+        change = (now - before) / before
+        marker = '⚠️ ' if change < -tolerance else '  '
+        unit = 'x calib' if relative else 'ops/s'
+        print(f"{marker}{name:<22} baseline {before:>12.4g}  now {now:>12.4g} {unit:<7}  ({change:+.1%})")
+        if change < -tolerance:
+            regressions.append((name, before, now, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the certificate pipeline')
+    parser.add_argument('--docs', type=int, default=20, help='Synthetic documents for pipeline benchmarks')
+    parser.add_argument('--repeat', type=int, default=9, help='Repetitions for micro benchmarks')
+    parser.add_argument('--pipeline-repeat', type=int, default=3, help='Repetitions for pipeline benchmarks')
+    parser.add_argument('--noise-words', type=int, default=80, help='Filler words per document')
+    parser.add_argument('--latency', type=float, default=0.01, help='Simulated seconds per model call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Latency jitter as a fraction')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probability of a simulated 429')
+    parser.add_argument('--variety', type=float, default=0.0, help='Probability of a perturbed field answer')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_output.json', help='Where to write the results JSON')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='Baseline results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed throughput drop (fraction)')
+    parser.add_argument('--save-baseline', action='store_true', help='Store these results as the baseline')
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"📄 Results saved to: {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"📌 Baseline updated: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("ℹ️  No baseline found; run with --save-baseline to create one.")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    print("\n📊 Comparison against baseline")
+    regressions = compare(report, baseline, args.tolerance)
+    if regressions:
+        print(f"\n❌ {len(regressions)} benchmark(s) regressed by more than {args.tolerance:.0%}")
+        sys.exit(1)
+    print("\n✅ No throughput regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Recall / memory report for quantized vector search.
+
+Run from the backend directory:
+    python -m benchmarks.vector_quantization
+    python -m benchmarks.vector_quantization --vectors 200000 --queries 200 --k 3 --output quant_report.json
+
+Builds one NumpyVectorStore per mode over the same synthetic clustered
+embeddings and compares each mode's top-k against exact float32 search.
+'Candidate recall' is the quantized scan alone; 'recall' is after the exact
+float32 rerank that queries actually return.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND_DIR)
+
+from app.vector_store import NumpyVectorStore, blocked_top_k  # noqa: E402
+
+MODES = ('none', 'float16', 'int8')
+
+
+def synthetic_embeddings(n, dim, clusters, seed=0):
+    """
+    Clustered vectors with a shared offset, so (like real text embeddings)
+    unrelated items are still fairly similar and near neighbours are close.
+    """
+    rng = np.random.default_rng(seed)
+    common = rng.normal(size=dim)
+    centers = rng.normal(size=(clusters, dim))
+    out = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 10000):
+        size = min(10000, n - start)
+        labels = rng.integers(0, clusters, size)
+        out[start:start + size] = 2.0 * common + centers[labels] + 0.6 * rng.normal(size=(size, dim))
+    return out
+
+
+def _recall(found, truth):
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def run(args):
+    vectors = synthetic_embeddings(args.vectors, args.dim, args.clusters, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    picks = rng.integers(0, len(vectors), args.queries)
+    queries = vectors[picks] + 0.3 * rng.normal(size=(args.queries, args.dim)).astype(np.float32)
+    ids = [f"cert_{i}" for i in range(len(vectors))]
+
+    report = {'vectors': args.vectors, 'dim': args.dim, 'k': args.k, 'modes': {}}
+    truth = None
+    tmp = tempfile.mkdtemp(prefix='vector_quant_')
+    try:
+        base = os.path.join(tmp, 'store')
+        store = NumpyVectorStore(base, quantization='none')
+        for start in range(0, len(vectors), 50000):
+            chunk = slice(start, start + 50000)
+            store.upsert(ids[chunk], vectors[chunk], None, None)
+
+        for mode in MODES:
+            # Quantized copies are derived from vectors.f32 when the store is opened in a new mode
+            t0 = time.perf_counter()
+            store = NumpyVectorStore(base, quantization=mode)
+            build = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            result = store.query(queries, n_results=args.k)
+            latency = (time.perf_counter() - t0) / args.queries
+            found = result['ids']
+            if truth is None:
+                truth = found
+
+            entry = {
+                'index_mb': round(store.index_bytes() / 2 ** 20, 2),
+                'query_ms': round(1000 * latency, 3),
+                'open_s': round(build, 3),
+                'recall': round(_recall(found, truth), 4),
+            }
+            if mode != 'none':
+                unit = NumpyVectorStore._normalise(queries)
+                _, candidate_rows = blocked_top_k(unit, store.codes, store.live, args.k, scales=store.scales)
+                entry['candidate_recall'] = round(_recall([[ids[r] for r in row] for row in candidate_rows], truth), 4)
+            report['modes'][mode] = entry
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    full = report['modes']['none']['index_mb'] or 1
+    print(f"\n{'mode':<8} {'index MB':>10} {'vs f32':>7} {'recall@' + str(args.k):>10} {'cand. recall':>13} {'query ms':>9}")
+    for mode, e in report['modes'].items():
+        print(f"{mode:<8} {e['index_mb']:>10} {e['index_mb'] / full:>6.0%} {e['recall']:>10} "
+              f"{e.get('candidate_recall', '-'):>13} {e['query_ms']:>9}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare recall and memory of vector quantization modes')
+    parser.add_argument('--vectors', type=int, default=50000, help='Stored embeddings')
+    parser.add_argument('--dim', type=int, default=1536, help='Embedding dimension')
+    parser.add_argument('--clusters', type=int, default=500, help='Synthetic topic clusters')
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--k', type=int, default=3, help='Results per query (RAG uses 3)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the report as JSON to this path')
+    args = parser.parse_args()
+
+    print(f"⚙️  {args.vectors} x {args.dim} vectors, {args.queries} queries, k={args.k}")
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,9 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from app.certificate_identification import is_certificate
-from app.field_extraction import extract_with_azure, extract_fields, create_json_output
+from app.document import Document
+from app.field_extraction import extract_fields, create_json_output
+from app.rule_extraction import extract_with_fast_path
 from app.date_validation import validate_dates, validate_issuer
 from app.logging_utils import log_extraction, check_for_issues
 from app.ocr_module import extract_text_from_file
@@ -55,8 +57,9 @@ def main():
         file_ext = "pdf" if file_ext == "unknown" else file_ext
 
     print(f"📄 Extracted Text Length: {len(text_content)} chars")
+    document = Document(text_content, file_type=file_ext)
     
-    is_valid_cert = is_certificate(file_ext, text_content)
+    is_valid_cert = is_certificate(file_ext, document)
     
     if not is_valid_cert:
         print("❌ Document is NOT classified as a certificate.")
@@ -67,9 +70,9 @@ def main():
 
     print("✅ Document identified as a certificate.")
 
-    # 2. Extract Fields (Azure OpenAI)
-    print("⏳ Extracting fields using Azure OpenAI...")
-    raw_extraction = extract_with_azure(text_content)
+    # 2. Extract Fields (rule-based fast path, else Azure OpenAI)
+    print("⏳ Extracting fields...")
+    raw_extraction = extract_with_fast_path(document)
     
     fields, confidence = extract_fields(raw_extraction)
     print("✅ Extraction complete.")
@@ -0,0 +1,42 @@
+import argparse
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.rag_pipeline import CertificateRAG, embedding_deployment  # noqa: E402
+from app.reindex import REINDEX_PAGE_SIZE, REINDEX_BATCH_SIZE, load_checkpoint, reindex_collection  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Re-embed the certificate collection into a shadow collection and swap it in')
+    parser.add_argument('--model', help='Embedding deployment (default: AZURE_EMBEDDING_DEPLOYMENT)')
+    parser.add_argument('--page-size', type=int, default=REINDEX_PAGE_SIZE, help='Records read per page')
+    parser.add_argument('--batch-size', type=int, default=REINDEX_BATCH_SIZE, help='Texts per embeddings call')
+    parser.add_argument('--restart', action='store_true', help='Ignore any checkpoint and start over')
+    parser.add_argument('--drop-old', action='store_true', help='Delete the previous collection after the swap')
+    parser.add_argument('--status', action='store_true', help='Show the checkpoint of an unfinished run and exit')
+    args = parser.parse_args()
+
+    rag = CertificateRAG()
+    if args.status:
+        state = load_checkpoint(rag.store_root)
+        if not state:
+            print("ℹ️  No reindex in progress.")
+        else:
+            print(f"⏳ '{state['source']}' -> '{state['target']}' ({state['model']}): "
+                  f"{state['copied']} records copied since {state['started_at']}")
+        return
+
+    if not rag.client:
+        print("⚠️  No valid Azure API key; records will get placeholder embeddings.")
+
+    summary = reindex_collection(rag, model=args.model or embedding_deployment(), page_size=args.page_size,
+                                 batch_size=args.batch_size, restart=args.restart, drop_old=args.drop_old)
+    print(f"📊 Re-embedded {summary['copied']} records (+{summary['caught_up']} caught up) "
+          f"with {summary['model']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.date_validation import TRUSTED_ISSUERS_FILE  # noqa: E402
+from app.issuer_index import ISSUER_INDEX_DB, connect, reverify  # noqa: E402
+
+
+def _run_once(conn, rag, dry_run):
+    summary = reverify(conn, rag=rag, dry_run=dry_run)
+    if not summary['added'] and not summary['removed']:
+        print("✅ Trusted issuer list unchanged; nothing to re-verify.")
+        return
+    print(f"🔄 Trusted list changed: +{summary['added']} -{summary['removed']}")
+    print(f"📊 Re-scored {summary['checked']} certificate(s), {summary['changed']} changed"
+          f"{' (dry run, nothing written)' if dry_run else ''}")
+    for transition, count in sorted(summary['transitions'].items()):
+        print(f"   {transition}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Re-verify stored certificates whose issuer was added to or removed from trusted_issuers.json')
+    parser.add_argument('--db', default=ISSUER_INDEX_DB, help='Path to the SQLite issuer index')
+    parser.add_argument('--no-rag', action='store_true', help='Only update the index, not the vector store')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+    parser.add_argument('--watch', type=float, metavar='SECONDS',
+                        help='Keep running and re-verify whenever trusted_issuers.json changes')
+    args = parser.parse_args()
+
+    rag = None
+    if not args.no_rag and not args.dry_run:
+        from app.rag_pipeline import CertificateRAG
+        rag = CertificateRAG()
+
+    conn = connect(args.db)
+    try:
+        _run_once(conn, rag, args.dry_run)
+        if not args.watch:
+            return
+        print(f"👀 Watching {TRUSTED_ISSUERS_FILE} every {args.watch}s (Ctrl+C to stop)")
+        last_mtime = os.path.getmtime(TRUSTED_ISSUERS_FILE)
+        while True:
+            time.sleep(args.watch)
+            mtime = os.path.getmtime(TRUSTED_ISSUERS_FILE)
+            if mtime != last_mtime:
+                last_mtime = mtime
+                _run_once(conn, rag, args.dry_run)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,13 @@ import unittest
 from datetime import datetime # Fix path to import modules from parent directory
 import sys
 import os
+import time
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from app.certificate_identification import is_certificate
 from app.date_validation import validate_dates
 from app.field_extraction import normalize_date
-from app.logging_utils import check_for_issues
+from app.logging_utils import check_for_issues, LogWriter
 
 class TestCertificateSystem(unittest.TestCase):
 
@@ -67,6 +68,1101 @@ class TestCertificateSystem(unittest.TestCase):
         flags = check_for_issues(fields_missing, conf_good)
         self.assertIn('MISSING_A', flags)
 
+    def test_log_writer_batches_and_rotates(self):
+        """Test background log writer flushing and size-based rotation"""
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'logs.json')
+            writer = LogWriter(path, flush_interval=60, batch_size=1000, max_bytes=100, backup_count=2)
+            for i in range(3):
+                writer.write('{"n": %d, "pad": "%s"}\n' % (i, 'x' * 40))
+                writer.flush()
+            writer.close()
+
+            # Each 50-byte line overflows the 100-byte limit after two lines
+            self.assertTrue(os.path.exists(path + '.1'))
+            with open(path) as f:
+                self.assertIn('"n": 2', f.read())
+
+            # Inline writes (full queue) and the writer thread share the file lock safely;
+            # flush/close give up after their timeout instead of blocking on a full queue
+            import queue
+            import threading
+            from unittest import mock
+            path = os.path.join(tmp, 'busy.json')
+            writer = LogWriter(path, max_queue=1, flush_interval=60, batch_size=1000, max_bytes=0)
+            with mock.patch('app.logging_utils.LOG_ENQUEUE_TIMEOUT', 0), mock.patch('builtins.print') as printed:
+                threads = [threading.Thread(target=lambda: [writer.write('{"t": 1}\n') for _ in range(200)])
+                           for _ in range(4)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                writer.flush(timeout=5)
+                writer.close(timeout=5)
+            printed.assert_not_called()
+            with open(path) as f:
+                self.assertEqual(len(f.readlines()), 800)
+
+            stuck = LogWriter(os.path.join(tmp, 'stuck.json'), max_queue=1, flush_interval=60)
+            stuck._queue = queue.Queue(maxsize=1)  # Detached from the writer thread: nothing drains it
+            stuck._queue.put('{}\n')
+            start = time.monotonic()
+            stuck.flush(timeout=0.2)
+            stuck.close(timeout=0.2)
+            self.assertLess(time.monotonic() - start, 2)
+
+    def test_log_index_incremental_ingest(self):
+        """Test watermark-based ingestion only loads new lines"""
+        import json
+        import tempfile
+        from app.log_analytics import ingest_logs, connect, top_flags
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path = os.path.join(tmp, 'logs.json')
+            db_path = os.path.join(tmp, 'index.db')
+            entry = {"doc_id": "d1", "timestamp": "2026-01-10T10:00:00", "extracted_fields": {"issuer": "IEEE"},
+                     "date_validation": {"expiry_status": "valid"}, "confidence_flags": ["MISSING_SUBJECT"],
+                     "needs_manual_review": True}
+            with open(log_path, 'w') as f:
+                f.write(json.dumps(entry) + '\n')
+            self.assertEqual(ingest_logs(log_path, db_path), 1)
+            self.assertEqual(ingest_logs(log_path, db_path), 0)
+
+            with open(log_path, 'a') as f:
+                f.write(json.dumps(entry) + '\n' + '{"partial": ')
+            self.assertEqual(ingest_logs(log_path, db_path), 1)
+
+            conn = connect(db_path)
+            self.assertEqual(top_flags(conn), [('MISSING_SUBJECT', 2)])
+            conn.close()
+
+    def test_metrics_spans_and_counters(self):
+        """Test stage timing histograms and Prometheus rendering"""
+        from app.metrics import MetricsRegistry, Histogram
+        hist = Histogram()
+        for seconds in (0.001, 0.02, 0.2, 100):
+            hist.observe(seconds)
+        self.assertEqual(hist.count, 4)
+        self.assertEqual(hist.quantile(0.5), 0.025)
+        self.assertEqual(hist.quantile(1.0), 100)
+
+        reg = MetricsRegistry()
+        reg.observe('stage', 'ocr', 0.3)
+        reg.incr('extraction_reused')
+        self.assertEqual(reg.snapshot()['stages']['ocr']['count'], 1)
+        text = reg.render_prometheus()
+        self.assertIn('certificate_stage_latency_seconds_count{stage="ocr"} 1', text)
+        self.assertIn('certificate_extraction_reused_total 1', text)
+        self.assertIn('certificate_vision_ocr_reused_total 0', text)
+
+    def test_benchmark_regression_gate(self):
+        """Test benchmark comparison uses calibrated scores and fails the run on a regression"""
+        import json
+        import tempfile
+        from unittest import mock
+        from benchmarks import run_benchmarks
+
+        def report(normalize_ops, relative, batch_ops):
+            return {'meta': {}, 'results': {'normalize_date': {'ops_per_sec': normalize_ops, 'relative': relative},
+                                            'process_batch': {'ops_per_sec': batch_ops}}}
+        baseline = report(1000.0, 2.0, 20.0)
+        faster_machine = report(3000.0, 1.9, 19.0)  # Same code on a faster host: only ops/s moved
+        slower_code = report(3000.0, 1.2, 19.0)
+        with mock.patch('builtins.print'):
+            self.assertEqual(run_benchmarks.compare(faster_machine, baseline, 0.25), [])
+            self.assertEqual(run_benchmarks.compare(slower_code, baseline, 0.25),
+                             [('normalize_date', 2.0, 1.2, -0.4)])
+            # Uncalibrated baselines fall back to plain ops/s
+            uncalibrated = report(1000.0, None, 30.0)
+            self.assertEqual([r[0] for r in run_benchmarks.compare(faster_machine, uncalibrated, 0.25)],
+                             ['process_batch'])
+
+            with tempfile.TemporaryDirectory() as tmp:
+                argv = ['--baseline', os.path.join(tmp, 'baseline.json'), '--output', os.path.join(tmp, 'out.json')]
+                with open(argv[1], 'w') as f:
+                    json.dump(baseline, f)
+                with mock.patch.object(run_benchmarks, 'run', return_value=faster_machine):
+                    self.assertIsNone(run_benchmarks.main(argv))
+                with mock.patch.object(run_benchmarks, 'run', return_value=slower_code), \
+                        self.assertRaises(SystemExit) as exit_code:
+                    run_benchmarks.main(argv)
+                self.assertEqual(exit_code.exception.code, 1)
+
+    def test_prompt_compaction_windows(self):
+        """Test relevance-window compaction keeps the fields and respects the budget"""
+        from app.text_windows import compact_text, estimate_tokens
+        filler = "\n".join("lorem ipsum dolor sit amet consectetur adipiscing elit" for _ in range(200))
+        text = ("CERTIFICATE OF COMPLETION\n" + filler + "\nIssued By: ISO Authority\n"
+                "Certificate Number: ISO-9001-2024-098\nIssued On: 2024-01-15\n" + filler)
+        compacted, stats = compact_text(text, token_budget=120)
+        self.assertIn('ISO-9001-2024-098', compacted)
+        self.assertIn('2024-01-15', compacted)
+        self.assertLessEqual(estimate_tokens(compacted), 120)
+        self.assertLess(stats['compacted_tokens'], stats['original_tokens'])
+
+        # Short texts and texts without dates are sent unchanged
+        self.assertEqual(compact_text("Certificate issued by IEEE", 120)[0], "Certificate issued by IEEE")
+        self.assertEqual(compact_text(filler, 120)[1]['fallback'], 'no_windows')
+
+    def test_consensus_normalized_voting(self):
+        """Test that case/whitespace/date-format variants count as agreement"""
+        from app.field_extraction import calculate_consensus
+        votes = [
+            {'issuer': {'value': 'ISO Authority', 'confidence': 0.95}, 'issued_date': {'value': '2024-01-15', 'confidence': 0.95}},
+            {'issuer': {'value': ' iso  authority', 'confidence': 0.9}, 'issued_date': {'value': '15/01/2024', 'confidence': 0.9}},
+            {'issuer': {'value': 'Other', 'confidence': 0.8}, 'issued_date': {'value': None, 'confidence': 0.0}},
+        ]
+        result, log = calculate_consensus(votes)
+        self.assertEqual(result['issuer'], {'value': 'ISO Authority', 'confidence': 0.95})
+        self.assertEqual(log['issued_date']['votes']['2024-01-15'], 2)
+        # Non-string answers keep their type
+        result, _ = calculate_consensus([{'issuer': {'value': 2024, 'confidence': 0.9}}] * 2)
+        self.assertEqual(result['issuer']['value'], 2024)
+
+    def test_adaptive_voting_policy(self):
+        """Test that clean answers cost one call and ambiguous ones escalate"""
+        from unittest import mock
+        from app import field_extraction
+        clean = {f: {'value': v, 'confidence': 0.95} for f, v in [
+            ('issuer', 'IEEE'), ('certificate_number', 'IE-1'), ('issued_date', '2024-01-15'),
+            ('expiry_date', '2026-01-15'), ('subject', 'Networking')]}
+        missing = dict(clean, subject={'value': None, 'confidence': 0.0})
+
+        with mock.patch.object(field_extraction, '_extract_single', return_value=clean) as single:
+            out = field_extraction.extract_with_azure("Certificate text")
+        self.assertEqual(single.call_count, 1)
+        self.assertEqual(out['_voting_debug']['calls_spent'], 1)
+
+        with mock.patch.object(field_extraction, '_extract_single', side_effect=[missing, clean, clean]) as single:
+            out = field_extraction.extract_with_azure("Certificate text")
+        self.assertEqual(single.call_count, 3)
+        self.assertEqual(out['_voting_debug']['escalations'], ['missing_fields', 'disagreement'])
+        self.assertEqual(out['subject']['value'], 'Networking')
+
+    def test_rule_fast_path_extraction(self):
+        """Test deterministic extraction of labelled certificates"""
+        from app.rule_extraction import extract_with_rules, is_confident
+        text = """
+        CERTIFICATE OF COMPLETION
+        This is to certify that John Doe has completed the Quality Management System course.
+        Certificate Number: ISO-9001-2024-098
+        Issued By: ISO Authority
+        Issued On: 15/01/2024
+        Valid Until: 2026-01-15
+        """
+        result = extract_with_rules(text)
+        self.assertEqual(result['issuer'], {'value': 'ISO Authority', 'confidence': 0.97})
+        self.assertEqual(result['certificate_number']['value'], 'ISO-9001-2024-098')
+        self.assertEqual(result['issued_date']['value'], '2024-01-15')
+        self.assertEqual(result['subject']['value'], 'Quality Management System course')
+        self.assertTrue(is_confident(result))
+
+        # Unknown issuer is not confident enough to skip the LLM
+        self.assertFalse(is_confident(extract_with_rules(text.replace('ISO Authority', 'Acme Labs'))))
+
+        # A trusted name in the body or inside the label never overrides the labelled issuer
+        mill = text.replace('ISO Authority', 'Shady Diploma Mill LLC') + "Course content follows IEEE standards.\nIEEE\n"
+        self.assertEqual(extract_with_rules(mill)['issuer'], {'value': 'Shady Diploma Mill LLC', 'confidence': 0.85})
+        lookalike = extract_with_rules(text.replace('ISO Authority', 'Not ISO Authority Affiliated Academy'))
+        self.assertEqual(lookalike['issuer']['value'], 'Not ISO Authority Affiliated Academy')
+        self.assertFalse(is_confident(lookalike))
+        # Without a label, only a trusted name on a line of its own counts
+        unlabelled = text.replace('Issued By: ISO Authority', 'Accredited by the ISO Authority board')
+        self.assertIsNone(extract_with_rules(unlabelled)['issuer']['value'])
+        self.assertEqual(extract_with_rules(unlabelled + "\nISO Authority\n")['issuer']['value'], 'ISO Authority')
+
+    def test_packed_batch_extraction(self):
+        """Test packing under a token budget and per-document retry/fallback"""
+        from unittest import mock
+        from app import field_extraction
+        docs = [(f"d{i}", "Certificate text " * 20) for i in range(5)]
+        packs = list(field_extraction.pack_documents(docs, token_budget=400, max_docs=10))
+        self.assertGreater(len(packs), 1)
+        self.assertEqual(sum(len(p) for p in packs), 5)
+
+        clean = {f: {'value': v, 'confidence': 0.95} for f, v in [
+            ('issuer', 'IEEE'), ('certificate_number', 'IE-1'), ('issued_date', '2024-01-15'),
+            ('expiry_date', '2026-01-15'), ('subject', 'Networking')]}
+        # d1 is never answered by the packed call and must fall back to a single extraction
+        packed_answer = lambda pack, temperature=0.0: {pid: clean for pid, _ in pack if pid != 'd1'}
+        with mock.patch.object(field_extraction, 'model_available', return_value=True), \
+             mock.patch.object(field_extraction, '_extract_packed', side_effect=packed_answer) as packed, \
+             mock.patch.object(field_extraction, '_extract_single', return_value=clean) as single:
+            outputs = field_extraction.extract_batch_with_azure([('a', 'text a'), ('b', 'text b'), ('c', 'text c')])
+        self.assertEqual(packed.call_count, 2)  # Initial pack + retry of the failed document
+        self.assertEqual(single.call_count, 1)
+        self.assertEqual([o['issuer']['value'] for o in outputs], ['IEEE'] * 3)
+        self.assertEqual(outputs[0]['_voting_debug']['method'], 'packed')
+
+        # The fixed policy gets its full vote count from extra packed requests
+        with mock.patch.object(field_extraction, 'model_available', return_value=True), \
+             mock.patch.object(field_extraction, 'VOTING_POLICY', 'fixed'), \
+             mock.patch.object(field_extraction, '_extract_packed', side_effect=packed_answer) as packed, \
+             mock.patch.object(field_extraction, '_extract_single', return_value=clean) as single, \
+             mock.patch('builtins.print'):
+            outputs = field_extraction.extract_batch_with_azure([('a', 'text a'), ('b', 'text b'), ('c', 'text c')])
+        self.assertEqual(packed.call_count, 2 + 2)  # Initial pack + retry, then two more votes for a and c
+        self.assertEqual(single.call_count, 3)  # d1 never answers packed: all 3 votes singly
+        self.assertEqual([o['_voting_debug']['calls_spent'] for o in outputs], [3, 3, 3])
+        self.assertEqual(outputs[0]['_voting_debug']['method'], 'packed')
+
+        # Clones within one pack reuse the earlier document's extraction instead of a second LLM slot
+        import batch_processor
+        from app import near_duplicate
+        from app.document import Document
+        texts = {'a': 'Certificate A rule text', 'a2': 'Certificate A rule text',
+                 'b': 'Certificate B needs llm', 'b2': 'Certificate B needs llm'}
+        docs = {p: (p, Document(t, doc_id=p)) for p, t in texts.items()}
+        rules = lambda document: clean if 'rule' in document.text else None
+        with mock.patch.object(near_duplicate, '_index', near_duplicate.NearDuplicateIndex()), \
+             mock.patch.object(batch_processor, 'prepare_document', side_effect=docs.get), \
+             mock.patch.object(batch_processor, 'try_rule_fast_path', side_effect=rules) as rule_calls, \
+             mock.patch.object(batch_processor, 'extract_batch_with_azure', side_effect=lambda pack: [clean] * len(pack)) as llm, \
+             mock.patch.object(batch_processor, 'finalize_document', side_effect=lambda *args: args):
+            results = batch_processor._process_packed(list(texts))
+        self.assertEqual(rule_calls.call_count, 2)
+        self.assertEqual([doc_id for doc_id, _ in llm.call_args[0][0]], ['b'])
+        self.assertEqual([r[1]['issuer']['value'] for r in results], ['IEEE'] * 4)
+        self.assertEqual([r[2] and r[2]['doc_id'] for r in results], [None, 'a', None, 'b'])
+
+    def test_rate_limiter_retries_throttled_calls(self):
+        """Test 429 retries honour Retry-After, count retries and halve concurrency"""
+        import httpx
+        import openai
+        from app.metrics import registry
+        from app.rate_limiter import RateLimiter, TokenBucket
+
+        response = httpx.Response(429, headers={'retry-after-ms': '20'},
+                                  request=httpx.Request('POST', 'https://example.invalid'))
+        outcomes = [openai.RateLimitError("throttled", response=response, body=None)] * 2 + ['ok']
+        calls = []
+
+        def flaky():
+            calls.append(time.monotonic())
+            outcome = outcomes[len(calls) - 1]
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        limiter = RateLimiter(max_concurrency=8, max_retries=3, backoff_base=0.001)
+        retries_before = registry.counters.get('retries', 0)
+        self.assertEqual(limiter.call('test_call', flaky), 'ok')
+        self.assertEqual(len(calls), 3)
+        self.assertGreaterEqual(calls[1] - calls[0], 0.02)
+        self.assertEqual(registry.counters['retries'] - retries_before, 2)
+        self.assertLess(limiter.concurrency.limit, 8)
+
+        # Non-retryable errors surface immediately; exhausted retries re-raise
+        with self.assertRaises(ValueError):
+            limiter.call('test_call', lambda: (_ for _ in ()).throw(ValueError('bad')))
+        limiter.max_retries = 0
+        outcomes[:] = [outcomes[0]]
+        calls.clear()
+        with self.assertRaises(openai.RateLimitError):
+            limiter.call('test_call', flaky)
+
+        # Token bucket: second acquire of a drained 100/s bucket waits ~0.05s
+        bucket = TokenBucket(rate=100, capacity=5)
+        self.assertEqual(bucket.acquire(5), 0.0)
+        self.assertGreater(bucket.acquire(5), 0.0)
+
+    def test_numpy_vector_store(self):
+        """Test the mmap vector store: top-k, upsert overwrite, delete, compaction and reload"""
+        import tempfile
+        from unittest import mock
+        import numpy as np
+        from app import vector_store
+        from app.vector_store import NumpyVectorStore
+
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(50, 16)).astype(np.float32)
+        ids = [f"doc{i}" for i in range(50)]
+        with tempfile.TemporaryDirectory() as tmp:
+            store = NumpyVectorStore(tmp)
+            store.upsert(ids, vectors.tolist(), [f"text {i}" for i in range(50)],
+                         [{'issuer': f"Issuer {i}"} for i in range(50)])
+
+            # Exact top-k matches a brute-force cosine ranking, also across blocks
+            unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+            expected = [ids[i] for i in np.argsort(-(unit @ unit[7]))[:5]]
+            with mock.patch.object(vector_store, 'VECTOR_BLOCK_ROWS', 8):
+                result = store.query([vectors[7].tolist()], n_results=5)
+            self.assertEqual(result['ids'][0], expected)
+            self.assertAlmostEqual(result['distances'][0][0], 0.0, places=5)
+            self.assertEqual(result['metadatas'][0][0], {'issuer': 'Issuer 7'})
+
+            # Overwrite and delete leave dead rows until compaction
+            store.upsert(['doc7'], [vectors[8].tolist()], ['moved'], [{'issuer': 'moved'}])
+            store.delete(['doc3'])
+            self.assertEqual(store.count(), 49)
+            self.assertNotIn('doc3', store.query([vectors[3].tolist()], n_results=49)['ids'][0])
+            store.delete([f"doc{i}" for i in range(20, 40)])
+            self.assertEqual(store.rows, store.count())  # Compacted past the dead-row ratio
+
+            reloaded = NumpyVectorStore(tmp)
+            self.assertEqual(reloaded.count(), 29)
+            self.assertEqual(reloaded.get(ids=['doc7'])['documents'], ['moved'])
+            self.assertEqual(len(reloaded.get(limit=10, offset=25)['ids']), 4)
+            top = reloaded.query([vectors[8].tolist()], n_results=2)['ids'][0]
+            self.assertEqual(sorted(top), ['doc7', 'doc8'])
+
+            # A compaction from another thread mid-query does not renumber the rows being returned
+            scan = vector_store.blocked_top_k
+            def compact_during_scan(*args, **kwargs):
+                found = scan(*args, **kwargs)
+                reloaded.delete([f"doc{i}" for i in range(0, 20)])
+                return found
+            with mock.patch.object(vector_store, 'blocked_top_k', side_effect=compact_during_scan):
+                result = reloaded.query([vectors[45].tolist()], n_results=1)
+            self.assertEqual((result['ids'][0], result['documents'][0]), (['doc45'], ['text 45']))
+            self.assertEqual(reloaded.rows, reloaded.count())
+
+    def test_quantized_vector_store_rerank(self):
+        """Test int8/float16 candidate search with exact rerank matches full-precision results"""
+        import tempfile
+        import numpy as np
+        from app.vector_store import NumpyVectorStore
+
+        rng = np.random.default_rng(1)
+        vectors = (rng.normal(size=(300, 32)) + 1.5).astype(np.float32)  # Crowded, like real embeddings
+        ids = [f"doc{i}" for i in range(300)]
+        queries = (vectors[:20] + 0.1 * rng.normal(size=(20, 32))).tolist()
+        with tempfile.TemporaryDirectory() as tmp:
+            NumpyVectorStore(tmp).upsert(ids, vectors.tolist(), None, None)
+            exact = NumpyVectorStore(tmp).query(queries, n_results=3)
+            for mode in ('float16', 'int8'):
+                store = NumpyVectorStore(tmp, quantization=mode)  # Quantized copy built from vectors.f32
+                self.assertEqual(store.codes.shape, (store.rows, 32))
+                self.assertLess(store.index_bytes(), store.matrix.nbytes)
+                result = store.query(queries, n_results=3)
+                self.assertEqual(result['ids'], exact['ids'])
+                np.testing.assert_allclose(result['distances'], exact['distances'], atol=1e-5)
+
+                store.upsert(['new'], [vectors[0].tolist()], None, None)
+                self.assertEqual(store.codes.shape[0], store.rows)
+                store.delete(['new'])
+
+    def test_reindex_embeddings_resume_and_swap(self):
+        """Test paged re-embedding checkpoints, resumes after a failure and swaps the active collection"""
+        import tempfile
+        from unittest import mock
+        from app import reindex
+        from app.rag_pipeline import CertificateRAG
+        from app.vector_store import active_collection
+
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch.dict(os.environ, {'VECTOR_STORE_PATH': tmp, 'AZURE_OPENAI_API_KEY': ''}), \
+             mock.patch('app.vector_store.VECTOR_STORE_BACKEND', 'numpy'):
+            rag = CertificateRAG()
+            for i in range(7):
+                rag.ingest_certificate({'doc_id': f"cert_{i}", 'fields': {'issuer': 'IEEE'}, 'final_status': 'Trusted'})
+            self.assertEqual(rag.store.get(ids=['cert_0'])['metadatas'][0]['embedding_model'], 'fallback')
+
+            # Fail on the second page: first page stays checkpointed, queries still use the old collection
+            real_copy = reindex._copy_records
+            calls = []
+            def flaky_copy(*args):
+                calls.append(1)
+                if len(calls) == 2:
+                    raise RuntimeError("embedding outage")
+                return real_copy(*args)
+            with mock.patch.object(reindex, '_copy_records', side_effect=flaky_copy):
+                with self.assertRaises(RuntimeError):
+                    reindex.reindex_collection(rag, model='embed-v2', page_size=3, batch_size=2)
+            self.assertEqual(reindex.load_checkpoint(tmp)['offset'], 3)
+            self.assertEqual(active_collection(tmp), 'certificates')
+
+            rag.ingest_certificate({'doc_id': 'cert_new', 'fields': {'issuer': 'IEEE'}, 'final_status': 'Trusted'})
+            summary = reindex.reindex_collection(rag, model='embed-v2', page_size=3, batch_size=2)
+            self.assertEqual(summary['copied'], 8)
+            self.assertEqual(active_collection(tmp), summary['target'])
+            self.assertIsNone(reindex.load_checkpoint(tmp))
+
+            # The running RAG instance follows the swap
+            self.assertEqual(len(rag.query("IEEE", n_results=10)['ids'][0]), 8)
+            self.assertEqual(rag.store.name, summary['target'])
+            self.assertEqual(rag.store.get(ids=['cert_new'])['metadatas'][0]['reindexed_at'][:4],
+                             str(datetime.now().year))
+
+    def test_streaming_intake_sources_and_backpressure(self):
+        """Test lazy directory/glob/CSV/stdin sources and bounded concurrent processing"""
+        import io
+        import json
+        import tempfile
+        import threading
+        from app import intake
+
+        with tempfile.TemporaryDirectory(dir='data') as tmp:
+            for name in ('b.txt', 'a.pdf', 'skip.docx', os.path.join('sub', 'c.png')):
+                path = os.path.join(tmp, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                open(path, 'w').close()
+            csv_path = os.path.join(tmp, 'list.csv')
+            with open(csv_path, 'w') as f:
+                f.write("x.pdf\n\n y.png \n")
+
+            names = [os.path.basename(p) for p in intake.iter_source(tmp)]
+            self.assertEqual(names, ['a.pdf', 'b.txt', 'c.png'])
+            self.assertEqual(sorted(os.path.basename(p) for p in intake.iter_source(os.path.join(tmp, '*.txt'))), ['b.txt'])
+            self.assertEqual(list(intake.iter_source(csv_path)), ['x.pdf', 'y.png'])
+            self.assertEqual(list(intake.iter_lines(io.StringIO("p1\n# comment\n\np2\n"))), ['p1', 'p2'])
+
+            # Items are pulled lazily: never more than 2 x concurrency ahead of the workers
+            pulled, in_flight, peak = [0], [0], [0]
+            lock = threading.Lock()
+            def source():
+                for i in range(200):
+                    pulled[0] += 1
+                    yield i
+            def work(i):
+                with lock:
+                    in_flight[0] += 1
+                    peak[0] = max(peak[0], in_flight[0])
+                    self.assertLessEqual(pulled[0] - i, 8 + 1)
+                time.sleep(0.001)
+                with lock:
+                    in_flight[0] -= 1
+                if i == 7:
+                    raise ValueError("bad file")
+                return i * 2
+            results = dict(intake.run_bounded(work, source(), concurrency=4))
+            self.assertEqual(len(results), 200)
+            self.assertIsInstance(results[7], ValueError)
+            self.assertEqual(results[199], 398)
+            self.assertLessEqual(peak[0], 4)
+
+            out = os.path.join(tmp, 'out.json')
+            with intake.JsonArrayWriter(out, json.dumps) as writer:
+                for i in range(3):
+                    writer.write({'n': i})
+            with open(out) as f:
+                self.assertEqual(json.load(f), [{'n': 0}, {'n': 1}, {'n': 2}])
+
+            import batch_processor
+            from unittest import mock
+            from app import issuer_index
+            connect = issuer_index.connect
+            db = os.path.join(tmp, 'index.db')
+            with mock.patch.object(issuer_index, 'connect', lambda: connect(db)):
+                # A source rejected mid-run leaves the previous output in place
+                batch_processor.process_batch(os.path.join(tmp, 'outside_data.csv'), output_file=out)
+                with open(out) as f:
+                    self.assertEqual(json.load(f), [{'n': 0}, {'n': 1}, {'n': 2}])
+                self.assertFalse(os.path.exists(out + '.tmp'))
+
+                # Batch results are recorded in the issuer index, like /upload results
+                from app.records import CertificateResult
+                result = lambda path: CertificateResult.from_dict(
+                    {'doc_id': path, 'fields': {'issuer': 'IEEE'}, 'final_status': 'Verified'})
+                with mock.patch.object(batch_processor, 'process_single_file', side_effect=result):
+                    batch_processor.process_batch(['c1.pdf', 'c2.pdf'], output_file=out)
+            conn = connect(db)
+            try:
+                self.assertEqual(sorted(d for d, _ in issuer_index.certificates_for_issuers(conn, ['IEEE'])), ['c1.pdf', 'c2.pdf'])
+            finally:
+                conn.close()
+
+    def test_result_records_and_redacted_view(self):
+        """Test typed result records keep the JSON shape and redact through a view"""
+        import io
+        import json
+        from app.records import CertificateResult, RedactedView, dumps, loads, write_jsonl, iter_jsonl
+        from app.security import redact_pii
+
+        legacy = {
+            'doc_id': 'cert_1',
+            'fields': {'issuer': 'IEEE', 'certificate_number': 'IE-2024-001', 'issued_date': '2024-01-15',
+                       'expiry_date': '2026-01-15', 'subject': 'Networking'},
+            'confidence': {'issuer': 0.97, 'certificate_number': 0.95, 'issued_date': 0.95,
+                           'expiry_date': 0.95, 'subject': 0.9},
+            'confidence_flags': [],
+            'validation': {'issued_date_valid': True, 'expiry_status': 'valid', 'dates_consistent': True},
+            'issuer_validation': {'issuer': 'IEEE', 'is_trusted': True, 'status': 'Valid Issuer'},
+            'external_verification': None,
+            'final_status': 'Verified',
+        }
+        record = CertificateResult.from_dict(legacy)
+        self.assertEqual(record.to_dict(), legacy)
+        self.assertEqual(json.loads(dumps(record)), legacy)
+        self.assertNotIn(' ', dumps(record.confidence))  # Compact encoding
+
+        view = RedactedView(record)
+        self.assertEqual(view.to_dict()['fields'], redact_pii(legacy['fields']))
+        self.assertEqual(view.final_status, 'Verified')
+        self.assertEqual(record.fields.certificate_number, 'IE-2024-001')  # Source record untouched
+
+        buf = io.StringIO()
+        self.assertEqual(write_jsonl(buf, [record, view]), 2)
+        buf.seek(0)
+        restored = list(iter_jsonl(buf, CertificateResult))
+        self.assertEqual(restored[0], record)
+        self.assertEqual(restored[1].fields.subject, 'Ne***REDACTED***')
+        self.assertEqual(loads('{"a":1}'), {'a': 1})
+
+    def test_incremental_issuer_reverification(self):
+        """Test only certificates of added/removed trusted issuers are re-scored and updated"""
+        import json
+        import tempfile
+        from unittest import mock
+        from app import date_validation, issuer_index
+        from app.deadline import DEADLINE_FLAG
+
+        def cert(doc_id, issuer, status):
+            return {'doc_id': doc_id,
+                    'fields': {'issuer': issuer, 'certificate_number': 'X-1', 'issued_date': '2024-01-15',
+                               'expiry_date': '2099-01-15', 'subject': 'Networking'},
+                    'confidence': {'issuer': 0.95, 'certificate_number': 0.95, 'issued_date': 0.95,
+                                   'expiry_date': 0.95, 'subject': 0.95},
+                    'validation': {'issued_date_valid': True, 'expiry_status': 'valid', 'dates_consistent': True},
+                    'issuer_validation': {'issuer': issuer, 'is_trusted': status == 'Verified',
+                                          'status': 'Valid Issuer' if status == 'Verified' else 'Untrusted Issuer'},
+                    'final_status': status}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            trusted_file = os.path.join(tmp, 'trusted.json')
+            def write_trusted(names):
+                with open(trusted_file, 'w') as f:
+                    json.dump({'trusted_issuers': names}, f)
+                os.utime(trusted_file, (time.time() + len(names), time.time() + len(names)))
+            write_trusted(['Old Academy', 'IEEE'])
+
+            with mock.patch.object(date_validation, 'TRUSTED_ISSUERS_FILE', trusted_file):
+                conn = issuer_index.connect(os.path.join(tmp, 'index.db'))
+                issuer_index.record_certificates(conn, [
+                    cert('a1', 'Old Academy', 'Verified'), cert('a2', 'Old Academy', 'Verified'),
+                    cert('n1', 'New Institute', 'Manual Review Required'), cert('i1', 'IEEE', 'Verified'),
+                    dict(cert('t1', 'New Institute', 'Manual Review Required'), confidence_flags=[DEADLINE_FLAG])])
+                self.assertEqual(issuer_index.reverify(conn)['checked'], 0)  # No list change yet
+
+                write_trusted(['IEEE', 'New Institute'])
+                rag = mock.Mock()
+                with mock.patch('builtins.print'):
+                    summary = issuer_index.reverify(conn, rag=rag)
+                self.assertEqual(summary['added'], ['New Institute'])
+                self.assertEqual(summary['removed'], ['Old Academy'])
+                self.assertEqual(summary['checked'], 4)  # IEEE certificates are never touched
+                self.assertEqual(summary['changed'], 4)  # t1 only gets the new issuer validation
+                self.assertEqual(summary['transitions'], {'Verified -> Manual Review Required': 2,
+                                                          'Manual Review Required -> Verified': 1,
+                                                          'Manual Review Required -> Manual Review Required': 1})
+                self.assertEqual(sorted(c['doc_id'] for c in rag.ingest_many.call_args[0][0]), ['a1', 'a2', 'n1', 't1'])
+
+                statuses = dict(conn.execute("SELECT doc_id, final_status FROM certificates"))
+                self.assertEqual(statuses, {'a1': 'Manual Review Required', 'a2': 'Manual Review Required',
+                                            'n1': 'Verified', 'i1': 'Verified',
+                                            't1': 'Manual Review Required'})  # Partial extraction: never verified
+                self.assertEqual(issuer_index.reverify(conn)['checked'], 0)  # Snapshot advanced
+                conn.close()
+
+    def test_near_duplicate_detection(self):
+        """Test MinHash/LSH flags template clones and only reuses extraction when no field line changed"""
+        from unittest import mock
+        from app import near_duplicate
+        from app.near_duplicate import NearDuplicateIndex, can_reuse_extraction
+
+        template = ("CERTIFICATE OF COMPLETION\nThis is to certify that\n{name}\n"
+                    "has successfully completed the Advanced Python Programming course\n"
+                    "Issued by: Microsoft Training\nCertificate No: {number}\n"
+                    "Issued on: 15 January 2024\nValid until: 15 January 2027\n")
+        original = template.format(name='Jane Doe', number='MS-2024-001')
+        output = {'issuer': {'value': 'Microsoft Training', 'confidence': 0.97},
+                  'certificate_number': {'value': 'MS-2024-001', 'confidence': 0.95},
+                  'subject': {'value': 'Advanced Python Programming', 'confidence': 0.9}}
+
+        index = NearDuplicateIndex(threshold=0.8)
+        index.add('orig', original, output)
+        for i in range(200):  # Unrelated documents must not become candidates
+            index.add(f'other{i}', f"Invoice {i} for consulting services rendered in region {i * 7}")
+
+        renamed = template.format(name='John Smith', number='MS-2024-001')
+        renumbered = template.format(name='Jane Doe', number='MS-2024-977')
+        self.assertEqual([m[0] for m in index.query(renamed)], ['orig'])
+        self.assertEqual([m[0] for m in index.query(renumbered)], ['orig'])
+        self.assertEqual(index.query("Quarterly sales report for the northern region"), [])
+        self.assertEqual(index.query(original, exclude='orig'), [])
+
+        # Cheap diff check: a new recipient is safe, a new certificate number is not
+        self.assertTrue(can_reuse_extraction(original, renamed, output))
+        self.assertFalse(can_reuse_extraction(original, renumbered, output))
+
+        small = NearDuplicateIndex(max_docs=2)
+        for i in range(3):
+            small.add(f'd{i}', f"document number {i} " * 5)
+        small.add('d2', "document number 2 " * 5)  # Re-adding replaces rather than duplicates
+        self.assertEqual(len(small), 2)
+        self.assertIsNone(small.entry('d0'))
+
+        with mock.patch.object(near_duplicate, '_index', index):
+            match, reused = near_duplicate.check('copy', renamed, reuse=True)
+            self.assertEqual(match['doc_id'], 'orig')
+            self.assertTrue(match['reused_extraction'])
+            self.assertEqual(reused, output)
+            self.assertIsNot(reused, output)
+            match, reused = near_duplicate.check('copy', renumbered, reuse=True)
+            self.assertFalse(match['reused_extraction'])
+            self.assertIsNone(reused)
+
+    def test_image_dedup_before_vision_ocr(self):
+        """Test dHash survives resize/noise, BK-tree radius search, and OCR text reuse only for confirmed matches"""
+        import json
+        import tempfile
+        import numpy as np
+        from unittest import mock
+        from app import image_dedup, ocr_module
+        from app.image_dedup import dhash_array, hamming, signature_array, BKTree, ImageOcrCache
+
+        rng = np.random.default_rng(0)
+        base = rng.integers(0, 256, (60, 80)).astype(float)
+        image = np.kron(base, np.ones((4, 4)))  # 240x320 "photo"
+        resized = np.kron(base, np.ones((8, 8)))  # Same picture at twice the size
+        noisy = np.clip(image + rng.normal(0, 4, image.shape) + 10, 0, 255)  # Re-compression + brightness
+        other = rng.integers(0, 256, (240, 320)).astype(float)
+        h = dhash_array(image)
+        self.assertLessEqual(hamming(h, dhash_array(resized)), 4)
+        self.assertLessEqual(hamming(h, dhash_array(noisy)), 6)
+        self.assertGreater(hamming(h, dhash_array(other)), 15)
+
+        tree = BKTree()
+        values = [int(v) for v in rng.integers(0, 2 ** 63, 500, dtype=np.int64)]
+        for v in values:
+            tree.add(v)
+        query = values[7] ^ 0b101  # Two bits away from a stored hash
+        brute = sorted((hamming(query, v), v) for v in set(values) if hamming(query, v) <= 10)
+        self.assertEqual(tree.search(query, 10), brute)
+        self.assertEqual(tree.search(query, 10)[0], (2, values[7]))
+
+        def certificate(name_seed):
+            # One template (border, fixed text lines) with a per-person name line
+            img = np.full((300, 420), 235.0)
+            img[10:15, :] = img[-15:-10, :] = img[:, 10:15] = img[:, -15:-10] = 40
+            for y, seed in ((50, 1), (80, 2), (210, 3), (240, name_seed + 100)):
+                words = np.random.default_rng(seed)
+                x = 50
+                while x < 370:
+                    w = int(words.integers(4, 15))
+                    img[y:y + 11 + 9 * (seed > 100), x:x + w] = words.integers(20, 90)
+                    x += w + int(words.integers(2, 8))
+            return img
+
+        alice, bob = certificate(1), certificate(2)
+        recompressed = np.clip(alice + rng.normal(0, 6, alice.shape) + 8, 0, 255)
+        sig = signature_array(alice)
+        self.assertLessEqual(hamming(sig.hash, signature_array(bob).hash), 6)  # dHash alone cannot tell them apart
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'hashes.jsonl')
+            cache = ImageOcrCache(path, max_distance=64)
+            cache.add(sig, 'Cert1', 'CERTIFICATE text', sha256='ab' * 32)
+            self.assertEqual(cache.lookup(signature_array(recompressed)),
+                             {'doc_id': 'Cert1', 'text': 'CERTIFICATE text', 'sha256': 'ab' * 32,
+                              'distance': hamming(sig.hash, signature_array(recompressed).hash),
+                              'exact': False, 'confirmed': True})
+            self.assertFalse(cache.lookup(signature_array(bob))['confirmed'])  # Same template, other person
+            self.assertFalse(cache.lookup(signature_array(alice[::2, ::2]))['confirmed'])  # Other size: flag only
+            # On disk: no OCR text, doc_id redacted like the extraction log
+            with open(path) as f:
+                stored = json.loads(f.read())
+            self.assertNotIn('text', stored)
+            self.assertEqual(stored['doc_id'], 'Ce***REDACTED***')
+            reloaded = ImageOcrCache(path, max_distance=64)  # Matches survive restarts, text does not
+            self.assertEqual(reloaded.lookup(None, 'ab' * 32), {'doc_id': 'Ce***REDACTED***', 'text': None,
+                                                               'sha256': 'ab' * 32, 'distance': 0,
+                                                               'exact': True, 'confirmed': True})
+            self.assertTrue(reloaded.lookup(signature_array(recompressed))['confirmed'])
+            self.assertIsNone(ImageOcrCache(path, max_distance=6).lookup(signature_array(other)))
+            reloaded.add(sig, 'Cert1', 'CERTIFICATE text', sha256='ab' * 32)  # Next OCR refills the text
+            self.assertEqual(reloaded.lookup(None, 'ab' * 32)['text'], 'CERTIFICATE text')
+            self.assertEqual(len(reloaded), 1)
+
+            data_dir = os.path.join(os.path.dirname(__file__), '..', 'data')
+            cert, copy, other = (os.path.abspath(os.path.join(data_dir, name))
+                                 for name in ('Cert8.png', 'Cert9.png', 'Cert1.jpeg'))
+            signatures = {cert: sig, copy: signature_array(recompressed), other: signature_array(bob)}
+            with mock.patch.object(image_dedup, '_cache', ImageOcrCache(os.path.join(tmp, 'ocr.jsonl'))), \
+                    mock.patch.object(ocr_module, 'validate_secure_path', os.path.abspath), \
+                    mock.patch.object(ocr_module, 'image_hash', side_effect=signatures.get), \
+                    mock.patch.object(ocr_module, 'extract_with_vision', return_value='OCR TEXT') as vision, \
+                    mock.patch('builtins.print'):
+                self.assertEqual(ocr_module.extract_text_from_file(cert), ('OCR TEXT', True))
+                self.assertEqual(ocr_module.extract_text_from_file(cert), ('OCR TEXT', True))
+                self.assertEqual(vision.call_count, 1)  # Same bytes never reached Vision OCR again
+                # Re-encoded copy: confirmed by size and thumbnail, OCR text reused
+                self.assertEqual(ocr_module.extract_text_from_file(copy), ('OCR TEXT', True))
+                self.assertEqual(vision.call_count, 1)
+                # Same template, other person: close dHash but the thumbnail differs, OCR runs
+                ocr_module.extract_text_from_file(other)
+                self.assertEqual(vision.call_count, 2)
+
+        # Identical OCR text also reuses the earlier extraction, even with NEAR_DUP_REUSE off
+        from app import near_duplicate
+        output = {'issuer': {'value': 'IEEE', 'confidence': 0.97}}
+        with mock.patch.object(near_duplicate, '_index', near_duplicate.NearDuplicateIndex()):
+            near_duplicate.register('Cert1', 'OCR TEXT of the certificate', output)
+            match, reused = near_duplicate.check('Cert3', 'OCR TEXT of the certificate', reuse=False)
+        self.assertEqual((match['doc_id'], match['similarity'], reused), ('Cert1', 1.0, output))
+
+    def test_upload_deadline_propagation(self):
+        """Test the request deadline caps call timeouts, cancels votes and yields a Manual Review result"""
+        import httpx
+        import openai
+        from unittest import mock
+        import batch_processor
+        from app import field_extraction
+        from app.deadline import Deadline, DeadlineExceeded, DEADLINE_FLAG
+        from app.rate_limiter import RateLimiter
+
+        deadline = Deadline(5)
+        self.assertLessEqual(deadline.timeout(30), 5)
+        self.assertEqual(deadline.timeout(2), 2)
+        with self.assertRaises(DeadlineExceeded):
+            Deadline(0).check('ocr')
+
+        # Each attempt's timeout is sized from the remaining budget; retries stop at the deadline
+        seen = []
+        limiter = RateLimiter(max_retries=10, backoff_base=0.05)
+        limiter.call('test_call', lambda **kw: seen.append(kw['timeout']), timeout=30, deadline=Deadline(3))
+        self.assertLessEqual(seen[0], 3)
+        timeout_error = openai.APITimeoutError(request=httpx.Request('POST', 'https://example.invalid'))
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            limiter.call('test_call', mock.Mock(side_effect=timeout_error), timeout=30, deadline=Deadline(1.3))
+        self.assertLess(time.monotonic() - start, 1.3)
+
+        # Outstanding votes are cancelled; the votes gathered so far still form the result
+        vote = {f: {'value': v, 'confidence': 0.95} for f, v in [
+            ('issuer', 'IEEE'), ('certificate_number', 'IE-1'), ('issued_date', '2024-01-15'),
+            ('expiry_date', '2026-01-15'), ('subject', None)]}
+        with mock.patch.object(field_extraction, '_extract_single',
+                               side_effect=[vote, DeadlineExceeded('budget spent')]) as single, \
+                mock.patch('builtins.print'):
+            out = field_extraction.extract_with_azure("Certificate text", deadline=Deadline(5))
+        self.assertEqual(single.call_count, 2)
+        self.assertTrue(out['_deadline_exceeded'])
+        self.assertEqual(out['_voting_debug']['calls_spent'], 1)
+        self.assertEqual(out['issuer']['value'], 'IEEE')
+
+        # Partial or empty results come back flagged for manual review, never auto-verified
+        trusted = dict(vote, subject={'value': 'Networking', 'confidence': 0.95}, _deadline_exceeded=True)
+        cert = os.path.join(os.path.dirname(__file__), '..', 'data', 'sample_certificate.txt')
+        with mock.patch.object(batch_processor, 'log_extraction'), mock.patch('builtins.print'), \
+                mock.patch('app.ocr_module.validate_secure_path', os.path.abspath), \
+                mock.patch.object(batch_processor.near_duplicate, 'check', return_value=(None, None)), \
+                mock.patch.object(batch_processor.near_duplicate, 'register') as register:
+            with mock.patch.object(batch_processor, 'extract_with_fast_path', return_value=trusted):
+                result = batch_processor.process_single_file(cert, deadline=Deadline(5))
+            self.assertEqual(result.final_status, 'Manual Review Required')
+            self.assertIn(DEADLINE_FLAG, result.confidence_flags)
+            register.assert_not_called()  # Partial extractions are not offered for reuse
+
+            with mock.patch.object(batch_processor, 'extract_text_from_file', side_effect=DeadlineExceeded('ocr')):
+                result = batch_processor.process_single_file(cert, deadline=Deadline(5))
+            self.assertEqual((result.doc_id, result.final_status), ('sample_certificate', 'Manual Review Required'))
+            self.assertIn(DEADLINE_FLAG, result.confidence_flags)
+
+    def test_request_profiling(self):
+        """Test the sampler captures hot frames (pool threads too) and reports are written, pruned and opt-in only"""
+        import contextlib
+        import io
+        import tempfile
+        from unittest import mock
+        from app import profiling
+        from app.profiling import SamplingProfiler, RequestProfile
+
+        def hot_loop(seconds):
+            end = time.perf_counter() + seconds
+            while time.perf_counter() < end:
+                sum(range(200))
+
+        sampler = SamplingProfiler(interval=0.002).start()
+        hot_loop(0.2)
+        sampler.stop()
+        self.assertGreater(sampler.samples, 10)
+        self.assertTrue(any('hot_loop' in label for label, _, _ in sampler.top_functions(3)))
+        first = sampler.collapsed().splitlines()[0]
+        self.assertRegex(first, r'^\S.*;.* \d+$')  # folded 'a;b;c count' format
+
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+            for mode, ext in (('sampling', '.collapsed'), ('deterministic', '.prof')):
+                profile = RequestProfile('upload_file', mode=mode, directory=tmp).start()
+                hot_loop(0.05)
+                base = profile.finish()
+                self.assertTrue(os.path.exists(base + ext))
+                with open(base + '.txt') as f:
+                    self.assertIn('hot_loop', f.read())
+            profiling._prune(tmp, keep=1)
+            self.assertEqual(len(os.listdir(tmp)), 2)  # Newest summary + its .prof
+
+        # Work handed to a thread pool shows up, not just the request thread waiting on it
+        from concurrent.futures import ThreadPoolExecutor
+        from app.intake import run_bounded
+
+        def pooled_work(seconds):
+            hot_loop(seconds)
+            return seconds
+
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+            profile = RequestProfile('upload_batch', mode='sampling', directory=tmp).start()
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                list(pool.map(pooled_work, [0.1, 0.1]))
+            base = profile.finish()
+            with open(base + '.collapsed') as f:
+                stacks = f.read()
+            self.assertRegex(stacks, r'(?m)^\[ThreadPoolExecutor-[^;]*\];.*pooled_work.*hot_loop')
+            self.assertNotIn('profile-sampler', stacks)
+
+            for run in (lambda: [r for _, r in run_bounded(pooled_work, [0.05, 0.05], concurrency=2)],
+                        lambda: list(ThreadPoolExecutor(2).map(profiling.propagate(pooled_work), [0.05]))):
+                profile = RequestProfile('upload_batch', mode='deterministic', directory=tmp).start()
+                run()
+                base = profile.finish()
+                with open(base + '.txt') as f:
+                    report = f.read()
+                self.assertIn('pooled_work', report)
+                self.assertIn('hot_loop', report)
+            self.assertIs(profiling.propagate(pooled_work), pooled_work)  # No active profile: unchanged
+
+        # Off by default; the header only counts when explicitly enabled
+        self.assertFalse(profiling.should_profile('1'))
+        with mock.patch.object(profiling, 'PROFILE_HEADER_ENABLED', True):
+            self.assertTrue(profiling.should_profile('1'))
+            self.assertFalse(profiling.should_profile('0'))
+        with mock.patch.object(profiling, 'PROFILE_SAMPLE_RATE', 1.0):
+            self.assertTrue(profiling.should_profile())
+        self.assertIsNone(profiling.start_request_profile('query_rag'))
+
+    def test_batch_question_answering(self):
+        """Test answer_many uses one embedding call and one retrieval, answers concurrently and keeps order"""
+        import random
+        import tempfile
+        from unittest import mock
+        from benchmarks.fake_azure import FakeConfig, fake_backend
+        from app.rag_pipeline import CertificateRAG, EMBEDDING_FAILED_ANSWER
+
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch.dict(os.environ, {'VECTOR_STORE_PATH': tmp}), \
+             mock.patch('app.vector_store.VECTOR_STORE_BACKEND', 'numpy'), \
+             fake_backend(FakeConfig(latency=0.05)) as config:
+            rag = CertificateRAG()
+            rag.ingest_many([{'doc_id': f"cert_{i}", 'fields': {'issuer': issuer}, 'final_status': 'Verified'}
+                             for i, issuer in enumerate(['IEEE', 'AWS Training', 'Oracle University'])])
+            self.assertEqual(rag.store.count(), 3)
+
+            # A failed batch falls back to one call per text; texts that still fail are skipped, not zeroed
+            embed = rag.get_embeddings_batch
+            def flaky(texts):
+                if len(texts) > 1 or 'cert_bad' in texts[0]:
+                    raise RuntimeError('embedding service unavailable')
+                return embed(texts)
+            with mock.patch.object(rag, 'get_embeddings_batch', side_effect=flaky), mock.patch('builtins.print'):
+                summary = rag.ingest_many([{'doc_id': 'cert_ok', 'fields': {}}, {'doc_id': 'cert_bad', 'fields': {}}])
+            self.assertEqual((summary['doc_ids'], summary['failed']), (['cert_ok'], ['cert_bad']))
+            self.assertEqual(rag.store.count(), 4)
+
+            questions = [f"Who issued certificate cert_{i % 3}? ({i})" for i in range(20)]
+            embeddings_before = config.calls['embeddings']
+
+            with mock.patch.object(rag.store, 'query', wraps=rag.store.query) as query:
+                start = time.monotonic()
+                answers = rag.answer_many(questions, concurrency=8)
+                elapsed = time.monotonic() - start
+            self.assertEqual(len(answers), 20)
+            self.assertEqual(config.calls['embeddings'] - embeddings_before, 1)
+            self.assertEqual(query.call_count, 1)
+            self.assertEqual(config.calls['chat'], 20)
+            self.assertLess(elapsed, 20 * 0.05 * 0.6)  # Well under the sequential time
+
+            # Answers line up with their questions even when they finish out of order
+            def slow_answer(question, docs):
+                time.sleep(random.uniform(0, 0.02))
+                return f"{question}|{len(docs)}"
+            with mock.patch.object(rag, '_answer_from_documents', side_effect=slow_answer):
+                self.assertEqual(rag.answer_many(questions, n_results=2), [f"{q}|2" for q in questions])
+            self.assertEqual(rag.answer_many([]), [])
+
+            # A question that cannot be embedded gets an error answer and is never searched with a zero vector
+            def flaky_questions(texts):
+                if len(texts) > 1 or 'BAD' in texts[0]:
+                    raise RuntimeError('embedding service unavailable')
+                return embed(texts)
+            mixed = ['Who issued cert_0?', 'BAD question', 'Who issued cert_1?']
+            with mock.patch.object(rag, 'get_embeddings_batch', side_effect=flaky_questions), \
+                    mock.patch.object(rag, '_answer_from_documents', side_effect=slow_answer) as answer, \
+                    mock.patch.object(rag.store, 'query', wraps=rag.store.query) as query, \
+                    mock.patch('builtins.print'):
+                self.assertEqual(rag.answer_many(mixed, n_results=2),
+                                 ['Who issued cert_0?|2', EMBEDDING_FAILED_ANSWER, 'Who issued cert_1?|2'])
+                self.assertEqual(len(query.call_args.kwargs['query_embeddings']), 2)
+                self.assertEqual(answer.call_count, 2)
+                self.assertEqual(rag.answer_many(['BAD one', 'BAD two']), [EMBEDDING_FAILED_ANSWER] * 2)
+                self.assertEqual(query.call_count, 1)
+
+    def test_compact_rag_context(self):
+        """Test the RAG context table drops filler, merges duplicates and respects the token budget"""
+        from app.rag_context import build_context, parse_record
+        from app.rag_pipeline import CertificateRAG
+        from app.text_windows import estimate_tokens
+
+        rag = CertificateRAG.__new__(CertificateRAG)  # _searchable_text needs no client or store
+        def doc(i, number, issuer='IEEE', expiry=None):
+            return rag._searchable_text({'doc_id': f"cert_{i}", 'final_status': 'Verified', 'fields': {
+                'issuer': issuer, 'subject': 'Networking', 'issued_date': '2024-01-15',
+                'expiry_date': expiry, 'certificate_number': number}})
+
+        self.assertEqual(parse_record(doc(1, None)), {'id': 'cert_1', 'issuer': 'IEEE', 'subject': 'Networking',
+                                                      'issued': '2024-01-15', 'status': 'Verified'})
+        docs = [doc(0, 'IE-1'), doc(1, 'IE-2'), doc(2, 'ie-1'), doc(3, 'AWS-9', 'AWS Training', '2027-01-01')]
+        context, stats = build_context(docs)
+        lines = context.splitlines()
+        self.assertEqual(lines[0], 'id | issuer | subject | issued | expires | number | status')
+        self.assertEqual(lines[1], 'cert_0, cert_2 | IEEE | Networking | 2024-01-15 | - | IE-1 | Verified')
+        self.assertEqual((stats['rows'], stats['duplicates'], stats['truncated']), (3, 1, 0))
+        self.assertNotIn('Unknown', context)
+        self.assertLess(stats['tokens'], stats['tokens_before'] / 3)
+
+        # Many retrieved records stay within the budget, most relevant first
+        many = [doc(i, f"IE-{i}") for i in range(50)]
+        context, stats = build_context(many, token_budget=120)
+        self.assertLessEqual(estimate_tokens(context), 120)
+        self.assertIn('cert_0 |', context)
+        self.assertEqual(stats['rows'] + stats['truncated'], 50)
+        self.assertEqual(build_context([]), ('', {'records': 0, 'rows': 0, 'duplicates': 0, 'truncated': 0,
+                                                  'tokens_before': 0, 'tokens': 0}))
+
+        # Free text that is not in the field format is still usable, cut to the budget
+        context, stats = build_context(["Some legacy note " * 200], token_budget=50)
+        self.assertTrue(context.startswith('text\nSome legacy note'))
+        self.assertLessEqual(stats['tokens'], 50)
+
+    def test_batch_upload_streams_progress(self):
+        """Test /upload/batch processes every file, streams SSE progress and bulk-ingests once"""
+        import importlib.util
+        import io
+        import json
+        import tempfile
+        from unittest import mock
+        import batch_processor
+        from benchmarks.fake_azure import FakeConfig, fake_backend
+
+        backend_dir = os.path.join(os.path.dirname(__file__), '..')
+        with open(os.path.join(backend_dir, 'data', 'sample_certificate.txt'), 'rb') as f:
+            certificate = f.read()
+
+        with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory() as uploads, \
+             mock.patch.dict(os.environ, {'VECTOR_STORE_PATH': tmp}), \
+             mock.patch('app.vector_store.VECTOR_STORE_BACKEND', 'numpy'), \
+             mock.patch('app.ocr_module.validate_secure_path', os.path.abspath), \
+             mock.patch.object(batch_processor, 'log_extraction'), mock.patch('builtins.print'), \
+             fake_backend(FakeConfig(latency=0.01)):
+            spec = importlib.util.spec_from_file_location('flask_app_under_test', os.path.join(backend_dir, 'app.py'))
+            flask_app = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(flask_app)
+            flask_app.UPLOAD_FOLDER = uploads
+            connect = flask_app.issuer_index.connect
+            # A profiled batch is only finished once the stream has done its work
+            profile = mock.Mock()
+            profile.finish.side_effect = lambda: self.assertTrue(ingest_many.called) or 'report'
+            with mock.patch.object(flask_app.issuer_index, 'connect', lambda: connect(os.path.join(tmp, 'i.db'))), \
+                 mock.patch.object(flask_app, 'start_request_profile', return_value=profile), \
+                 mock.patch.object(flask_app.rag, 'ingest_many', wraps=flask_app.rag.ingest_many) as ingest_many:
+                response = flask_app.app.test_client().post('/upload/batch', data={'files': [
+                    (io.BytesIO(certificate), 'cert_a.txt'),
+                    (io.BytesIO(certificate), 'cert_a.txt'),  # Same name twice is kept apart
+                    (io.BytesIO(b'grocery list: eggs, milk'), 'notes.txt'),
+                ]}, content_type='multipart/form-data')
+                body = response.get_data(as_text=True)
+
+            self.assertEqual(response.mimetype, 'text/event-stream')
+            events = [(block.split('\n')[0][len('event: '):], json.loads(block.split('\n')[1][len('data: '):]))
+                      for block in body.strip().split('\n\n')]
+            self.assertEqual([e for e, _ in events], ['start', 'progress', 'progress', 'progress', 'ingested', 'done'])
+            progress = [d for e, d in events if e == 'progress']
+            self.assertEqual(sorted(p['file'] for p in progress), ['cert_a.txt', 'cert_a_1.txt', 'notes.txt'])
+            self.assertEqual([p['done'] for p in progress], [1, 2, 3])
+            self.assertEqual(sorted(p['success'] for p in progress), [False, True, True])
+            self.assertEqual(events[-1][1], {'total': 3, 'succeeded': 2, 'failed': 1})
+            ingest_many.assert_called_once()
+            profile.finish.assert_called_once()
+            self.assertEqual(flask_app.rag.store.count(), 2)
+
+            self.assertEqual(flask_app.app.test_client().post('/upload/batch', data={}).status_code, 400)
+
+    def test_model_backend_record_replay(self):
+        """Test record mode captures model calls to a cassette and replay serves them back offline"""
+        import tempfile
+        from unittest import mock
+        import openai
+        from app import field_extraction, model_backend
+        from benchmarks.fake_azure import FakeConfig, fake_backend
+
+        text = "Issued By: IEEE\nCertificate Number: IEEE-77\nIssued On: 2024-01-05\nValid Until: 2026-01-05"
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch.dict(model_backend._cassettes, clear=True), \
+             mock.patch.object(model_backend, 'MODEL_CASSETTE_DIR', tmp):
+            with mock.patch.object(model_backend, 'MODEL_BACKEND', 'record'), \
+                 fake_backend(FakeConfig(latency=0.02, variety=0.5, seed=3)) as config:
+                recorded = [field_extraction._extract_single(text, temperature=0.7) for _ in range(3)]
+                vector = model_backend.get_client().embeddings.create(input=text, model='emb').data[0].embedding
+            self.assertEqual(config.calls['chat'], 3)
+            self.assertEqual(sorted(os.listdir(tmp)), ['chat.jsonl', 'embeddings.jsonl'])
+
+            model_backend._cassettes.clear()  # Fresh process: cassette loaded from disk
+            with mock.patch.object(model_backend, 'MODEL_BACKEND', 'replay'), \
+                 mock.patch.dict(os.environ, {'AZURE_OPENAI_API_KEY': ''}):
+                self.assertTrue(model_backend.available())
+                # Repeated identical votes come back in recording order
+                self.assertEqual([field_extraction._extract_single(text, temperature=0.7) for _ in range(3)], recorded)
+                client = model_backend.get_client()
+                self.assertEqual(client.embeddings.create(input=text, model='emb', timeout=5).data[0].embedding, vector)
+                with self.assertRaises(model_backend.CassetteMiss):
+                    client.embeddings.create(input="never recorded", model='emb')
+                with mock.patch.object(model_backend, 'MODEL_REPLAY_LATENCY', 1.0), \
+                     self.assertRaises(openai.APITimeoutError):
+                    client.embeddings.create(input=text, model='emb', timeout=0.001)
+            self.assertEqual(config.calls['chat'], 3)
+
+    def test_shared_document_features(self):
+        """Test a Document computes each text feature once and is shared across pipeline stages"""
+        from unittest import mock
+        from app import document as document_module, field_extraction, near_duplicate
+        from app.document import Document
+        from app.rule_extraction import extract_with_rules
+
+        filler = "\n".join("lorem ipsum dolor sit amet consectetur adipiscing elit" for _ in range(100))
+        text = ("CERTIFICATE OF COMPLETION\nThis is to certify that Jane Roe has completed the Networking course.\n"
+                "Certificate Number: IE-2024-7\nIssued By: IEEE\nIssued On: 2024-01-15\nValid Until: 2026-01-15\n" + filler)
+        doc = Document(text, doc_id='cert_a')
+        self.assertEqual(doc.keyword_hits['primary'], ('certificate', 'certify'))
+        self.assertEqual([text[s:e] for s, e in doc.date_spans], ['2024-01-15', '2026-01-15'])
+        self.assertEqual(doc.normalized, near_duplicate._normalize(text))
+
+        with mock.patch.object(document_module, 'find_relevant_windows',
+                               wraps=document_module.find_relevant_windows) as windows:
+            self.assertTrue(is_certificate('txt', doc))
+            rules = extract_with_rules(doc)
+            self.assertEqual(rules['expiry_date']['value'], '2026-01-15')
+            self.assertEqual(rules, extract_with_rules(text))
+
+            # Every vote, across both entry points, gets the same prompt string built once from the cached compaction
+            vote = {f: dict(rules[f], value=rules[f]['value'] or 'Networking') for f in rules}
+            with mock.patch.object(field_extraction, '_extract_single',
+                                   side_effect=[dict(vote, subject={'value': None, 'confidence': 0.0}), vote, vote, vote]) as single, \
+                    mock.patch('builtins.print'):
+                field_extraction.extract_with_azure(doc)
+                field_extraction.extract_batch_with_azure([('cert_a', doc)])
+            prompts = {id(call.kwargs['prompt']) for call in single.call_args_list}
+            self.assertEqual((single.call_count, len(prompts)), (4, 1))
+        self.assertEqual(windows.call_count, 1)
+
+        # Exact copies are matched by content hash; the signature is computed once per document
+        with mock.patch.object(near_duplicate, '_index', near_duplicate.NearDuplicateIndex()), \
+             mock.patch.object(near_duplicate, 'minhash_signature', wraps=near_duplicate.minhash_signature) as sig:
+            near_duplicate.register('cert_a', doc, rules)
+            copy = Document(text, doc_id='cert_b')
+            match, reused = near_duplicate.check('cert_b', copy)
+            near_duplicate.register('cert_b', copy, reused)
+        self.assertEqual(match, {'doc_id': 'cert_a', 'similarity': 1.0, 'reused_extraction': True})
+        self.assertEqual(sig.call_count, 2)
+
 if __name__ == '__main__':
     print("Running comprehensive system tests...")
     unittest.main()